@@ -1,8 +1,20 @@
+import errno
 import logging as pylog
+import os
+import signal
+import socket
+import time
 
+import eventlet
+import eventlet.event
+import eventlet.greenio
+import eventlet.wsgi
+
+import qonos.db
 from qonos.openstack.common import cfg
 from qonos.openstack.common.gettextutils import _
 import qonos.openstack.common.log as logging
+from qonos.openstack.common import service
 from qonos.openstack.common.wsgi import run_server
 
 LOG = logging.getLogger(__name__)
@@ -10,6 +22,16 @@ LOG = logging.getLogger(__name__)
 api_opts = [
     cfg.BoolOpt('daemonized', default=False),
     cfg.IntOpt('port', default=8080),
+    cfg.IntOpt('workers', default=1,
+               help=_('Number of API processes to fork, sharing one '
+                      'listening socket. More than one needs a database '
+                      'shared between processes, which the simple db '
+                      'api is not. SIGHUP replaces the processes without '
+                      'dropping requests.')),
+    cfg.IntOpt('drain_timeout', default=70,
+               help=_('Seconds a stopping API process waits for the '
+                      'requests in flight, including long polls for jobs, '
+                      'before closing their connections.')),
 ]
 
 CONF = cfg.CONF
@@ -23,6 +45,11 @@ class API(object):
     def run(self, run_once=False):
         LOG.debug(_('Starting qonos-api service'))
 
+        if CONF.api.workers > 1 and CONF.db_api == 'qonos.db.simple.api':
+            raise RuntimeError(_('The simple db api keeps its data in one '
+                                 'process, it cannot be used with more '
+                                 'than one API worker'))
+
         if CONF.api.daemonized:
             import daemon
             #NOTE(ameade): We need to preserve all open files for logging
@@ -32,6 +59,145 @@ class API(object):
                         hasattr(handler.stream, 'fileno')):
                     open_files.append(handler.stream)
             with daemon.DaemonContext(files_preserve=open_files):
-                run_server(self.app, CONF.api.port)
+                self._serve()
         else:
+            self._serve()
+
+    def _serve(self):
+        if CONF.api.workers <= 1:
             run_server(self.app, CONF.api.port)
+            return
+
+        sock = eventlet.listen(('0.0.0.0', CONF.api.port))
+        # NOTE: Connections opened while loading the app would be shared
+        # by every child, each child has to open its own.
+        db_api = qonos.db.get_api()
+        db_api.dispose_engine()
+        launcher = APILauncher()
+        launcher.launch_service(APIService(self.app, sock, db_api),
+                                workers=CONF.api.workers)
+        launcher.wait()
+
+
+class APIService(service.Service):
+    """Serves the API on a socket bound before forking.
+
+    Stopping closes the socket to new connections and lets the requests
+    in flight finish, for up to drain_timeout seconds.
+    """
+
+    def __init__(self, app, sock, db_api, threads=1000):
+        super(APIService, self).__init__()
+        self.app = app
+        self.sock = sock
+        self.db_api = db_api
+        self.pool = eventlet.GreenPool(threads)
+        self.server = None
+        self.acceptor = None
+        self.connections = {}
+        self.active = 0
+        self.stopped = eventlet.event.Event()
+
+    def start(self):
+        super(APIService, self).start()
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        logger = logging.getLogger('eventlet.wsgi.server')
+        self.server = eventlet.wsgi.Server(self.sock,
+                                           self.sock.getsockname(),
+                                           self._count_requests,
+                                           log=logging.WritableLogger(logger))
+        self.acceptor = eventlet.spawn(self._accept)
+
+    def _handle_reload(self, signo, frame):
+        eventlet.spawn_n(self.stop)
+
+    def _accept(self):
+        # NOTE: eventlet.wsgi.server shuts down every connection when it
+        # stops, including those with a request in flight, so connections
+        # are accepted here and only idle ones are closed on stop.
+        while True:
+            try:
+                client, address = self.sock.accept()
+            except socket.error as e:
+                if e.errno in (errno.EPIPE, errno.EBADF, errno.ECONNRESET):
+                    continue
+                raise
+            client.settimeout(self.server.socket_timeout)
+            connection = [address, client, eventlet.wsgi.STATE_IDLE]
+            self.connections[address] = connection
+            self.pool.spawn(self.server.process_request,
+                            connection).link(self._close, connection)
+
+    def _close(self, thread, connection):
+        self.connections.pop(connection[0], None)
+        eventlet.greenio.shutdown_safe(connection[1])
+        connection[1].close()
+
+    def _count_requests(self, environ, start_response):
+        self.active += 1
+        try:
+            return self.app(environ, start_response)
+        finally:
+            self.active -= 1
+
+    def stop(self):
+        """Stop accepting connections and finish the requests in flight.
+        """
+        if self.acceptor is None:
+            return
+        self.acceptor.kill()
+        self.acceptor = None
+
+        # Keep-alive connections close after their current response
+        for connection in self.connections.values():
+            connection[2] = eventlet.wsgi.STATE_CLOSE
+        deadline = time.time() + CONF.api.drain_timeout
+        while self.active and time.time() < deadline:
+            eventlet.sleep(0.1)
+        if self.active:
+            LOG.warn(_('Closing %d requests still in flight'), self.active)
+            for thread in list(self.pool.coroutines_running):
+                thread.kill()
+            # NOTE: Connections of killed requests are closed rather than
+            # reused in case they were left in a transaction.
+            self.db_api.dispose_engine()
+        for connection in self.connections.values():
+            eventlet.greenio.shutdown_safe(connection[1])
+        self.pool.waitall()
+        super(APIService, self).stop()
+        self.stopped.send()
+
+    def wait(self):
+        self.stopped.wait()
+
+
+class APILauncher(service.ProcessLauncher):
+    """Forks API processes, replacing them all on SIGHUP.
+
+    Replacements are started before the old processes are told to stop,
+    so the old ones finish their requests while the new ones accept.
+    """
+
+    def __init__(self):
+        super(APILauncher, self).__init__()
+        self.reload = False
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+    def _handle_reload(self, signo, frame):
+        self.reload = True
+
+    def _wait_child(self):
+        if self.reload:
+            self.reload = False
+            self._replace_children()
+        return super(APILauncher, self)._wait_child()
+
+    def _replace_children(self):
+        LOG.info(_('Caught SIGHUP, replacing %d children'),
+                 len(self.children))
+        for wrap in set(self.children.values()):
+            old_children = set(wrap.children)
+            for i in xrange(wrap.workers):
+                self._start_child(wrap)
+            for pid in old_children:
+                os.kill(pid, signal.SIGHUP)
@@ -0,0 +1,80 @@
+import urllib
+
+import webob.exc
+
+from qonos.api.v1 import job_waiters
+from qonos.openstack.common import cfg
+from qonos.openstack.common.gettextutils import _
+from qonos.openstack.common import wsgi
+
+
+CONF = cfg.CONF
+
+
+def get_pagination_limit(request):
+    """Returns the page size requested, capped at api_limit_max."""
+    limit = request.params.get('limit')
+    if limit is None:
+        return CONF.api_limit_max
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = -1
+    if limit < 1:
+        msg = _('limit param must be a positive integer')
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+
+    return min(limit, CONF.api_limit_max)
+
+
+def get_shard_args(request):
+    """Returns the shard and shard_count filter args of a list request."""
+    try:
+        shard = int(request.params.get('shard', 0))
+        shard_count = int(request.params['shard_count'])
+    except ValueError:
+        shard = shard_count = 0
+    if not 0 <= shard < shard_count:
+        msg = _('shard param must be at least 0 and below shard_count')
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+    return {'shard': shard, 'shard_count': shard_count}
+
+
+def get_pagination_args(request):
+    """Returns the limit and marker filter args of a list request."""
+    filter_args = {'limit': get_pagination_limit(request)}
+    if request.params.get('marker') is not None:
+        filter_args['marker'] = request.params['marker']
+    return filter_args
+
+
+def get_links(request, items, limit):
+    """Returns a next link for a full page of items, otherwise nothing."""
+    if not items or len(items) < limit:
+        return []
+
+    params = dict((k, unicode(v).encode('utf-8'))
+                  for k, v in request.params.iteritems())
+    params['marker'] = items[-1]['id']
+    params['limit'] = limit
+    href = '%s?%s' % (request.path_url, urllib.urlencode(params))
+    return [{'rel': 'next', 'href': href}]
+
+
+class Resource(wsgi.Resource):
+    """Runs each controller action in one db session and transaction.
+
+    Actions named in the controller's unscoped_actions, such as those
+    waiting for new jobs, use a session per db api call instead, so they
+    neither hold a connection while waiting nor read an old snapshot.
+    """
+
+    def execute_action(self, action, request, **action_args):
+        execute = super(Resource, self).execute_action
+        if action in getattr(self.controller, 'unscoped_actions', ()):
+            return execute(action, request, **action_args)
+
+        with job_waiters.held():
+            with self.controller.db_api.session_scope():
+                return execute(action, request, **action_args)
@@ -1,9 +1,9 @@
 import webob.exc
 
+from qonos.api.v1 import api_utils
 from qonos.common import exception
 from qonos.common import utils
 import qonos.db
-from qonos.openstack.common import wsgi
 from qonos.openstack.common.gettextutils import _
 
 
@@ -27,4 +27,4 @@ class JobMetadataController(object):
 
 def create_resource():
     """QonoS resource factory method"""
-    return wsgi.Resource(JobMetadataController())
+    return api_utils.Resource(JobMetadataController())
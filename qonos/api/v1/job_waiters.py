@@ -0,0 +1,70 @@
+import contextlib
+
+import eventlet
+from eventlet import corolocal
+from eventlet import event
+
+
+class JobWaiters(object):
+    """Wakes requests waiting for jobs of an action when one is created.
+
+    Only jobs created through this API process are seen, so waiters
+    should wait in short slices and check the database in between.
+    """
+
+    def __init__(self):
+        self._events = {}
+
+    def wait(self, action, timeout):
+        """Wait until a job for action is created or timeout passes.
+
+        Returns True if woken by a new job, False on timeout.
+        """
+        waiter = self._events.get(action)
+        if waiter is None:
+            waiter = self._events[action] = event.Event()
+
+        with eventlet.Timeout(timeout, False):
+            waiter.wait()
+            return True
+        return False
+
+    def notify(self, action):
+        """Wake every request waiting for a job of action."""
+        waiter = self._events.pop(action, None)
+        if waiter is not None:
+            waiter.send()
+
+
+_WAITERS = JobWaiters()
+_HELD = corolocal.local()
+
+
+def wait(action, timeout):
+    return _WAITERS.wait(action, timeout)
+
+
+def notify(action):
+    actions = getattr(_HELD, 'actions', None)
+    if actions is not None:
+        actions.add(action)
+    else:
+        _WAITERS.notify(action)
+
+
+@contextlib.contextmanager
+def held():
+    """Delay the notify() calls made inside until the block exits
+    without an exception, e.g. until the new jobs are committed.
+    """
+    if getattr(_HELD, 'actions', None) is not None:
+        yield
+        return
+
+    _HELD.actions = actions = set()
+    try:
+        yield
+    finally:
+        _HELD.actions = None
+    for action in actions:
+        _WAITERS.notify(action)
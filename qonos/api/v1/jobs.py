@@ -1,10 +1,11 @@
 import webob.exc
 
+from qonos.api.v1 import api_utils
+from qonos.api.v1 import job_waiters
 from qonos.common import exception
 from qonos.common import utils
 import qonos.db
 from qonos.openstack.common import timeutils
-from qonos.openstack.common import wsgi
 from qonos.openstack.common.gettextutils import _
 
 
@@ -14,9 +15,19 @@ class JobsController(object):
         self.db_api = db_api or qonos.db.get_api()
 
     def list(self, request):
-        jobs = self.db_api.job_get_all()
+        filter_args = api_utils.get_pagination_args(request)
+        try:
+            jobs = self.db_api.job_get_all(filter_args=filter_args)
+        except exception.NotFound:
+            msg = _('Marker %s could not be found.') % filter_args['marker']
+            raise webob.exc.HTTPBadRequest(explanation=msg)
         [utils.serialize_datetimes(job) for job in jobs]
-        return {'jobs': jobs}
+        links = api_utils.get_links(request, jobs, filter_args['limit'])
+        return {'jobs': jobs, 'jobs_links': links}
+
+    def _schedule_to_job_metadata(self, schedule):
+        return [{'key': meta['key'], 'value': meta['value']}
+                for meta in schedule['schedule_metadata']]
 
     def create(self, request, body):
         if (body is None or body.get('job') is None or
@@ -34,13 +45,61 @@ class JobsController(object):
         values['tenant_id'] = schedule['tenant_id']
         values['action'] = schedule['action']
         values['status'] = 'queued'
-        values['job_metadata'] = schedule['schedule_metadata']
+        values['job_metadata'] = self._schedule_to_job_metadata(schedule)
 
         job = self.db_api.job_create(values)
+        job_waiters.notify(job['action'])
         utils.serialize_datetimes(job)
 
         return {'job': job}
 
+    def create_batch(self, request, body):
+        if (body is None or
+                not isinstance(body.get('schedule_ids'), list)):
+            raise webob.exc.HTTPBadRequest()
+
+        schedule_ids = []
+        seen = set()
+        for schedule_id in body['schedule_ids']:
+            if not isinstance(schedule_id, basestring):
+                raise webob.exc.HTTPBadRequest()
+            if schedule_id not in seen:
+                seen.add(schedule_id)
+                schedule_ids.append(schedule_id)
+
+        schedules = self.db_api.schedule_get_by_ids(schedule_ids)
+        schedules = dict((s['id'], s) for s in schedules)
+
+        jobs_values = []
+        for schedule_id in schedule_ids:
+            schedule = schedules.get(schedule_id)
+            if schedule is None:
+                continue
+            jobs_values.append({
+                'schedule_id': schedule_id,
+                'tenant_id': schedule['tenant_id'],
+                'action': schedule['action'],
+                'status': 'queued',
+                'job_metadata': self._schedule_to_job_metadata(schedule),
+            })
+
+        jobs = self.db_api.job_create_many(jobs_values)
+        for action in set(job['action'] for job in jobs):
+            job_waiters.notify(action)
+        jobs = dict((job['schedule_id'], job) for job in jobs)
+
+        results = []
+        for schedule_id in schedule_ids:
+            job = jobs.get(schedule_id)
+            if job is None:
+                msg = _('Schedule %s could not be found.') % schedule_id
+                results.append({'schedule_id': schedule_id, 'error': msg})
+            else:
+                utils.serialize_datetimes(job)
+                results.append({'schedule_id': schedule_id, 'job': job})
+
+        return {'results': results}
+
     def get(self, request, job_id):
         try:
             job = self.db_api.job_get_by_id(job_id)
@@ -81,7 +140,7 @@ class JobsController(object):
         updated_at = timeutils.normalize_time(updated_at)
 
         try:
-            self.db_api.job_update(job_id, {'updated_at': updated_at})
+            self.db_api.job_updated_at_update(job_id, updated_at)
         except exception.NotFound:
             msg = _('Job %s could not be found.') % job_id
             raise webob.exc.HTTPNotFound(explanation=msg)
@@ -101,7 +160,7 @@ class JobsController(object):
             raise webob.exc.HTTPBadRequest()
 
         try:
-            self.db_api.job_update(job_id, {'status': status})
+            self.db_api.job_status_update(job_id, status)
         except exception.NotFound:
             msg = _('Job %s could not be found.') % job_id
             raise webob.exc.HTTPNotFound(explanation=msg)
@@ -109,4 +168,4 @@ class JobsController(object):
 
 def create_resource():
     """QonoS resource factory method"""
-    return wsgi.Resource(JobsController())
+    return api_utils.Resource(JobsController())
@@ -23,6 +23,16 @@ class API(wsgi.Router):
                        action='create',
                        conditions=dict(method=['POST']))
 
+        mapper.connect('/schedules/claim',
+                       controller=schedules_resource,
+                       action='claim_due',
+                       conditions=dict(method=['POST']))
+
+        mapper.connect('/schedules/next_run',
+                       controller=schedules_resource,
+                       action='recompute_next_run',
+                       conditions=dict(method=['POST']))
+
         mapper.connect('/schedules/{schedule_id}',
                        controller=schedules_resource,
                        action='get',
@@ -77,6 +87,11 @@ class API(wsgi.Router):
                        action='create',
                        conditions=dict(method=['POST']))
 
+        mapper.connect('/jobs/batch',
+                       controller=jobs_resource,
+                       action='create_batch',
+                       conditions=dict(method=['POST']))
+
         mapper.connect('/jobs/{job_id}',
                        controller=jobs_resource,
                        action='get',
@@ -146,6 +161,11 @@ class API(wsgi.Router):
                        action='get_next_job',
                        conditions=dict(method=['POST']))
 
+        mapper.connect('/workers/{worker_id}/heartbeats',
+                       controller=workers_resource,
+                       action='update_heartbeats',
+                       conditions=dict(method=['PUT']))
+
         super(API, self).__init__(mapper)
 
     @classmethod
@@ -1,9 +1,9 @@
 import webob.exc
 
+from qonos.api.v1 import api_utils
 from qonos.common import exception
 from qonos.common import utils
 import qonos.db
-from qonos.openstack.common import wsgi
 from qonos.openstack.common.gettextutils import _
 
 
@@ -51,4 +51,4 @@ class ScheduleMetadataController(object):
 
 def create_resource():
     """QonoS resource factory method"""
-    return wsgi.Resource(ScheduleMetadataController())
+    return api_utils.Resource(ScheduleMetadataController())
@@ -1,10 +1,11 @@
 import webob.exc
 
+from qonos.api.v1 import api_utils
+from qonos.api.v1 import job_waiters
 from qonos.common import exception
 from qonos.common import utils
 import qonos.db
 from qonos.openstack.common import timeutils
-from qonos.openstack.common import wsgi
 from qonos.openstack.common.gettextutils import _
 
 
@@ -27,9 +28,18 @@ class SchedulesController(object):
             next_run_before = timeutils.normalize_time(next_run_before)
             filter_args['next_run_before'] = next_run_before
 
+        if request.params.get('updated_since') is not None:
+            updated_since = request.params['updated_since']
+            updated_since = timeutils.parse_isotime(updated_since)
+            updated_since = timeutils.normalize_time(updated_since)
+            filter_args['updated_since'] = updated_since
+
         if request.params.get('tenant_id') is not None:
             filter_args['tenant_id'] = request.params['tenant_id']
 
+        if request.params.get('shard_count') is not None:
+            filter_args.update(api_utils.get_shard_args(request))
+
         if request.params.get('instance_id') is not None:
             filter_args['instance_id'] = request.params['instance_id']
 
@@ -37,18 +47,63 @@ class SchedulesController(object):
 
     def list(self, request):
         filter_args = self._get_list_filter_args(request)
-        schedules = self.db_api.schedule_get_all(filter_args=filter_args)
+        filter_args.update(api_utils.get_pagination_args(request))
+        try:
+            schedules = self.db_api.schedule_get_all(filter_args=filter_args)
+        except exception.NotFound:
+            msg = _('Marker %s could not be found.') % filter_args['marker']
+            raise webob.exc.HTTPBadRequest(explanation=msg)
         [utils.serialize_datetimes(sched) for sched in schedules]
-        return {'schedules': schedules}
+        links = api_utils.get_links(request, schedules, filter_args['limit'])
+        return {'schedules': schedules, 'schedules_links': links}
+
+    def claim_due(self, request, body=None):
+        body = body or {}
+        due_before = body.get('due_before')
+        if due_before is None:
+            due_before = timeutils.utcnow()
+        else:
+            try:
+                due_before = timeutils.parse_isotime(due_before)
+            except ValueError:
+                msg = _('Must supply a timestamp in valid format.')
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+            due_before = timeutils.normalize_time(due_before)
+
+        limit = body.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                limit = -1
+            if limit < 1:
+                msg = _('limit must be a positive integer.')
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+
+        jobs = self.db_api.schedule_claim_due(due_before, limit=limit)
+        for action in set(job['action'] for job in jobs):
+            job_waiters.notify(action)
+        [utils.serialize_datetimes(job) for job in jobs]
+        return {'jobs': jobs}
+
+    def recompute_next_run(self, request, body=None):
+        body = body or {}
+        start_time = body.get('start_time')
+        if start_time is None:
+            start_time = timeutils.utcnow()
+        else:
+            try:
+                start_time = timeutils.parse_isotime(start_time)
+            except ValueError:
+                msg = _('Must supply a timestamp in valid format.')
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+            start_time = timeutils.normalize_time(start_time)
+
+        updated = self.db_api.schedules_recompute_next_run(start_time)
+        return {'updated': updated}
 
     def _schedule_to_next_run(self, schedule):
-        minute = schedule.get('minute', '*')
-        hour = schedule.get('hour', '*')
-        day_of_month = schedule.get('day_of_month', '*')
-        month = schedule.get('month', '*')
-        day_of_week = schedule.get('day_of_week', '*')
-        return utils.cron_string_to_next_datetime(minute, hour, day_of_month,
-                                                  month, day_of_week)
+        return utils.schedule_to_next_run(schedule)
 
     def create(self, request, body):
         if body is None or body.get('schedule') is None:
@@ -97,4 +152,4 @@ class SchedulesController(object):
 
 def create_resource():
     """QonoS resource factory method"""
-    return wsgi.Resource(SchedulesController())
+    return api_utils.Resource(SchedulesController())
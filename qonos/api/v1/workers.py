@@ -1,21 +1,38 @@
+import time
+
 import webob.exc
 
+from qonos.api.v1 import api_utils
+from qonos.api.v1 import job_waiters
 from qonos.common import exception
 from qonos.common import utils
 import qonos.db
-from qonos.openstack.common import wsgi
+from qonos.openstack.common import cfg
+from qonos.openstack.common import timeutils
 from qonos.openstack.common.gettextutils import _
 
 
+CONF = cfg.CONF
+
+
 class WorkersController(object):
 
+    # NOTE: Long polls for jobs must see jobs committed while they wait.
+    unscoped_actions = ('get_next_job',)
+
     def __init__(self, db_api=None):
         self.db_api = db_api or qonos.db.get_api()
 
     def list(self, request):
-        workers = self.db_api.worker_get_all()
+        filter_args = api_utils.get_pagination_args(request)
+        try:
+            workers = self.db_api.worker_get_all(filter_args=filter_args)
+        except exception.NotFound:
+            msg = _('Marker %s could not be found.') % filter_args['marker']
+            raise webob.exc.HTTPBadRequest(explanation=msg)
         [utils.serialize_datetimes(worker) for worker in workers]
-        return {'workers': workers}
+        links = api_utils.get_links(request, workers, filter_args['limit'])
+        return {'workers': workers, 'workers_links': links}
 
     def create(self, request, body):
         worker = self.db_api.worker_create(body.get('worker'))
@@ -40,14 +57,69 @@ class WorkersController(object):
 
     def get_next_job(self, request, worker_id, body):
         action = body.get('action')
+        max_jobs = body.get('max_jobs', 1)
+        try:
+            max_jobs = int(max_jobs)
+        except (TypeError, ValueError):
+            max_jobs = -1
+        if max_jobs < 1:
+            msg = _('max_jobs must be a positive integer.')
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        max_jobs = min(max_jobs, CONF.api_claim_max)
+
+        wait = body.get('wait', 0)
         try:
-            return self.db_api.job_get_and_assign_next_by_action(action,
-                                                                 worker_id)
-        except exception.NotFound as e:
+            wait = float(wait)
+        except (TypeError, ValueError):
+            wait = -1
+        if wait < 0:
+            msg = _('wait must be a non-negative number of seconds.')
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        deadline = time.time() + min(wait, CONF.job_wait_max)
+
+        while True:
+            jobs = self.db_api.jobs_get_and_assign_next_by_action(action,
+                                                                  worker_id,
+                                                                  max_jobs)
+            remaining = deadline - time.time()
+            if jobs or remaining <= 0:
+                break
+            # NOTE: Jobs created through other API processes do not wake
+            # this request, so the database is checked again periodically.
+            job_waiters.wait(action,
+                             min(remaining, CONF.job_wait_poll_interval))
+
+        if not jobs:
             msg = _('No available jobs found for action %s') % action
             raise webob.exc.HTTPNotFound(explanation=msg)
 
+        [utils.serialize_datetimes(job) for job in jobs]
+        return {'jobs': jobs}
+
+    def update_heartbeats(self, request, worker_id, body):
+        if body is None or not isinstance(body.get('job_ids'), list):
+            raise webob.exc.HTTPBadRequest()
+        for job_id in body['job_ids']:
+            if not isinstance(job_id, basestring):
+                raise webob.exc.HTTPBadRequest()
+
+        updated_at = body.get('heartbeat')
+        if updated_at is None:
+            updated_at = timeutils.utcnow()
+        else:
+            try:
+                updated_at = timeutils.parse_isotime(updated_at)
+            except ValueError:
+                msg = _('Must supply a timestamp in valid format.')
+                raise webob.exc.HTTPBadRequest(explanation=msg)
+            updated_at = timeutils.normalize_time(updated_at)
+
+        updated = self.db_api.job_heartbeats_update(worker_id,
+                                                    body['job_ids'],
+                                                    updated_at)
+        return {'updated': updated}
+
 
 def create_resource():
     """QonoS resource factory method"""
-    return wsgi.Resource(WorkersController())
+    return api_utils.Resource(WorkersController())
@@ -17,6 +17,19 @@ paste_deploy_opts = [
 common_opts = [
     cfg.StrOpt('db_api', default='qonos.db.simple.api',
                help=_('Python module path of database access API')),
+    cfg.IntOpt('api_limit_max', default=1000,
+               help=_('Maximum and default number of items returned by a '
+                      'single list request')),
+    cfg.IntOpt('api_claim_max', default=100,
+               help=_('Maximum number of jobs a worker can claim in a '
+                      'single request')),
+    cfg.IntOpt('job_wait_max', default=60,
+               help=_('Maximum number of seconds a worker request for jobs '
+                      'can wait for a job to be created')),
+    cfg.FloatOpt('job_wait_poll_interval', default=1.0,
+                 help=_('Interval in seconds at which waiting worker '
+                        'requests check the database for jobs created '
+                        'through other API processes')),
 ]
 
 CONF = cfg.CONF
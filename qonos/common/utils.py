@@ -1,6 +1,7 @@
+import calendar
 import datetime
-
-from croniter.croniter import croniter
+import hashlib
+import threading
 
 from qonos.openstack.common import timeutils
 
@@ -17,13 +18,262 @@ def serialize_datetimes(data):
             serialize_datetimes(v)
 
 
+class LRUCache(object):
+    """Mapping of at most size items which drops the least recently used."""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = {}
+        # Circular doubly linked list of [previous, next, key, value]
+        # links, from the least to the most recently used.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._items.get(key)
+            if link is None:
+                return default
+            previous, next, _key, value = link
+            previous[1] = next
+            next[0] = previous
+            last = self._root[0]
+            last[1] = self._root[0] = link
+            link[0] = last
+            link[1] = self._root
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            link = self._items.pop(key, None)
+            if link is not None:
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+            elif len(self._items) >= self.size:
+                oldest = self._root[1]
+                self._root[1] = oldest[1]
+                oldest[1][0] = self._root
+                del self._items[oldest[2]]
+            last = self._root[0]
+            link = [last, self._root, key, value]
+            last[1] = self._root[0] = self._items[key] = link
+
+    def __len__(self):
+        return len(self._items)
+
+
+# (name, lowest value, highest value, end of N/step, value names)
+# NOTE: Sunday is also 7, but as in croniter N/step stops at Saturday.
+_CRON_FIELDS = (
+    ('minute', 0, 59, 59, {}),
+    ('hour', 0, 23, 23, {}),
+    ('day_of_month', 1, 31, 31, {}),
+    ('month', 1, 12, 12, dict((name, i + 1) for i, name in enumerate(
+        ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep',
+         'oct', 'nov', 'dec']))),
+    ('day_of_week', 0, 7, 6, dict((name, i) for i, name in enumerate(
+        ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']))),
+)
+_CRON_ALL_DAYS = ((1 << 31) - 1) << 1
+_CRON_ALL_DAYS_OF_WEEK = (1 << 7) - 1
+_CRON_CACHE = LRUCache(4096)
+# Months for which each expression keeps the matching days
+_CRON_MONTHS_CACHED = 120
+# NOTE: Day of month and week combinations like February 30th never fire.
+# Every weekday and leap day combination occurs within 28 years.
+_CRON_SEARCH_YEARS = 28
+
+
+def _next_bit(bits, start):
+    """Returns the lowest set bit of bits at or above start, or None."""
+    remaining = bits >> start
+    if not remaining:
+        return None
+    return start + (remaining & -remaining).bit_length() - 1
+
+
+def _parse_cron_field(value, low, high, step_end, names):
+    bits = 0
+    for part in str(value).lower().split(','):
+        base, slash, step = part.partition('/')
+        step = int(step) if step else 1
+        if base == '*':
+            first, last = low, high
+        else:
+            first, _sep, last = base.partition('-')
+            first = names.get(first, first)
+            # As in croniter, N/step runs from N to the end of the field
+            last = names.get(last, last) if last else (step_end if slash
+                                                       else first)
+            first, last = int(first), int(last)
+        if not (low <= first <= last <= high) or step < 1:
+            raise ValueError('Invalid cron field: %s' % value)
+        for i in xrange(first, last + 1, step):
+            bits |= 1 << i
+    return bits
+
+
+class CronExpression(object):
+    """Cron expression compiled into bitsets of the matching values.
+
+    As in cron, a day matches either field when neither day_of_month nor
+    day_of_week covers all days. Use compile_cron to get cached instances.
+    """
+
+    def __init__(self, minute='*', hour='*', day_of_month='*', month='*',
+                 day_of_week='*'):
+        fields = (minute, hour, day_of_month, month, day_of_week)
+        bits = [_parse_cron_field(value, low, high, step_end, names)
+                for value, (name, low, high, step_end, names)
+                in zip(fields, _CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, days_of_week = bits
+        # Sunday is both 0 and 7
+        self.days_of_week = ((days_of_week | days_of_week >> 7) &
+                             _CRON_ALL_DAYS_OF_WEEK)
+        self.any_day_of_month = self.days == _CRON_ALL_DAYS
+        self.any_day_of_week = self.days_of_week == _CRON_ALL_DAYS_OF_WEEK
+        self._month_days = {}
+
+    def _days_in_month(self, year, month):
+        """Returns the bitset of the days of a month which match."""
+        bits = self._month_days.get((year, month))
+        if bits is None:
+            weekday, days = calendar.monthrange(year, month)
+            valid = ((1 << days) - 1) << 1
+            # calendar counts weekdays from Monday, cron from Sunday
+            first = (weekday + 1) % 7
+            by_weekday = 0
+            for day in xrange(1, days + 1):
+                if self.days_of_week & (1 << (first + day - 1) % 7):
+                    by_weekday |= 1 << day
+            if self.any_day_of_month and self.any_day_of_week:
+                bits = valid
+            elif self.any_day_of_month:
+                bits = by_weekday
+            elif self.any_day_of_week:
+                bits = self.days & valid
+            else:
+                bits = (self.days | by_weekday) & valid
+            if len(self._month_days) >= _CRON_MONTHS_CACHED:
+                self._month_days.clear()
+            self._month_days[(year, month)] = bits
+        return bits
+
+    def next_after(self, start_time):
+        """Returns the first fire time after start_time."""
+        # NOTE: Values past the end of their field, like minute 60, find
+        # no next bit and move on to the next hour, day, month or year.
+        year, month, day = start_time.year, start_time.month, start_time.day
+        hour, minute = start_time.hour, start_time.minute + 1
+        last_year = year + _CRON_SEARCH_YEARS
+        while year <= last_year:
+            next_month = _next_bit(self.months, month)
+            if next_month is None:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if next_month != month:
+                month, day, hour, minute = next_month, 1, 0, 0
+
+            days = self._days_in_month(year, month)
+            while True:
+                next_day = _next_bit(days, day)
+                if next_day is None:
+                    break
+                if next_day != day:
+                    day, hour, minute = next_day, 0, 0
+
+                while True:
+                    next_hour = _next_bit(self.hours, hour)
+                    if next_hour is None:
+                        break
+                    if next_hour != hour:
+                        hour, minute = next_hour, 0
+                    next_minute = _next_bit(self.minutes, minute)
+                    if next_minute is not None:
+                        return datetime.datetime(year, month, day, hour,
+                                                 next_minute)
+                    hour, minute = hour + 1, 0
+                day, hour, minute = day + 1, 0, 0
+            month, day, hour, minute = month + 1, 1, 0, 0
+        raise ValueError('Cron expression never fires')
+
+    def next_n(self, start_time, count):
+        """Returns the next count fire times after start_time."""
+        times = []
+        for i in xrange(count):
+            start_time = self.next_after(start_time)
+            times.append(start_time)
+        return times
+
+    def fire_times(self, start_time, end_time):
+        """Returns the fire times after start_time up to end_time."""
+        times = []
+        next_time = self.next_after(start_time)
+        while next_time <= end_time:
+            times.append(next_time)
+            next_time = self.next_after(next_time)
+        return times
+
+
+def compile_cron(minute=None, hour=None, day_of_month=None, month=None,
+                 day_of_week=None):
+    """Returns the cached CronExpression of the given cron fields."""
+    key = (minute, hour, day_of_month, month, day_of_week)
+    expression = _CRON_CACHE.get(key)
+    if expression is None:
+        # NOTE: Fields are cached as given, the normalized fields share
+        # their expression with every spelling like 30, '30' or u'30'.
+        fields = tuple(_cron_field(value) for value in key)
+        expression = _CRON_CACHE.get(fields)
+        if expression is None:
+            expression = CronExpression(*fields)
+            _CRON_CACHE.put(fields, expression)
+        _CRON_CACHE.put(key, expression)
+    return expression
+
+
 def cron_string_to_next_datetime(minute="*", hour="*", day_of_month="*",
-                                 month="*", day_of_week="*"):
-    cron_string = ("%s %s %s %s %s" %
-                  (minute or '*',
-                   hour or '*',
-                   day_of_month or '*',
-                   month or '*',
-                   day_of_week or '*'))
-    iter = croniter(cron_string, timeutils.utcnow())
-    return iter.get_next(datetime.datetime)
+                                 month="*", day_of_week="*", start_time=None):
+    expression = compile_cron(minute, hour, day_of_month, month, day_of_week)
+    return expression.next_after(start_time or timeutils.utcnow())
+
+
+def _cron_field(value):
+    if value is None or value == '':
+        return '*'
+    return str(value)
+
+
+def schedule_to_next_run(schedule, start_time=None):
+    """Returns the next time a schedule should run after start_time."""
+    return cron_string_to_next_datetime(schedule.get('minute'),
+                                        schedule.get('hour'),
+                                        schedule.get('day_of_month'),
+                                        schedule.get('month'),
+                                        schedule.get('day_of_week'),
+                                        start_time=start_time)
+
+
+def spread_offset(schedule_id, window_seconds):
+    """Returns the seconds within a window that runs of a schedule are
+    delayed by, the same for every run of the schedule."""
+    if window_seconds <= 0:
+        return 0
+    digest = hashlib.md5(schedule_id).hexdigest()
+    return int(digest[:8], 16) % window_seconds
+
+
+def shard_id_range(shard, shard_count):
+    """Returns the (lower, upper) bounds of the ids in a shard.
+
+    Ids are random UUIDs, so splitting the range of their leading hex
+    digits evenly splits the ids. Either bound is None at the ends of
+    the range.
+    """
+    lower = upper = None
+    if shard > 0:
+        lower = '%08x' % (shard * 2 ** 32 // shard_count)
+    if shard < shard_count - 1:
+        upper = '%08x' % ((shard + 1) * 2 ** 32 // shard_count)
+    return lower, upper
@@ -1,3 +1,5 @@
+from eventlet import tpool
+
 from qonos.openstack.common import cfg
 from qonos.openstack.common import importutils
 
@@ -8,12 +10,27 @@ sql_connection_opt = cfg.StrOpt('sql_connection',
                                 help='A valid SQLAlchemy connection '
                                      'string for the database. '
                                      'Default: %default')
+sql_use_tpool_opt = cfg.BoolOpt('sql_use_tpool', default=False,
+                                help='Run db api calls in the eventlet '
+                                     'pool of native threads, so a '
+                                     'blocking database driver does not '
+                                     'stall the other requests of the '
+                                     'process. The EVENTLET_THREADPOOL_SIZE '
+                                     'environment variable sets the number '
+                                     'of threads. Each call then uses its '
+                                     'own session instead of the one of '
+                                     'the request. Not for in-memory '
+                                     'SQLite, where each thread has its '
+                                     'own database.')
 
 CONF = cfg.CONF
 CONF.register_opt(sql_connection_opt)
+CONF.register_opt(sql_use_tpool_opt)
 
 
 def get_api():
     db_api = importutils.import_module(CONF.db_api)
     db_api.configure_db()
+    if CONF.sql_use_tpool:
+        return tpool.Proxy(db_api)
     return db_api
@@ -1,14 +1,42 @@
+import bisect
+import collections
+import contextlib
+import copy
 import functools
+import heapq
+import threading
+import time
 import uuid
-import copy
 import qonos.db.db_utils as db_utils
+from datetime import datetime
 from datetime import timedelta
-from operator import itemgetter
-from operator import methodcaller
 
 from qonos.common import exception
-from qonos.openstack.common import timeutils
+from qonos.common import utils as qonos_utils
+from qonos.db.simple import journal
+from qonos.openstack.common import cfg
 from qonos.openstack.common.gettextutils import _
+import qonos.openstack.common.log as logging
+from qonos.openstack.common import timeutils
+
+LOG = logging.getLogger(__name__)
+
+simple_db_opts = [
+    cfg.StrOpt('simple_db_dir', default=None,
+               help=_('Directory where the simple db backend journals its '
+                      'changes and keeps snapshots, so its data survives '
+                      'restarts. Data is kept in memory only when unset')),
+    cfg.IntOpt('simple_db_snapshot_interval', default=10000,
+               help=_('Number of journaled changes after which the simple '
+                      'db backend writes a snapshot and starts a new '
+                      'journal')),
+    cfg.BoolOpt('simple_db_fsync', default=False,
+                help=_('Sync the journal to disk after every change, so '
+                       'changes also survive a host crash')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(simple_db_opts)
 
 
 DATA = {
@@ -20,6 +48,25 @@ DATA = {
     'job_faults': {},
 }
 
+# NOTE: Every change to DATA goes through the _*_insert, _*_set and
+# _*_remove helpers below so these indexes stay in step with it. The
+# helpers replace rows and metadata dicts instead of changing them, so a
+# shallow copy of a table is a consistent snapshot of it.
+INDEXES = {}
+
+# NOTE: Each public function holds the locks of the tables it reads or
+# changes for its whole run, so claims and updates are atomic for API
+# requests served by threads. None of them yields to the eventlet hub,
+# which makes them atomic for green threads too. Functions needing more
+# than one table take the locks in _LOCK_ORDER so they cannot deadlock.
+_LOCK_ORDER = ('schedules', 'workers', 'jobs')
+_LOCKS = dict((table, threading.RLock()) for table in _LOCK_ORDER)
+
+_JOURNAL = None
+# NOTE: Changes are journaled as one record per outermost public call,
+# written before its locks are released.
+_CHANGES = threading.local()
+
 
 # TODO: Move to config
 JOB_TYPES = {
@@ -35,15 +82,258 @@ JOB_TYPES = {
     }
 }
 
-
-def configure_db():
-    pass
+# Schedule times with a SortedIndex named schedules_by_<key>
+_SCHEDULE_TIME_KEYS = ('next_run', 'updated_at')
+
+# Job values which decide whether and in which order a job is claimed
+_JOB_CLAIM_KEYS = frozenset(['action', 'created_at', 'hard_timeout',
+                             'retry_count', 'timeout', 'worker_id'])
+
+
+class SortedIndex(object):
+    """Sorted (key, id) pairs of one table, for range scans by key."""
+
+    def __init__(self):
+        self._items = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, key, item_id):
+        bisect.insort(self._items, (key, item_id))
+
+    def remove(self, key, item_id):
+        i = bisect.bisect_left(self._items, (key, item_id))
+        if i < len(self._items) and self._items[i] == (key, item_id):
+            del self._items[i]
+
+    def extend(self, items):
+        self._items.extend(items)
+        self._items.sort()
+
+    def range(self, lower=None, upper=None):
+        """Yield the ids of items with lower <= key < upper."""
+        start = 0
+        if lower is not None:
+            start = bisect.bisect_left(self._items, (lower,))
+        end = len(self._items)
+        if upper is not None:
+            end = bisect.bisect_left(self._items, (upper,))
+        for key, item_id in self._items[start:end]:
+            yield item_id
+
+    def after(self, key, item_id):
+        """Yield the ids of items sorting after (key, item_id)."""
+        start = bisect.bisect_right(self._items, (key, item_id))
+        for i in xrange(start, len(self._items)):
+            yield self._items[i][1]
+
+
+def _synchronized(*tables):
+    """Run the decorated function holding the locks of the given tables.
+
+    Schedule locks cover schedule_metadata and job locks job_metadata.
+    """
+    locks = [_LOCKS[table] for table in _LOCK_ORDER if table in tables]
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            for lock in locks:
+                lock.acquire()
+            depth = getattr(_CHANGES, 'depth', 0)
+            if not depth:
+                _CHANGES.changes = []
+            _CHANGES.depth = depth + 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _CHANGES.depth = depth
+                try:
+                    if not depth and _CHANGES.changes:
+                        _JOURNAL.append(_CHANGES.changes)
+                finally:
+                    for lock in reversed(locks):
+                        lock.release()
+                if (not depth and _JOURNAL is not None and
+                        _JOURNAL.snapshot_due()):
+                    _snapshot_if_due()
+        return wrapped
+    return decorator
+
+
+def _log(operation, table, key, row=None):
+    if _JOURNAL is not None:
+        _CHANGES.changes.append((operation, table, key, row))
 
 
+def configure_db():
+    if CONF.simple_db_dir and _JOURNAL is None:
+        _recover()
+
+
+@contextlib.contextmanager
+def session_scope():
+    """Every call applies its changes at once, there is no session."""
+    yield
+
+
+def dispose_engine():
+    """There are no database connections to close."""
+
+
+@_synchronized(*_LOCK_ORDER)
+def _recover():
+    global _JOURNAL
+    start = time.time()
+    new_journal = journal.Journal(CONF.simple_db_dir,
+                                  CONF.simple_db_snapshot_interval,
+                                  fsync=CONF.simple_db_fsync)
+    data, records = new_journal.recover()
+    for table in DATA:
+        DATA[table] = {}
+    if data is not None:
+        DATA.update(data)
+    _index_all()
+    for changes in records:
+        for change in changes:
+            _replay(*change)
+    _JOURNAL = new_journal
+    LOG.info(_('Recovered simple db from %(dir)s with %(records)d journal '
+               'records in %(seconds).1fs') %
+             {'dir': CONF.simple_db_dir, 'records': len(records),
+              'seconds': time.time() - start})
+
+
+def _snapshot_if_due():
+    # NOTE: Only copying the data holds up other calls, the snapshot is
+    # written while they go on.
+    started = _start_snapshot()
+    if started is not None:
+        _JOURNAL.finish_snapshot(*started)
+
+
+@_synchronized(*_LOCK_ORDER)
+def _start_snapshot():
+    if not _JOURNAL.snapshot_due():
+        return None
+    generation = _JOURNAL.start_snapshot()
+    if generation is None:
+        return None
+    return generation, _dump()
+
+
+def _dump():
+    return dict((table, dict(DATA[table]))
+                for table in ('schedules', 'schedule_metadata', 'workers',
+                              'jobs', 'job_metadata'))
+
+
+def _replay(operation, table, key, row):
+    if operation == 'reset':
+        for name in DATA:
+            DATA[name] = {}
+        _index_all()
+    elif table == 'schedules':
+        if operation == 'delete':
+            if key in DATA['schedules']:
+                _schedule_remove(key)
+        elif key in DATA['schedules']:
+            _schedule_set(DATA['schedules'][key], row)
+        else:
+            _schedule_insert(row)
+    elif table == 'schedule_metadata':
+        schedule_id, meta_key = key
+        if operation == 'delete':
+            if meta_key in DATA['schedule_metadata'].get(schedule_id, {}):
+                _schedule_meta_remove(schedule_id, meta_key)
+        else:
+            _schedule_meta_set(schedule_id, meta_key, row)
+    elif table == 'workers':
+        if operation == 'delete':
+            if key in DATA['workers']:
+                _worker_remove(key)
+        elif key not in DATA['workers']:
+            _worker_insert(row)
+    elif table == 'jobs':
+        if operation == 'delete':
+            if key in DATA['jobs']:
+                _job_remove(key)
+        elif key in DATA['jobs']:
+            _job_set(DATA['jobs'][key], row)
+        else:
+            _job_insert(row)
+    elif table == 'job_metadata':
+        job_id, meta_key = key
+        if operation == 'delete':
+            if meta_key in DATA['job_metadata'].get(job_id, {}):
+                _job_meta_remove(job_id, meta_key)
+        else:
+            _job_meta_set(job_id, meta_key, row)
+
+
+@_synchronized(*_LOCK_ORDER)
 def reset():
     global DATA
     for k in DATA:
         DATA[k] = {}
+    _index_all()
+    _log('reset', None, None)
+
+
+def _index_all():
+    """Rebuild every index from DATA."""
+    INDEXES.clear()
+    INDEXES.update({
+        'schedules': SortedIndex(),
+        'jobs': SortedIndex(),
+        'workers': SortedIndex(),
+        'schedules_by_next_run': SortedIndex(),
+        'schedules_by_updated_at': SortedIndex(),
+        'schedules_by_tenant': collections.defaultdict(set),
+        'schedules_by_metadata': collections.defaultdict(set),
+        # action -> heap of (created_at, id) of jobs that may be claimable
+        'jobs_ready': collections.defaultdict(list),
+        # action -> heap of (timeout, created_at, id) of assigned jobs
+        'jobs_assigned': collections.defaultdict(list),
+    })
+
+    for table in ('schedules', 'jobs', 'workers'):
+        INDEXES[table].extend((item['created_at'], item_id)
+                              for item_id, item in DATA[table].iteritems())
+
+    for key in _SCHEDULE_TIME_KEYS:
+        INDEXES['schedules_by_' + key] = _schedule_time_index(key)
+    for schedule_id, schedule in DATA['schedules'].iteritems():
+        INDEXES['schedules_by_tenant'][schedule.get('tenant_id')].add(
+            schedule_id)
+    for schedule_id, metadata in DATA['schedule_metadata'].iteritems():
+        for meta in metadata.itervalues():
+            INDEXES['schedules_by_metadata'][(meta['key'],
+                                              meta['value'])].add(schedule_id)
+
+    for job_id, job in DATA['jobs'].iteritems():
+        if job.get('worker_id') is None:
+            INDEXES['jobs_ready'][job['action']].append(
+                (job['created_at'], job_id))
+        else:
+            INDEXES['jobs_assigned'][job['action']].append(
+                (job['timeout'], job['created_at'], job_id))
+    for heaps in (INDEXES['jobs_ready'], INDEXES['jobs_assigned']):
+        for heap in heaps.itervalues():
+            heapq.heapify(heap)
+
+
+def _schedule_time_index(key):
+    # NOTE: Only datetimes can be compared with the range filters.
+    index = SortedIndex()
+    index.extend((schedule[key], schedule_id)
+                 for schedule_id, schedule in DATA['schedules'].iteritems()
+                 if isinstance(schedule.get(key), datetime))
+    return index
+
+
+reset()
 
 
 def _gen_base_attributes():
@@ -51,80 +341,204 @@ def _gen_base_attributes():
     values['id'] = str(uuid.uuid4())
     values['created_at'] = timeutils.utcnow()
     values['updated_at'] = timeutils.utcnow()
-    return copy.deepcopy(values)
+    return values
+
+
+def _page_ids(table, filter_args, candidate_ids=None):
+    """Return the ids of the requested page, ordered by (created_at, id).
+
+    Without candidate_ids the page is read off the table's created_at
+    index, otherwise the candidates are sorted.
+    """
+    marker_key = None
+    marker = filter_args.get('marker')
+    if marker is not None:
+        if marker not in DATA[table]:
+            msg = _('Marker %s could not be found') % marker
+            raise exception.NotFound(message=msg)
+        marker_key = (DATA[table][marker]['created_at'], marker)
+
+    limit = filter_args.get('limit')
+    if candidate_ids is None:
+        if marker_key is None:
+            ids = INDEXES[table].range()
+        else:
+            ids = INDEXES[table].after(*marker_key)
+        page = []
+        for item_id in ids:
+            if limit is not None and len(page) >= limit:
+                break
+            page.append(item_id)
+        return page
+
+    keys = sorted((DATA[table][item_id]['created_at'], item_id)
+                  for item_id in candidate_ids)
+    if marker_key is not None:
+        keys = keys[bisect.bisect_right(keys, marker_key):]
+    if limit is not None:
+        keys = keys[:limit]
+    return [item_id for created_at, item_id in keys]
+
+
+#################### Schedule primitives
+
+
+def _schedule_insert(schedule):
+    DATA['schedules'][schedule['id']] = schedule
+    DATA['schedule_metadata'][schedule['id']] = {}
+    INDEXES['schedules'].add(schedule['created_at'], schedule['id'])
+    _schedule_index(schedule)
+    _log('put', 'schedules', schedule['id'], schedule)
+
+
+def _schedule_set(schedule, values):
+    _schedule_unindex(schedule)
+    if 'created_at' in values:
+        INDEXES['schedules'].remove(schedule['created_at'], schedule['id'])
+        INDEXES['schedules'].add(values['created_at'], schedule['id'])
+    schedule = dict(schedule)
+    schedule.update(values)
+    DATA['schedules'][schedule['id']] = schedule
+    _schedule_index(schedule)
+    _log('put', 'schedules', schedule['id'], schedule)
+    return schedule
 
 
-def _schedule_create(values):
-    global DATA
-    DATA['schedules'][values['id']] = values
-    _schedule_meta_init(values['id'])
-    return copy.deepcopy(values)
+def _schedule_remove(schedule_id):
+    schedule = DATA['schedules'].pop(schedule_id)
+    _schedule_unindex(schedule)
+    INDEXES['schedules'].remove(schedule['created_at'], schedule_id)
+    for meta in DATA['schedule_metadata'].pop(schedule_id, {}).itervalues():
+        _schedule_meta_unindex(schedule_id, meta)
+    _log('delete', 'schedules', schedule_id)
+
+
+def _schedule_index(schedule):
+    for key in _SCHEDULE_TIME_KEYS:
+        if isinstance(schedule.get(key), datetime):
+            INDEXES['schedules_by_' + key].add(schedule[key], schedule['id'])
+    INDEXES['schedules_by_tenant'][schedule.get('tenant_id')].add(
+        schedule['id'])
+
+
+def _schedule_unindex(schedule):
+    for key in _SCHEDULE_TIME_KEYS:
+        if isinstance(schedule.get(key), datetime):
+            INDEXES['schedules_by_' + key].remove(schedule[key],
+                                                  schedule['id'])
+    tenant_id = schedule.get('tenant_id')
+    INDEXES['schedules_by_tenant'][tenant_id].discard(schedule['id'])
+    if not INDEXES['schedules_by_tenant'][tenant_id]:
+        del INDEXES['schedules_by_tenant'][tenant_id]
+
+
+def _schedule_meta_set(schedule_id, key, meta):
+    metadata = dict(DATA['schedule_metadata'][schedule_id])
+    old = metadata.get(key)
+    if old is not None:
+        _schedule_meta_unindex(schedule_id, old)
+    metadata[key] = meta
+    DATA['schedule_metadata'][schedule_id] = metadata
+    INDEXES['schedules_by_metadata'][(meta['key'], meta['value'])].add(
+        schedule_id)
+    _log('put', 'schedule_metadata', (schedule_id, key), meta)
+
+
+def _schedule_meta_remove(schedule_id, key):
+    metadata = dict(DATA['schedule_metadata'][schedule_id])
+    meta = metadata.pop(key)
+    DATA['schedule_metadata'][schedule_id] = metadata
+    _schedule_meta_unindex(schedule_id, meta)
+    _log('delete', 'schedule_metadata', (schedule_id, key))
+
+
+def _schedule_meta_unindex(schedule_id, meta):
+    index_key = (meta['key'], meta['value'])
+    INDEXES['schedules_by_metadata'][index_key].discard(schedule_id)
+    if not INDEXES['schedules_by_metadata'][index_key]:
+        del INDEXES['schedules_by_metadata'][index_key]
+
+
+def _schedule_copy(schedule_id):
+    schedule = dict(DATA['schedules'][schedule_id])
+    schedule['schedule_metadata'] = \
+        [dict(meta) for meta in DATA['schedule_metadata'][schedule_id]
+         .itervalues()]
+    return schedule
 
 
+#################### Schedule methods
+
+
+@_synchronized('schedules')
 def schedule_get_all(filter_args={}):
-    schedules = copy.deepcopy(DATA['schedules'].values())
-    schedules_mutate = copy.deepcopy(DATA['schedules'].values())
-
-    for schedule in schedules:
-        schedule['schedule_metadata'] =\
-            copy.deepcopy(schedule_meta_get_all(schedule['id']))
-
-    schedules_mutate = copy.deepcopy(schedules)
-
-    if 'next_run_after' in filter_args and 'next_run_before' in filter_args:
-        for schedule in schedules:
-            if not((schedule['next_run'] > filter_args['next_run_after'] and
-                    schedule['next_run'] < filter_args['next_run_before']) or
-                    schedule['next_run'] == filter_args['next_run_after']):
-                if schedule in schedules_mutate:
-                    del schedules_mutate[schedules_mutate.index(schedule)]
-
-    if ('next_run_after' not in filter_args and
-        'next_run_before' in filter_args):
-        for schedule in schedules:
-            if not (schedule['next_run'] < filter_args['next_run_before']):
-                if schedule in schedules_mutate:
-                    del schedules_mutate[schedules_mutate.index(schedule)]
-
-    if ('next_run_after' in filter_args and
-        'next_run_before' not in filter_args):
-        for schedule in schedules:
-            if not(schedule['next_run'] > filter_args['next_run_after'] or
-                   schedule['next_run'] == filter_args['next_run_after']):
-                if schedule in schedules_mutate:
-                    del schedules_mutate[schedules_mutate.index(schedule)]
+    candidate_ids = None
+
+    if ('next_run_after' in filter_args or
+            'next_run_before' in filter_args):
+        after = filter_args.get('next_run_after')
+        by_next_run = INDEXES['schedules_by_next_run']
+        candidate_ids = set(by_next_run.range(
+            after, filter_args.get('next_run_before')))
+        if after is not None:
+            # Schedules due exactly at next_run_after always match
+            candidate_ids.update(by_next_run.range(
+                after, after + timedelta(microseconds=1)))
+
+    if filter_args.get('updated_since') is not None:
+        updated_ids = set(INDEXES['schedules_by_updated_at'].range(
+            filter_args['updated_since']))
+        if candidate_ids is None:
+            candidate_ids = updated_ids
+        else:
+            candidate_ids &= updated_ids
+
+    if filter_args.get('shard_count') is not None:
+        lower, upper = qonos_utils.shard_id_range(filter_args['shard'],
+                                                  filter_args['shard_count'])
+        shard_ids = set(
+            schedule_id for schedule_id in DATA['schedules']
+            if ((lower is None or schedule_id >= lower) and
+                (upper is None or schedule_id < upper)))
+        if candidate_ids is None:
+            candidate_ids = shard_ids
+        else:
+            candidate_ids &= shard_ids
 
     if filter_args.get('tenant_id') is not None:
-        for schedule in schedules:
-            if schedule['tenant_id'] != filter_args['tenant_id']:
-                if schedule in schedules_mutate:
-                    del schedules_mutate[schedules_mutate.index(schedule)]
+        tenant_ids = INDEXES['schedules_by_tenant'].get(
+            filter_args['tenant_id'], set())
+        if candidate_ids is None:
+            candidate_ids = set(tenant_ids)
+        else:
+            candidate_ids &= tenant_ids
 
     if filter_args.get('instance_id') is not None:
-        instance_id = filter_args['instance_id']
-        for schedule in schedules:
-            if schedule['schedule_metadata']:
-                for schedule_metadata in schedule['schedule_metadata']:
-                    if not(schedule_metadata['key'] == 'instance_id' and
-                           schedule_metadata['value'] == instance_id):
-                        del schedules_mutate[schedules_mutate.index(schedule)]
-                        break
-            else:
-                if schedule in schedules_mutate:
-                    del schedules_mutate[schedules_mutate.index(schedule)]
+        instance_ids = INDEXES['schedules_by_metadata'].get(
+            ('instance_id', filter_args['instance_id']), set())
+        if candidate_ids is None:
+            candidate_ids = set(instance_ids)
+        else:
+            candidate_ids &= instance_ids
 
-    return schedules_mutate
+    schedule_ids = _page_ids('schedules', filter_args, candidate_ids)
+    return [_schedule_copy(schedule_id) for schedule_id in schedule_ids]
 
 
+@_synchronized('schedules')
 def schedule_get_by_id(schedule_id):
     if schedule_id not in DATA['schedules']:
         raise exception.NotFound()
-    schedule = copy.deepcopy(DATA['schedules'][schedule_id])
-    schedule['schedule_metadata'] = \
-        copy.deepcopy(schedule_meta_get_all(schedule_id))
-    return schedule
+    return _schedule_copy(schedule_id)
 
 
+@_synchronized('schedules')
+def schedule_get_by_ids(schedule_ids):
+    return [_schedule_copy(schedule_id) for schedule_id in set(schedule_ids)
+            if schedule_id in DATA['schedules']]
+
+
+@_synchronized('schedules')
 def schedule_create(schedule_values):
     db_utils.validate_schedule_values(schedule_values)
     values = copy.deepcopy(schedule_values)
@@ -137,17 +551,17 @@ def schedule_create(schedule_values):
 
     schedule.update(values)
     schedule.update(_gen_base_attributes())
-    schedule = _schedule_create(schedule)
+    _schedule_insert(schedule)
 
     for metadatum in metadata:
         schedule_meta_create(schedule['id'], metadatum)
 
-    return schedule_get_by_id(schedule['id'])
+    return _schedule_copy(schedule['id'])
 
 
+@_synchronized('schedules')
 def schedule_update(schedule_id, schedule_values):
-    global DATA
-    values = schedule_values.copy()
+    values = copy.deepcopy(schedule_values)
 
     if schedule_id not in DATA['schedules']:
         raise exception.NotFound()
@@ -158,38 +572,98 @@ def schedule_update(schedule_id, schedule_values):
         del values['schedule_metadata']
 
     if len(values) > 0:
-        schedule = DATA['schedules'][schedule_id]
-        schedule['updated_at'] = timeutils.utcnow()
-        schedule.update(values)
+        #NOTE(ameade): This must come before update specified values since
+        # we may be trying to manually set updated_at
+        values.setdefault('updated_at', timeutils.utcnow())
+        _schedule_set(DATA['schedules'][schedule_id], values)
 
     if len(metadata) > 0:
-        DATA['schedule_metadata'][schedule_id] = {}
+        for key in DATA['schedule_metadata'][schedule_id].keys():
+            _schedule_meta_remove(schedule_id, key)
         for metadatum in metadata:
             schedule_meta_create(schedule_id, metadatum)
 
-    return schedule_get_by_id(schedule_id)
+    return _schedule_copy(schedule_id)
+
+
+@_synchronized('schedules', 'jobs')
+def schedule_claim_due(due_before, limit=None):
+    now = timeutils.utcnow()
+    # NOTE: Datetimes have microsecond resolution, so this includes
+    # schedules due exactly at due_before.
+    due_ids = INDEXES['schedules_by_next_run'].range(
+        upper=due_before + timedelta(microseconds=1))
+    due = [DATA['schedules'][schedule_id] for schedule_id in due_ids]
+    if limit is not None:
+        due = due[:limit]
+
+    jobs = []
+    for schedule in due:
+        next_run = qonos_utils.schedule_to_next_run(schedule, due_before)
+        schedule = _schedule_set(schedule, {'next_run': next_run,
+                                            'last_scheduled': now,
+                                            'updated_at': now})
+        values = {
+            'schedule_id': schedule['id'],
+            'tenant_id': schedule['tenant_id'],
+            'action': schedule['action'],
+            'status': 'queued',
+            'job_metadata': [{'key': meta['key'], 'value': meta['value']}
+                             for meta in DATA['schedule_metadata']
+                             [schedule['id']].itervalues()],
+        }
+        jobs.append(job_create(values))
+
+    return jobs
 
 
+_CRON_KEYS = ('minute', 'hour', 'day_of_month', 'month', 'day_of_week')
+
+
+@_synchronized('schedules')
+def schedules_recompute_next_run(start_time):
+    now = timeutils.utcnow()
+    next_runs = {}
+    for schedule in DATA['schedules'].itervalues():
+        fields = tuple(schedule.get(key) for key in _CRON_KEYS)
+        if fields not in next_runs:
+            try:
+                next_runs[fields] = qonos_utils.compile_cron(*fields)\
+                                               .next_after(start_time)
+            except ValueError:
+                LOG.warn(_('Cron fields %s never fire') % (fields,))
+                next_runs[fields] = None
+
+    updated = 0
+    for schedule_id, schedule in DATA['schedules'].items():
+        next_run = next_runs[tuple(schedule.get(key) for key in _CRON_KEYS)]
+        if next_run is None:
+            continue
+        schedule = dict(schedule)
+        schedule.update({'next_run': next_run, 'updated_at': now})
+        DATA['schedules'][schedule_id] = schedule
+        _log('put', 'schedules', schedule_id, schedule)
+        updated += 1
+
+    # NOTE: Rebuilding the indexes once is cheaper than moving every entry.
+    for key in _SCHEDULE_TIME_KEYS:
+        INDEXES['schedules_by_' + key] = _schedule_time_index(key)
+    return updated
+
+
+@_synchronized('schedules')
 def schedule_delete(schedule_id):
-    global DATA
     if schedule_id not in DATA['schedules']:
         raise exception.NotFound()
-    del DATA['schedules'][schedule_id]
-
-
-def _schedule_meta_init(schedule_id):
-    if DATA['schedule_metadata'].get(schedule_id) is None:
-        DATA['schedule_metadata'][schedule_id] = {}
+    _schedule_remove(schedule_id)
 
 
+@_synchronized('schedules')
 def schedule_meta_create(schedule_id, values):
-    global DATA
     if DATA['schedules'].get(schedule_id) is None:
         msg = _('Schedule %s could not be found') % schedule_id
         raise exception.NotFound(message=msg)
 
-    _schedule_meta_init(schedule_id)
-
     try:
         _check_meta_exists(schedule_id, values['key'])
     except exception.NotFound:
@@ -201,8 +675,8 @@ def schedule_meta_create(schedule_id, values):
     values['schedule_id'] = schedule_id
     meta.update(values)
     meta.update(_gen_base_attributes())
-    DATA['schedule_metadata'][schedule_id][values['key']] = meta
-    return copy.deepcopy(meta)
+    _schedule_meta_set(schedule_id, values['key'], meta)
+    return dict(meta)
 
 
 def _check_schedule_exists(schedule_id):
@@ -214,74 +688,162 @@ def _check_schedule_exists(schedule_id):
 def _check_meta_exists(schedule_id, key):
     _check_schedule_exists(schedule_id)
 
-    if (DATA['schedule_metadata'].get(schedule_id) is None or
-            DATA['schedule_metadata'][schedule_id].get(key) is None):
+    if DATA['schedule_metadata'][schedule_id].get(key) is None:
         msg = _('Meta %s could not be found for Schedule %s ')
         msg = msg % (key, schedule_id)
         raise exception.NotFound(message=msg)
 
 
+@_synchronized('schedules')
 def schedule_meta_get_all(schedule_id):
     _check_schedule_exists(schedule_id)
-    _schedule_meta_init(schedule_id)
 
-    return DATA['schedule_metadata'][schedule_id].values()
+    return [dict(meta) for meta in
+            DATA['schedule_metadata'][schedule_id].itervalues()]
 
 
+@_synchronized('schedules')
 def schedule_meta_get(schedule_id, key):
     _check_meta_exists(schedule_id, key)
 
-    return DATA['schedule_metadata'][schedule_id][key]
+    return dict(DATA['schedule_metadata'][schedule_id][key])
 
 
+@_synchronized('schedules')
 def schedule_meta_update(schedule_id, key, values):
-    global DATA
     _check_meta_exists(schedule_id, key)
 
-    meta = DATA['schedule_metadata'][schedule_id][key]
+    meta = dict(DATA['schedule_metadata'][schedule_id][key])
     meta.update(values)
     meta['updated_at'] = timeutils.utcnow()
-    DATA['schedule_metadata'][schedule_id][key] = meta
+    _schedule_meta_set(schedule_id, key, meta)
 
-    return copy.deepcopy(meta)
+    return dict(meta)
 
 
+@_synchronized('schedules')
 def schedule_meta_delete(schedule_id, key):
     _check_meta_exists(schedule_id, key)
 
-    del DATA['schedule_metadata'][schedule_id][key]
+    _schedule_meta_remove(schedule_id, key)
+
+
+#################### Worker primitives
+
+
+def _worker_insert(worker):
+    DATA['workers'][worker['id']] = worker
+    INDEXES['workers'].add(worker['created_at'], worker['id'])
+    _log('put', 'workers', worker['id'], worker)
 
 
-def worker_get_all():
-    return DATA['workers'].values()
+def _worker_remove(worker_id):
+    worker = DATA['workers'].pop(worker_id)
+    INDEXES['workers'].remove(worker['created_at'], worker_id)
+    _log('delete', 'workers', worker_id)
 
 
+#################### Worker methods
+
+
+@_synchronized('workers')
+def worker_get_all(filter_args={}):
+    worker_ids = _page_ids('workers', filter_args)
+    return [dict(DATA['workers'][worker_id]) for worker_id in worker_ids]
+
+
+@_synchronized('workers')
 def worker_get_by_id(worker_id):
     if worker_id not in DATA['workers']:
         raise exception.NotFound()
-    return copy.deepcopy(DATA['workers'][worker_id])
+    return dict(DATA['workers'][worker_id])
 
 
+@_synchronized('workers')
 def worker_create(values):
-    global DATA
     worker = {}
-    worker.update(values)
+    worker.update(copy.deepcopy(values))
     worker.update(_gen_base_attributes())
-    DATA['workers'][worker['id']] = worker
-    return copy.deepcopy(worker)
+    _worker_insert(worker)
+    return dict(worker)
 
 
+@_synchronized('workers')
 def worker_delete(worker_id):
-    global DATA
     if worker_id not in DATA['workers']:
         raise exception.NotFound()
-    del DATA['workers'][worker_id]
+    _worker_remove(worker_id)
+
+
+#################### Job primitives
+
+
+def _job_insert(job):
+    DATA['jobs'][job['id']] = job
+    DATA['job_metadata'][job['id']] = {}
+    INDEXES['jobs'].add(job['created_at'], job['id'])
+    _job_index_claim(job)
+    _log('put', 'jobs', job['id'], job)
+
+
+def _job_set(job, values):
+    if 'created_at' in values:
+        INDEXES['jobs'].remove(job['created_at'], job['id'])
+        INDEXES['jobs'].add(values['created_at'], job['id'])
+    job = dict(job)
+    job.update(values)
+    DATA['jobs'][job['id']] = job
+    # NOTE: Outdated claim index entries are skipped when they come up.
+    if _JOB_CLAIM_KEYS.intersection(values):
+        _job_index_claim(job)
+    _log('put', 'jobs', job['id'], job)
+    return job
+
+
+def _job_remove(job_id):
+    job = DATA['jobs'].pop(job_id)
+    DATA['job_metadata'].pop(job_id, None)
+    INDEXES['jobs'].remove(job['created_at'], job_id)
+    _log('delete', 'jobs', job_id)
+
+
+def _job_meta_set(job_id, key, meta):
+    metadata = dict(DATA['job_metadata'][job_id])
+    metadata[key] = meta
+    DATA['job_metadata'][job_id] = metadata
+    _log('put', 'job_metadata', (job_id, key), meta)
+
+
+def _job_meta_remove(job_id, key):
+    metadata = dict(DATA['job_metadata'][job_id])
+    del metadata[key]
+    DATA['job_metadata'][job_id] = metadata
+    _log('delete', 'job_metadata', (job_id, key))
+
+
+def _job_index_claim(job):
+    if job.get('worker_id') is None:
+        heapq.heappush(INDEXES['jobs_ready'][job['action']],
+                       (job['created_at'], job['id']))
+    else:
+        heapq.heappush(INDEXES['jobs_assigned'][job['action']],
+                       (job['timeout'], job['created_at'], job['id']))
+
+
+def _job_copy(job_id):
+    job = dict(DATA['jobs'][job_id])
+    job['job_metadata'] = [dict(meta) for meta in
+                           DATA['job_metadata'][job_id].itervalues()]
+    return job
 
 
+#################### Job methods
+
+
+@_synchronized('jobs')
 def job_create(job_values):
-    global DATA
     db_utils.validate_job_values(job_values)
-    values = job_values.copy()
+    values = copy.deepcopy(job_values)
     job = {}
 
     metadata = []
@@ -302,82 +864,112 @@ def job_create(job_values):
     job.update(values)
     job.update(_gen_base_attributes())
 
-    DATA['jobs'][job['id']] = job
+    _job_insert(job)
 
     for metadatum in metadata:
         job_meta_create(job['id'], metadatum)
 
-    return job_get_by_id(job['id'])
+    return _job_copy(job['id'])
 
 
-def job_get_all():
-    jobs = copy.deepcopy(DATA['jobs'].values())
+@_synchronized('jobs')
+def job_create_many(jobs_values):
+    for job_values in jobs_values:
+        db_utils.validate_job_values(job_values)
 
-    for job in jobs:
-        job['job_metadata'] =\
-            job_meta_get_all_by_job_id(job['id'])
+    return [job_create(job_values) for job_values in jobs_values]
 
-    return jobs
+
+@_synchronized('jobs')
+def job_get_all(filter_args={}):
+    job_ids = _page_ids('jobs', filter_args)
+    return [_job_copy(job_id) for job_id in job_ids]
 
 
+@_synchronized('jobs')
 def job_get_by_id(job_id):
     if job_id not in DATA['jobs']:
         raise exception.NotFound()
 
-    job = copy.deepcopy(DATA['jobs'][job_id])
+    return _job_copy(job_id)
 
-    job['job_metadata'] = \
-        job_meta_get_all_by_job_id(job_id)
 
-    return job
+def _job_get_ref(job_id):
+    if job_id not in DATA['jobs']:
+        raise exception.NotFound()
+    return DATA['jobs'][job_id]
 
 
+@_synchronized('jobs')
 def job_updated_at_get_by_id(job_id):
-    job = job_get_by_id(job_id)
-    return job['updated_at']
+    return _job_get_ref(job_id)['updated_at']
+
 
+@_synchronized('jobs')
+def job_updated_at_update(job_id, updated_at):
+    _job_set(_job_get_ref(job_id), {'updated_at': updated_at})
 
+
+@_synchronized('jobs')
 def job_status_get_by_id(job_id):
-    job = job_get_by_id(job_id)
-    return job['status']
+    return _job_get_ref(job_id)['status']
+
 
+@_synchronized('jobs')
+def job_status_update(job_id, status):
+    _job_set(_job_get_ref(job_id), {'status': status,
+                                    'updated_at': timeutils.utcnow()})
 
+
+@_synchronized('jobs')
 def job_get_and_assign_next_by_action(action, worker_id):
     """Get the next available job for the given action and assign it
     to the worker for worker_id.
     This must be an atomic action!"""
-    job_ref = None
-    now = timeutils.utcnow()
-    jobs = _jobs_get_sorted()
-    max_retry = _job_get_max_retry(action)
-    for job in jobs:
-        if job['action'] == action and \
-                job['retry_count'] < max_retry and \
-                job['hard_timeout'] > now and \
-                (job['worker_id'] is None or job['timeout'] <= now):
-            job_ref = job
-            break
-
-    if job_ref is None:
+    jobs = jobs_get_and_assign_next_by_action(action, worker_id, 1)
+    if not jobs:
         raise exception.NotFound("No jobs found for action: %s" % action)
 
-    job_id = job_ref['id']
-    DATA['jobs'][job_id]['worker_id'] = worker_id
-    DATA['jobs'][job_id]['retry_count'] = job_ref['retry_count'] + 1
-    job = copy.deepcopy(DATA['jobs'][job_id])
-    job['job_metadata'] = job_meta_get_all_by_job_id(job_id)
-
-    return job
+    return jobs[0]
 
 
-def _jobs_get_sorted():
-    jobs = copy.deepcopy(DATA['jobs'])
-    sorted_jobs = []
-    for job_id in jobs:
-        sorted_jobs.append(jobs[job_id])
-
-    sorted_jobs = sorted(sorted_jobs, key=itemgetter('created_at'))
-    return sorted_jobs
+@_synchronized('jobs')
+def jobs_get_and_assign_next_by_action(action, worker_id, max_jobs):
+    """Assign up to max_jobs of the next available jobs for the given
+    action to the worker for worker_id, oldest first."""
+    now = timeutils.utcnow()
+    max_retry = _job_get_max_retry(action)
+    ready = INDEXES['jobs_ready'][action]
+    assigned = INDEXES['jobs_assigned'][action]
+
+    # Assigned jobs past their timeout can be claimed again
+    while assigned and assigned[0][0] <= now:
+        timeout, created_at, job_id = heapq.heappop(assigned)
+        job = DATA['jobs'].get(job_id)
+        if (job is not None and job['worker_id'] is not None and
+                job['timeout'] == timeout):
+            heapq.heappush(ready, (created_at, job_id))
+
+    claimed = []
+    claimed_ids = set()
+    while ready and len(claimed) < max_jobs:
+        created_at, job_id = heapq.heappop(ready)
+        job = DATA['jobs'].get(job_id)
+        if (job is None or job_id in claimed_ids or
+                job['action'] != action or
+                job['created_at'] != created_at):
+            continue
+        if not (job['retry_count'] < max_retry and
+                job['hard_timeout'] > now and
+                (job['worker_id'] is None or job['timeout'] <= now)):
+            continue
+
+        _job_set(job, {'worker_id': worker_id,
+                       'retry_count': job['retry_count'] + 1})
+        claimed.append(_job_copy(job_id))
+        claimed_ids.add(job_id)
+
+    return claimed
 
 
 def _job_get_max_retry(action):
@@ -392,26 +984,22 @@ def _job_get_timeout(action):
     return JOB_TYPES[action]['timeout_seconds']
 
 
+@_synchronized('jobs')
 def _jobs_cleanup_hard_timed_out():
     """Find all jobs with hard_timeout values which have passed
     and delete them, logging the timeout / failure as appropriate"""
     now = timeutils.utcnow()
-    del_ids = []
-    for job_id in DATA['jobs']:
-        job = DATA['jobs'][job_id]
-        print now, job['hard_timeout']
-        print now - job['hard_timeout']
-        if (now - job['hard_timeout']) > timedelta(microseconds=0):
-            del_ids.append(job_id)
+    del_ids = [job_id for job_id, job in DATA['jobs'].iteritems()
+               if job['hard_timeout'] < now]
 
     for job_id in del_ids:
-        job_delete(job_id)
+        _job_remove(job_id)
     return len(del_ids)
 
 
+@_synchronized('jobs')
 def job_update(job_id, job_values):
-    global DATA
-    values = job_values.copy()
+    values = copy.deepcopy(job_values)
     if job_id not in DATA['jobs']:
         raise exception.NotFound()
 
@@ -421,35 +1009,47 @@ def job_update(job_id, job_values):
         del values['job_metadata']
 
     if len(values) > 0:
-        job = DATA['jobs'][job_id]
         #NOTE(ameade): This must come before update specified values since
         # we may be trying to manually set updated_at
-        job['updated_at'] = timeutils.utcnow()
-        job.update(values)
+        values.setdefault('updated_at', timeutils.utcnow())
+        _job_set(DATA['jobs'][job_id], values)
 
     if len(metadata) > 0:
-        DATA['job_metadata'][job_id] = {}
+        for key in DATA['job_metadata'][job_id].keys():
+            _job_meta_remove(job_id, key)
         for metadatum in metadata:
             job_meta_create(job_id, metadatum)
 
-    return job_get_by_id(job_id)
+    return _job_copy(job_id)
+
 
+@_synchronized('jobs')
+def job_heartbeats_update(worker_id, job_ids, updated_at):
+    """Set updated_at of the given jobs assigned to worker_id.
 
+    Returns the number of jobs updated.
+    """
+    updated = 0
+    for job_id in set(job_ids):
+        job = DATA['jobs'].get(job_id)
+        if job is not None and job['worker_id'] == worker_id:
+            _job_set(job, {'updated_at': updated_at})
+            updated += 1
+    return updated
+
+
+@_synchronized('jobs')
 def job_delete(job_id):
-    global DATA
     if job_id not in DATA['jobs']:
         raise exception.NotFound()
-    del DATA['jobs'][job_id]
+    _job_remove(job_id)
 
 
+@_synchronized('jobs')
 def job_meta_create(job_id, values):
-    global DATA
     values['job_id'] = job_id
     _check_job_exists(job_id)
 
-    if DATA['job_metadata'].get(job_id) is None:
-        DATA['job_metadata'][job_id] = {}
-
     try:
         _check_job_meta_exists(job_id, values['key'])
     except exception.NotFound:
@@ -460,8 +1060,8 @@ def job_meta_create(job_id, values):
     meta = {}
     meta.update(values)
     meta.update(_gen_base_attributes())
-    DATA['job_metadata'][job_id][values['key']] = meta
-    return copy.deepcopy(meta)
+    _job_meta_set(job_id, values['key'], meta)
+    return dict(meta)
 
 
 def _check_job_exists(job_id):
@@ -479,34 +1079,34 @@ def _check_job_meta_exists(job_id, key):
         raise exception.NotFound(message=msg)
 
 
+@_synchronized('jobs')
 def job_meta_get_all_by_job_id(job_id):
     _check_job_exists(job_id)
 
-    if job_id not in DATA['job_metadata']:
-        DATA['job_metadata'][job_id] = {}
-
-    return copy.deepcopy(DATA['job_metadata'][job_id].values())
+    return [dict(meta) for meta in DATA['job_metadata'][job_id].itervalues()]
 
 
+@_synchronized('jobs')
 def job_meta_get(job_id, key):
     _check_job_exists(job_id)
     _check_job_meta_exists(job_id, key)
-    return DATA['job_metadata'][job_id][key]
+    return dict(DATA['job_metadata'][job_id][key])
 
 
+@_synchronized('jobs')
 def job_meta_update(job_id, key, values):
-    global DATA
     _check_job_meta_exists(job_id, key)
 
-    meta = DATA['job_metadata'][job_id][key]
+    meta = dict(DATA['job_metadata'][job_id][key])
     meta.update(values)
     meta['updated_at'] = timeutils.utcnow()
-    DATA['job_metadata'][job_id][key] = meta
+    _job_meta_set(job_id, key, meta)
 
-    return copy.deepcopy(meta)
+    return dict(meta)
 
 
+@_synchronized('jobs')
 def job_meta_delete(job_id, key):
     _check_job_meta_exists(job_id, key)
 
-    del DATA['job_metadata'][job_id][key]
+    _job_meta_remove(job_id, key)
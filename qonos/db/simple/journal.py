@@ -0,0 +1,181 @@
+"""
+Append-only change log with compacted snapshots for the simple db backend
+"""
+
+import cPickle as pickle
+import glob
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+import qonos.openstack.common.log as logging
+from qonos.openstack.common.gettextutils import _
+
+LOG = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'snapshot'
+JOURNAL_PREFIX = 'journal-'
+JOURNAL_FILE = JOURNAL_PREFIX + '%d'
+# Each record is framed by its length and CRC32 so a torn write at the
+# end of the journal is detected and dropped on recovery.
+_HEADER = struct.Struct('>II')
+
+
+class Journal(object):
+    """Stores changes in a directory as a snapshot plus journals.
+
+    Starting a snapshot moves appends to a new journal generation, so the
+    snapshot can be written while changes go on. Recovery loads the
+    snapshot and replays the journals of its generation and later ones.
+    """
+
+    def __init__(self, directory, snapshot_interval, fsync=False):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.fsync = fsync
+        self.generation = 0
+        self.records = 0
+        self.size = 0
+        self.snapshot_size = 0
+        self._snapshotting = False
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _journal_generations(self):
+        prefix = self._path(JOURNAL_PREFIX)
+        return sorted(int(path[len(prefix):])
+                      for path in glob.glob(prefix + '*'))
+
+    def recover(self):
+        """Return the snapshot data and the journaled records after it.
+
+        The data is None without a snapshot. The last journal is opened
+        for appending once the records have been read.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        data = None
+        snapshot_generation = 0
+        snapshot_path = self._path(SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            self.snapshot_size = os.path.getsize(snapshot_path)
+            with open(snapshot_path, 'rb') as snapshot_file:
+                snapshot_generation, data = pickle.load(snapshot_file)
+
+        records = []
+        self.generation = snapshot_generation
+        for generation in self._journal_generations():
+            journal_path = self._path(JOURNAL_FILE % generation)
+            if generation < snapshot_generation:
+                os.remove(journal_path)
+                continue
+            self.generation = generation
+            journal_records, size = _read_records(journal_path)
+            records.extend(journal_records)
+            dropped = os.path.getsize(journal_path) - size
+            if dropped:
+                LOG.warn(_('Dropping %(dropped)d bytes of incomplete '
+                           'records from %(path)s') %
+                         {'dropped': dropped, 'path': journal_path})
+                with open(journal_path, 'r+b') as journal_file:
+                    journal_file.truncate(size)
+
+        journal_path = self._path(JOURNAL_FILE % self.generation)
+        self._file = open(journal_path, 'ab')
+        self.records = len(records)
+        self.size = os.path.getsize(journal_path)
+        return data, records
+
+    def append(self, record):
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        header = _HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff)
+        with self._lock:
+            self._file.write(header + payload)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.records += 1
+            self.size += len(header) + len(payload)
+
+    def snapshot_due(self):
+        """Whether the journal grew enough to be worth compacting.
+
+        Writing a snapshot costs about as much as the data it holds, so
+        the journal must also have outgrown the last snapshot.
+        """
+        return (not self._snapshotting and
+                self.records >= self.snapshot_interval and
+                self.size >= self.snapshot_size)
+
+    def start_snapshot(self):
+        """Move appends to a new journal and return its generation.
+
+        Returns None when another snapshot is being written. The data
+        for the snapshot must be taken with no change in between.
+        """
+        with self._lock:
+            if self._snapshotting:
+                return None
+            self._snapshotting = True
+            self._file.close()
+            self.generation += 1
+            self.records = 0
+            self.size = 0
+            self._file = open(self._path(JOURNAL_FILE % self.generation),
+                              'ab')
+            return self.generation
+
+    def finish_snapshot(self, generation, data):
+        """Write data as the snapshot of generation and drop old journals.
+        """
+        try:
+            tmp_path = self._path(SNAPSHOT_FILE + '.tmp')
+            with open(tmp_path, 'wb') as snapshot_file:
+                pickle.dump((generation, data), snapshot_file,
+                            pickle.HIGHEST_PROTOCOL)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.rename(tmp_path, self._path(SNAPSHOT_FILE))
+            self.snapshot_size = os.path.getsize(self._path(SNAPSHOT_FILE))
+
+            for old_generation in self._journal_generations():
+                if old_generation < generation:
+                    os.remove(self._path(JOURNAL_FILE % old_generation))
+        finally:
+            self._snapshotting = False
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _read_records(path):
+    """Return the complete records of a journal file and their size."""
+    if os.path.getsize(path) == 0:
+        return [], 0
+
+    records = []
+    offset = 0
+    with open(path, 'rb') as journal_file:
+        view = mmap.mmap(journal_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            while offset + _HEADER.size <= len(view):
+                length, crc = _HEADER.unpack_from(view, offset)
+                start = offset + _HEADER.size
+                payload = view[start:start + length]
+                if (len(payload) != length or
+                        zlib.crc32(payload) & 0xffffffff != crc):
+                    break
+                records.append(pickle.loads(payload))
+                offset = start + length
+        finally:
+            view.close()
+    return records, offset
@@ -2,6 +2,7 @@
 Defines interface for DB access
 """
 
+import contextlib
 import functools
 import logging
 import time
@@ -9,11 +10,14 @@ import qonos.db.db_utils as db_utils
 from datetime import timedelta
 from qonos.openstack.common.gettextutils import _
 
+from eventlet import corolocal
 import sqlalchemy
 import sqlalchemy.orm as sa_orm
+import sqlalchemy.pool
 import sqlalchemy.sql as sa_sql
 
 from qonos.common import exception
+from qonos.common import utils as qonos_utils
 from qonos.db.sqlalchemy import models
 from qonos.openstack.common import cfg
 import qonos.openstack.common.log as os_logging
@@ -25,6 +29,14 @@ _MAKER = None
 _MAX_RETRIES = None
 _RETRY_INTERVAL = None
 BASE = models.BASE
+# NOTE: Keeps IN clauses under the bound parameter limit of SQLite.
+_IN_CLAUSE_SIZE = 500
+# NOTE: Checkouts waiting at least this many seconds are logged.
+_POOL_WAIT_WARN = 1.0
+_POOL_STATS = None
+_JOB_CLAIM_STRATEGIES = ('auto', 'skip_locked', 'compare_and_swap')
+# NOTE: Holds the session of the session_scope() of each green thread.
+_LOCAL = corolocal.local()
 sa_logger = None
 LOG = os_logging.getLogger(__name__)
 
@@ -33,6 +45,31 @@ db_opts = [
     cfg.IntOpt('sql_max_retries', default=60),
     cfg.IntOpt('sql_retry_interval', default=1),
     cfg.BoolOpt('db_auto_create', default=True),
+    cfg.BoolOpt('sql_core_list_queries', default=False,
+                help=_('Build schedule, job and worker listings from '
+                       'SQLAlchemy Core selects instead of ORM objects')),
+    cfg.StrOpt('sql_job_claim_strategy', default='auto',
+               help=_('How workers claim jobs: "skip_locked" locks the '
+                      'next job with SELECT ... FOR UPDATE SKIP LOCKED, '
+                      '"compare_and_swap" assigns it with a conditional '
+                      'UPDATE, "auto" uses skip_locked on PostgreSQL 9.5 '
+                      'and later and compare_and_swap elsewhere')),
+    cfg.IntOpt('sql_job_claim_candidates', default=10,
+               help=_('Number of jobs read beyond those requested by a '
+                      'compare_and_swap claim, so concurrent workers can '
+                      'fall through to the next jobs instead of all '
+                      'retrying the oldest')),
+    cfg.IntOpt('sql_max_pool_size', default=None,
+               help=_('Connections kept open in the pool, SQLAlchemy '
+                      'keeps 5 by default. Not used with SQLite')),
+    cfg.IntOpt('sql_max_overflow', default=None,
+               help=_('Connections opened beyond sql_max_pool_size when '
+                      'all pooled ones are checked out, SQLAlchemy allows '
+                      '10 by default. Not used with SQLite')),
+    cfg.IntOpt('sql_pool_timeout', default=None,
+               help=_('Seconds to wait for a connection when the pool and '
+                      'its overflow are all checked out, SQLAlchemy waits '
+                      '30 by default. Not used with SQLite')),
 ]
 
 CONF = cfg.CONF
@@ -66,8 +103,9 @@ def force_dict(func):
         return to_return
 
     def convert_object(object):
-        if (isinstance(object, models.ModelBase) or
-                isinstance(object, tuple)):
+        if isinstance(object, models.ModelBase):
+            return object.serialize()
+        elif isinstance(object, tuple):
             to_return = dict(object)
         else:
             raise ValueError()
@@ -100,6 +138,12 @@ def force_dict(func):
     return wrapped
 
 
+def _chunks(items, size):
+    """Split items into lists of at most size elements."""
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+
 def ping_listener(dbapi_conn, connection_rec, connection_proxy):
 
     """
@@ -121,6 +165,61 @@ def ping_listener(dbapi_conn, connection_rec, connection_proxy):
             raise
 
 
+class _MeteredQueuePool(sqlalchemy.pool.QueuePool):
+    """Queue pool recording how long checkouts wait, see pool_stats()."""
+
+    def connect(self):
+        return self._metered(super(_MeteredQueuePool, self).connect)
+
+    def unique_connection(self):
+        return self._metered(
+            super(_MeteredQueuePool, self).unique_connection)
+
+    def _metered(self, checkout):
+        start = time.time()
+        try:
+            return checkout()
+        except sqlalchemy.exc.TimeoutError:
+            _POOL_STATS['timeouts'] += 1
+            raise
+        finally:
+            waited = time.time() - start
+            _POOL_STATS['checkouts'] += 1
+            _POOL_STATS['wait_total'] += waited
+            _POOL_STATS['wait_max'] = max(_POOL_STATS['wait_max'], waited)
+            _POOL_STATS['checked_out_max'] = max(
+                _POOL_STATS['checked_out_max'], self.checkedout())
+            if waited >= _POOL_WAIT_WARN:
+                LOG.warn(_('Waited %(waited).1f seconds for a database '
+                           'connection. %(status)s') %
+                         {'waited': waited, 'status': self.status()})
+
+
+def reset_pool_stats():
+    global _POOL_STATS
+    _POOL_STATS = {'checkouts': 0, 'timeouts': 0, 'wait_total': 0.0,
+                   'wait_max': 0.0, 'checked_out_max': 0}
+
+
+def pool_stats():
+    """
+    Return counters of connection checkouts since the last
+    reset_pool_stats(), and the current state of the pool.
+
+    Only engines with a connection pool, i.e. not SQLite, are counted.
+    """
+    stats = dict(_POOL_STATS)
+    pool = getattr(_ENGINE, 'pool', None)
+    if isinstance(pool, sqlalchemy.pool.QueuePool):
+        stats.update({'size': pool.size(),
+                      'checked_out': pool.checkedout(),
+                      'overflow': pool.overflow()})
+    return stats
+
+
+reset_pool_stats()
+
+
 def configure_db():
     """
     Establish the database, create an engine if needed, and
@@ -136,6 +235,14 @@ def configure_db():
                        'echo': False,
                        'convert_unicode': True
                        }
+        if 'sqlite' not in connection_dict.drivername:
+            engine_args['poolclass'] = _MeteredQueuePool
+            pool_args = {'pool_size': CONF.sql_max_pool_size,
+                         'max_overflow': CONF.sql_max_overflow,
+                         'pool_timeout': CONF.sql_pool_timeout}
+            for key, value in pool_args.items():
+                if value is not None:
+                    engine_args[key] = value
 
         try:
             _ENGINE = sqlalchemy.create_engine(sql_connection, **engine_args)
@@ -168,8 +275,26 @@ def reset():
     models.register_models(_ENGINE)
 
 
+def db_sync():
+    """Create missing tables and indexes in an existing database."""
+    models.register_models(_ENGINE)
+
+
+def dispose_engine():
+    """Close the pooled connections, so forked processes open their own."""
+    if _ENGINE is not None:
+        _ENGINE.dispose()
+
+
 def get_session(autocommit=True, expire_on_commit=False):
-    """Helper method to grab session"""
+    """
+    Helper method to grab session, the one of the enclosing
+    session_scope() if there is one.
+    """
+    session = getattr(_LOCAL, 'session', None)
+    if session is not None:
+        return session
+
     global _MAKER
     if not _MAKER:
         assert _ENGINE
@@ -179,6 +304,32 @@ def get_session(autocommit=True, expire_on_commit=False):
     return _MAKER()
 
 
+@contextlib.contextmanager
+def session_scope():
+    """
+    Run the db api calls made inside in one session and transaction,
+    committed when the block exits without an exception and rolled back
+    otherwise. Nested scopes join the outermost one.
+    """
+    if getattr(_LOCAL, 'session', None) is not None:
+        yield
+        return
+
+    session = get_session()
+    session.begin()
+    _LOCAL.session = session
+    try:
+        yield
+        session.commit()
+    except:
+        # NOTE: Also rolls back green threads killed with GreenletExit.
+        session.rollback()
+        raise
+    finally:
+        _LOCAL.session = None
+        session.close()
+
+
 def is_db_connection_error(args):
     """Return True if error in connecting to db."""
     # NOTE(adam_g): This is currently MySQL specific and needs to be extended
@@ -243,37 +394,124 @@ def schedule_create(schedule_values):
     return _schedule_get_by_id(schedule_ref['id'])
 
 
-@force_dict
 def schedule_get_all(filter_args={}):
+    if CONF.sql_core_list_queries:
+        return _schedule_get_all_core(filter_args)
+    return _schedule_get_all(filter_args)
+
+
+@force_dict
+def _schedule_get_all(filter_args):
     session = get_session()
     query = session.query(models.Schedule)\
                    .options(sa_orm.joinedload(
                             models.Schedule.schedule_metadata))
 
+    for criterion in _schedule_get_all_criteria(filter_args):
+        query = query.filter(criterion)
+
+    query = _paginate_query(session, query, models.Schedule, filter_args)
+    return query.all()
+
+
+def _schedule_get_all_core(filter_args):
+    session = get_session()
+    query = sa_sql.select([models.Schedule.__table__])
+
+    for criterion in _schedule_get_all_criteria(filter_args):
+        query = query.where(criterion)
+
+    query = _paginate_query(session, query, models.Schedule, filter_args)
+    schedules = _rows_to_dicts(session.execute(query))
+    _attach_metadata(session, schedules, models.ScheduleMetadata,
+                     'schedule_id', 'schedule_metadata')
+    return schedules
+
+
+def _schedule_get_all_criteria(filter_args):
+    criteria = []
     if 'next_run_after' in filter_args and 'next_run_before' in filter_args:
-        query = query.filter(
+        criteria.append(
             models.Schedule.next_run.between(filter_args['next_run_after'],
                                              filter_args['next_run_before']))
 
     if ('next_run_after' in filter_args and
         'next_run_before' not in filter_args):
-        query = query.filter(
+        criteria.append(
             models.Schedule.next_run >= filter_args['next_run_after'])
 
     if ('next_run_after' not in filter_args and
         'next_run_before' in filter_args):
-        query = query.filter(
+        criteria.append(
             models.Schedule.next_run < filter_args['next_run_before'])
 
+    if filter_args.get('updated_since') is not None:
+        criteria.append(
+            models.Schedule.updated_at >= filter_args['updated_since'])
+
+    if filter_args.get('shard_count') is not None:
+        lower, upper = qonos_utils.shard_id_range(filter_args['shard'],
+                                                  filter_args['shard_count'])
+        if lower is not None:
+            criteria.append(models.Schedule.id >= lower)
+        if upper is not None:
+            criteria.append(models.Schedule.id < upper)
+
     if filter_args.get('tenant_id') is not None:
-        query = query.filter(
+        criteria.append(
                 models.Schedule.tenant_id == filter_args['tenant_id'])
 
     if filter_args.get('instance_id') is not None:
-        query = query.filter(models.Schedule.schedule_metadata.any(
+        criteria.append(models.Schedule.schedule_metadata.any(
                     key='instance_id', value=filter_args['instance_id']))
 
-    return query.all()
+    return criteria
+
+
+def _paginate_query(session, query, model, filter_args):
+    """Apply keyset pagination on (created_at, id) to a query or select."""
+    marker = filter_args.get('marker')
+    if marker is not None:
+        try:
+            marker_created_at = session.query(model.created_at)\
+                                       .filter_by(id=marker)\
+                                       .one()[0]
+        except sa_orm.exc.NoResultFound:
+            msg = _('Marker %s could not be found') % marker
+            raise exception.NotFound(message=msg)
+        criterion = sa_sql.or_(
+            model.created_at > marker_created_at,
+            sa_sql.and_(model.created_at == marker_created_at,
+                        model.id > marker))
+        if isinstance(query, sa_orm.Query):
+            query = query.filter(criterion)
+        else:
+            query = query.where(criterion)
+
+    query = query.order_by(model.created_at.asc(), model.id.asc())
+    if filter_args.get('limit') is not None:
+        query = query.limit(filter_args['limit'])
+    return query
+
+
+def _rows_to_dicts(result):
+    keys = result.keys()
+    return [dict(zip(keys, row)) for row in result]
+
+
+def _attach_metadata(session, parents, meta_model, parent_key, name):
+    """Load the metadata of all parents with one query per IN chunk."""
+    parents_by_id = {}
+    for parent in parents:
+        parent[name] = []
+        parents_by_id[parent['id']] = parent
+
+    meta_table = meta_model.__table__
+    parent_column = meta_table.c[parent_key]
+    for ids in _chunks(parents_by_id.keys(), _IN_CLAUSE_SIZE):
+        query = sa_sql.select([meta_table]).where(parent_column.in_(ids))
+        for meta in _rows_to_dicts(session.execute(query)):
+            parents_by_id[meta[parent_key]][name].append(meta)
 
 
 def _schedule_get_by_id(schedule_id):
@@ -294,6 +532,23 @@ def schedule_get_by_id(schedule_id):
     return _schedule_get_by_id(schedule_id)
 
 
+@force_dict
+def schedule_get_by_ids(schedule_ids):
+    """Get all schedules matching the given ids with a single query.
+
+    Ids that do not match a schedule are ignored.
+    """
+    session = get_session()
+    schedules = []
+    for ids in _chunks(list(set(schedule_ids)), _IN_CLAUSE_SIZE):
+        query = session.query(models.Schedule)\
+                       .options(sa_orm.subqueryload('schedule_metadata'))\
+                       .filter(models.Schedule.id.in_(ids))
+        schedules.extend(query.all())
+
+    return schedules
+
+
 @force_dict
 def schedule_update(schedule_id, schedule_values):
     # make a copy so we can remove 'schedule_metadata'
@@ -315,6 +570,97 @@ def schedule_update(schedule_id, schedule_values):
     return _schedule_get_by_id(schedule_id)
 
 
+@force_dict
+def schedule_claim_due(due_before, limit=None):
+    """Create jobs for all schedules due at due_before.
+
+    Each claimed schedule has its next_run advanced past due_before in the
+    same transaction that creates its job. The update only applies if
+    next_run is unchanged since it was read, so concurrent callers never
+    create two jobs for the same run of a schedule.
+    """
+    now = timeutils.utcnow()
+    session = get_session()
+    job_refs = []
+    with session.begin(subtransactions=True):
+        query = session.query(models.Schedule)\
+                       .options(sa_orm.subqueryload('schedule_metadata'))\
+                       .filter(models.Schedule.next_run <= due_before)\
+                       .order_by(models.Schedule.next_run.asc())
+        if limit is not None:
+            query = query.limit(limit)
+
+        for schedule in query.all():
+            next_run = qonos_utils.schedule_to_next_run(schedule, due_before)
+            claimed = session.query(models.Schedule)\
+                .filter_by(id=schedule['id'])\
+                .filter_by(next_run=schedule['next_run'])\
+                .update({'next_run': next_run, 'last_scheduled': now},
+                        synchronize_session=False)
+            if not claimed:
+                continue
+
+            values = {
+                'schedule_id': schedule['id'],
+                'tenant_id': schedule['tenant_id'],
+                'action': schedule['action'],
+                'status': 'queued',
+                'job_metadata': [{'key': meta['key'], 'value': meta['value']}
+                                 for meta in schedule['schedule_metadata']],
+            }
+            job_ref = _job_ref_from_values(values, now)
+            session.add(job_ref)
+            job_refs.append(job_ref)
+
+    job_ids = [job_ref['id'] for job_ref in job_refs]
+    return _jobs_get_by_ids(session, job_ids)
+
+
+_CRON_COLUMNS = ('minute', 'hour', 'day_of_month', 'month', 'day_of_week')
+_RECOMPUTE_BATCH = 10000
+
+
+def schedules_recompute_next_run(start_time):
+    """Set next_run of every schedule to its first run after start_time.
+
+    The next run is computed once per distinct set of cron fields and the
+    rows are written by primary key in batched UPDATEs. Schedules whose
+    cron fields never fire are left unchanged.
+
+    Returns the number of schedules updated.
+    """
+    now = timeutils.utcnow()
+    schedules = models.Schedule.__table__
+    columns = [schedules.c[name] for name in _CRON_COLUMNS]
+    update = schedules.update()\
+        .where(schedules.c.id == sa_sql.bindparam('b_id'))\
+        .values(next_run=sa_sql.bindparam('b_next_run',
+                                          type_=schedules.c.next_run.type),
+                updated_at=now)
+    session = get_session()
+    with session.begin(subtransactions=True):
+        next_runs = {}
+        for row in session.execute(sa_sql.select(columns).distinct()):
+            fields = tuple(row)
+            try:
+                next_runs[fields] = qonos_utils.compile_cron(*fields)\
+                                               .next_after(start_time)
+            except ValueError:
+                LOG.warn(_('Cron fields %s never fire') % (fields,))
+
+        params = []
+        for row in session.execute(sa_sql.select([schedules.c.id] +
+                                                 columns)):
+            row = tuple(row)
+            next_run = next_runs.get(row[1:])
+            if next_run is not None:
+                params.append({'b_id': row[0], 'b_next_run': next_run})
+        for offset in xrange(0, len(params), _RECOMPUTE_BATCH):
+            session.execute(update,
+                            params[offset:offset + _RECOMPUTE_BATCH])
+    return len(params)
+
+
 def schedule_delete(schedule_id):
     session = get_session()
     schedule_ref = _schedule_get_by_id(schedule_id)
@@ -330,10 +676,53 @@ def _set_schedule_metadata(schedule_ref, metadata):
 #################### Schedule Metadata methods
 
 
+def _meta_get_with_parent(session, parent_model, meta_model, parent_key,
+                          parent_id, key=None):
+    """
+    Return the metadata of a parent, only the one with key if given, from
+    one query outer joining the metadata to the parent.
+
+    Returns None if the parent does not exist, so a missing parent can be
+    told apart from missing metadata without another query.
+    """
+    onclause = getattr(meta_model, parent_key) == parent_model.id
+    if key is not None:
+        onclause = sa_sql.and_(onclause, meta_model.key == key)
+    rows = session.query(parent_model.id, meta_model)\
+                  .outerjoin(meta_model, onclause)\
+                  .filter(parent_model.id == parent_id)\
+                  .all()
+    if not rows:
+        return None
+    return [meta for parent_id, meta in rows if meta is not None]
+
+
+def _meta_delete(session, meta_model, parent_key, parent_id, key):
+    """Delete the metadata with key of a parent, returns the row count."""
+    meta_table = meta_model.__table__
+    delete = meta_table.delete()\
+        .where(sa_sql.and_(meta_table.c[parent_key] == parent_id,
+                           meta_table.c.key == key))
+    return session.execute(delete).rowcount
+
+
+def _schedule_not_found(schedule_id):
+    msg = _('Schedule %s could not be found') % schedule_id
+    return exception.NotFound(message=msg)
+
+
+def _schedule_meta_not_found(schedule_id, key):
+    msg = _('Meta %(key)s could not be found for Schedule %(schedule_id)s')
+    return exception.NotFound(message=msg % locals())
+
+
 @force_dict
 def schedule_meta_create(schedule_id, values):
-    _schedule_get_by_id(schedule_id)
     session = get_session()
+    if session.query(models.Schedule.id).filter_by(id=schedule_id)\
+              .first() is None:
+        raise _schedule_not_found(schedule_id)
+
     meta_ref = models.ScheduleMetadata()
     values['schedule_id'] = schedule_id
     meta_ref.update(values)
@@ -343,70 +732,79 @@ def schedule_meta_create(schedule_id, values):
     except sqlalchemy.exc.IntegrityError:
         raise exception.Duplicate()
 
-    return _schedule_meta_get(schedule_id, values['key'])
+    return meta_ref
 
 
 @force_dict
 def schedule_meta_get_all(schedule_id):
-    _schedule_get_by_id(schedule_id)
-    session = get_session()
-    query = session.query(models.ScheduleMetadata)\
-                   .filter_by(schedule_id=schedule_id)
+    metadata = _meta_get_with_parent(get_session(), models.Schedule,
+                                     models.ScheduleMetadata, 'schedule_id',
+                                     schedule_id)
+    if metadata is None:
+        raise _schedule_not_found(schedule_id)
 
-    return query.all()
+    return metadata
 
 
-def _schedule_meta_get(schedule_id, key):
-    try:
-        _schedule_get_by_id(schedule_id)
-    except exception.NotFound:
-        msg = _('Schedule %s could not be found') % schedule_id
-        raise exception.NotFound(message=msg)
-    session = get_session()
-    try:
-        meta = session.query(models.ScheduleMetadata)\
-                      .filter_by(schedule_id=schedule_id)\
-                      .filter_by(key=key)\
-                      .one()
-    except sa_orm.exc.NoResultFound:
-        raise exception.NotFound()
+def _schedule_meta_get(session, schedule_id, key):
+    metadata = _meta_get_with_parent(session, models.Schedule,
+                                     models.ScheduleMetadata, 'schedule_id',
+                                     schedule_id, key)
+    if metadata is None:
+        raise _schedule_not_found(schedule_id)
+    if not metadata:
+        raise _schedule_meta_not_found(schedule_id, key)
 
-    return meta
+    return metadata[0]
 
 
 @force_dict
 def schedule_meta_get(schedule_id, key):
-    return _schedule_meta_get(schedule_id, key)
+    return _schedule_meta_get(get_session(), schedule_id, key)
 
 
 @force_dict
 def schedule_meta_update(schedule_id, key, values):
-    _schedule_get_by_id(schedule_id)
     session = get_session()
-    meta_ref = _schedule_meta_get(schedule_id, key)
+    meta_ref = _schedule_meta_get(session, schedule_id, key)
     meta_ref.update(values)
     meta_ref.save(session=session)
     return meta_ref
 
 
 def schedule_meta_delete(schedule_id, key):
-    _schedule_get_by_id(schedule_id)
     session = get_session()
-    meta_ref = _schedule_meta_get(schedule_id, key)
-    meta_ref.delete(session=session)
+    if not _meta_delete(session, models.ScheduleMetadata, 'schedule_id',
+                        schedule_id, key):
+        # NOTE: Only tells which of the schedule or the key is missing.
+        _schedule_meta_get(session, schedule_id, key)
 
 
 ##################### Worker methods
 
 
+def worker_get_all(filter_args={}):
+    if CONF.sql_core_list_queries:
+        return _worker_get_all_core(filter_args)
+    return _worker_get_all(filter_args)
+
+
 @force_dict
-def worker_get_all():
+def _worker_get_all(filter_args):
     session = get_session()
     query = session.query(models.Worker)
+    query = _paginate_query(session, query, models.Worker, filter_args)
 
     return query.all()
 
 
+def _worker_get_all_core(filter_args):
+    session = get_session()
+    query = sa_sql.select([models.Worker.__table__])
+    query = _paginate_query(session, query, models.Worker, filter_args)
+    return _rows_to_dicts(session.execute(query))
+
+
 @force_dict
 def worker_create(values):
     session = get_session()
@@ -437,7 +835,7 @@ def worker_get_by_id(worker_id):
 def worker_delete(worker_id):
     session = get_session()
 
-    with session.begin():
+    with session.begin(subtransactions=True):
         worker = _worker_get_by_id(worker_id)
         worker.delete(session=session)
 
@@ -445,11 +843,9 @@ def worker_delete(worker_id):
 #################### Job methods
 
 
-@force_dict
-def job_create(job_values):
+def _job_ref_from_values(job_values, now):
     db_utils.validate_job_values(job_values)
     values = job_values.copy()
-    session = get_session()
     job_ref = models.Job()
 
     if 'job_metadata' in values:
@@ -457,27 +853,77 @@ def job_create(job_values):
         _set_job_metadata(job_ref, metadata)
         del values['job_metadata']
 
-    now = timeutils.utcnow()
-
     job_timeout_seconds = _job_get_timeout(values['action'])
     if not 'timeout' in values:
         values['timeout'] = now + timedelta(seconds=job_timeout_seconds)
     values['hard_timeout'] = now + timedelta(seconds=job_timeout_seconds)
     job_ref.update(values)
+    return job_ref
+
+
+@force_dict
+def job_create(job_values):
+    session = get_session()
+    job_ref = _job_ref_from_values(job_values, timeutils.utcnow())
     job_ref.save(session=session)
 
     return _job_get_by_id(job_ref['id'])
 
 
 @force_dict
-def job_get_all():
+def job_create_many(jobs_values):
+    """Create several jobs in a single transaction.
+
+    Returns the created jobs in the same order as jobs_values.
+    """
+    now = timeutils.utcnow()
+    job_refs = [_job_ref_from_values(values, now) for values in jobs_values]
+    session = get_session()
+    with session.begin(subtransactions=True):
+        session.add_all(job_refs)
+
+    job_ids = [job_ref['id'] for job_ref in job_refs]
+    return _jobs_get_by_ids(session, job_ids)
+
+
+def _jobs_get_by_ids(session, job_ids):
+    jobs = {}
+    for ids in _chunks(job_ids, _IN_CLAUSE_SIZE):
+        query = session.query(models.Job)\
+                       .options(sa_orm.subqueryload('job_metadata'))\
+                       .filter(models.Job.id.in_(ids))
+        for job in query.all():
+            jobs[job['id']] = job
+
+    return [jobs[job_id] for job_id in job_ids]
+
+
+def job_get_all(filter_args={}):
+    if CONF.sql_core_list_queries:
+        return _job_get_all_core(filter_args)
+    return _job_get_all(filter_args)
+
+
+@force_dict
+def _job_get_all(filter_args):
     session = get_session()
     query = session.query(models.Job)\
                    .options(sa_orm.subqueryload('job_metadata'))
+    query = _paginate_query(session, query, models.Job, filter_args)
 
     return query.all()
 
 
+def _job_get_all_core(filter_args):
+    session = get_session()
+    query = sa_sql.select([models.Job.__table__])
+    query = _paginate_query(session, query, models.Job, filter_args)
+    jobs = _rows_to_dicts(session.execute(query))
+    _attach_metadata(session, jobs, models.JobMetadata, 'job_id',
+                     'job_metadata')
+    return jobs
+
+
 def _job_get_by_id(job_id):
     session = get_session()
     try:
@@ -496,12 +942,38 @@ def job_get_by_id(job_id):
     return _job_get_by_id(job_id)
 
 
+def _job_column_get_by_id(job_id, column):
+    session = get_session()
+    row = session.execute(sa_sql.select([column],
+                                        models.Job.__table__.c.id == job_id))\
+        .first()
+    if row is None:
+        raise exception.NotFound()
+    return row[0]
+
+
+def _job_columns_update(job_id, values):
+    jobs = models.Job.__table__
+    session = get_session()
+    update = jobs.update().where(jobs.c.id == job_id).values(values)
+    if not session.execute(update).rowcount:
+        raise exception.NotFound()
+
+
 def job_updated_at_get_by_id(job_id):
-    return _job_get_by_id(job_id)['updated_at']
+    return _job_column_get_by_id(job_id, models.Job.__table__.c.updated_at)
+
+
+def job_updated_at_update(job_id, updated_at):
+    _job_columns_update(job_id, {'updated_at': updated_at})
 
 
 def job_status_get_by_id(job_id):
-    return _job_get_by_id(job_id)['status']
+    return _job_column_get_by_id(job_id, models.Job.__table__.c.status)
+
+
+def job_status_update(job_id, status):
+    _job_columns_update(job_id, {'status': status})
 
 
 @force_dict
@@ -509,38 +981,129 @@ def job_get_and_assign_next_by_action(action, worker_id):
     """Get the next available job for the given action and assign it
     to the worker for worker_id.
     This must be an atomic action!"""
-    now = timeutils.utcnow()
-    session = get_session()
-    job_id = None
-    try:
-        job_ref = _job_get_next_by_action(session, now, action)
+    job_ids = _jobs_claim(get_session(), action, worker_id, 1)
+    if not job_ids:
+        raise exception.NotFound()
 
-        if job_ref is None:
-            raise exception.NotFound()
+    return _job_get_by_id(job_ids[0])
 
-        job_ref.update({'worker_id': worker_id,
-                        'retry_count': job_ref['retry_count'] + 1})
-        job_id = job_ref['id']
-        job_ref.save(session)
-    except sa_orm.exc.NoResultFound:
-        raise exception.NotFound()
 
-    return _job_get_by_id(job_id)
+@force_dict
+def jobs_get_and_assign_next_by_action(action, worker_id, max_jobs):
+    """Assign up to max_jobs of the next available jobs for the given
+    action to the worker for worker_id, oldest first."""
+    session = get_session()
+    job_ids = _jobs_claim(session, action, worker_id, max_jobs)
+    return _jobs_get_by_ids(session, job_ids)
 
 
-def _job_get_next_by_action(session, now, action):
-    max_retry = _job_get_max_retry(action)
-    job_ref = session.query(models.Job)\
-        .options(sa_orm.subqueryload('job_metadata'))\
-        .filter_by(action=action)\
-        .filter(models.Job.retry_count < max_retry)\
-        .filter(models.Job.hard_timeout > now)\
-        .filter(sa_sql.or_(models.Job.worker_id == None,
-                           models.Job.timeout <= now))\
-        .with_lockmode('update')\
-        .order_by(models.Job.created_at.asc())\
-        .first()
-    return job_ref
+def _jobs_claim(session, action, worker_id, max_jobs):
+    now = timeutils.utcnow()
+    if _job_claim_strategy() == 'skip_locked':
+        return _jobs_claim_skip_locked(session, now, action, worker_id,
+                                       max_jobs)
+    return _jobs_claim_compare_and_swap(session, now, action, worker_id,
+                                        max_jobs)
+
+
+def _job_claim_strategy():
+    strategy = CONF.sql_job_claim_strategy
+    if strategy not in _JOB_CLAIM_STRATEGIES:
+        msg = (_('Invalid sql_job_claim_strategy %(strategy)r, expected '
+                 'one of %(choices)s') %
+               {'strategy': strategy,
+                'choices': ', '.join(_JOB_CLAIM_STRATEGIES)})
+        raise exception.QonosException(msg)
+    if strategy != 'auto':
+        return strategy
+
+    dialect = _ENGINE.dialect
+    version = dialect.server_version_info or ()
+    if dialect.name == 'postgresql' and version >= (9, 5):
+        return 'skip_locked'
+    return 'compare_and_swap'
+
+
+def _job_claimable_criteria(now, action):
+    jobs = models.Job.__table__
+    return [jobs.c.action == action,
+            jobs.c.retry_count < _job_get_max_retry(action),
+            jobs.c.hard_timeout > now,
+            sa_sql.or_(jobs.c.worker_id == None, jobs.c.timeout <= now)]
+
+
+def _job_assign_values(worker_id):
+    jobs = models.Job.__table__
+    return {'worker_id': worker_id,
+            'retry_count': jobs.c.retry_count + 1}
+
+
+def _jobs_claim_skip_locked(session, now, action, worker_id, max_jobs):
+    """Lock the oldest claimable jobs that no other claim has locked."""
+    jobs = models.Job.__table__
+    query = sa_sql.select([jobs.c.id],
+                          sa_sql.and_(*_job_claimable_criteria(now, action)))\
+        .order_by(jobs.c.created_at.asc())\
+        .limit(max_jobs)
+
+    with session.begin(subtransactions=True):
+        connection = session.connection()
+        # NOTE: SQLAlchemy cannot render SKIP LOCKED, so it is appended to
+        # the compiled select and executed with the DBAPI parameters.
+        compiled = query.compile(bind=connection)
+        params = compiled.construct_params()
+        if compiled.positional:
+            params = tuple(params[name] for name in compiled.positiontup)
+        job_ids = [row[0] for row in
+                   connection.execute('%s FOR UPDATE SKIP LOCKED' % compiled,
+                                      params)]
+        if job_ids:
+            connection.execute(jobs.update()
+                               .where(jobs.c.id.in_(job_ids))
+                               .values(_job_assign_values(worker_id)))
+    return job_ids
+
+
+def _jobs_claim_compare_and_swap(session, now, action, worker_id, max_jobs):
+    """Assign the oldest claimable jobs nobody assigned since they were read.
+
+    Each job is assigned by its own update, which only matches the job if
+    it is still claimable and its retry_count is the one that was read.
+    Of several claims reading the same job, even by the same worker, only
+    the one whose update matched a row assigned it. Jobs lost to another
+    claim are replaced with the next candidates.
+    """
+    jobs = models.Job.__table__
+    criteria = _job_claimable_criteria(now, action)
+    claimed = []
+    candidates = []
+    while len(claimed) < max_jobs:
+        if not candidates:
+            limit = max_jobs - len(claimed) + CONF.sql_job_claim_candidates
+            candidates = _job_get_claim_candidates(session, now, action,
+                                                   limit)
+            if not candidates:
+                break
+
+        job_id, retry_count = candidates.pop(0)
+        update = jobs.update()\
+            .where(sa_sql.and_(jobs.c.id == job_id,
+                               jobs.c.retry_count == retry_count,
+                               *criteria))\
+            .values(_job_assign_values(worker_id))
+        if session.execute(update).rowcount == 1:
+            claimed.append(job_id)
+
+    return claimed
+
+
+def _job_get_claim_candidates(session, now, action, limit):
+    jobs = models.Job.__table__
+    query = sa_sql.select([jobs.c.id, jobs.c.retry_count],
+                          sa_sql.and_(*_job_claimable_criteria(now, action)))\
+        .order_by(jobs.c.created_at.asc())\
+        .limit(limit)
+    return session.execute(query).fetchall()
 
 
 def _job_get_max_retry(action):
@@ -588,6 +1151,24 @@ def job_update(job_id, job_values):
     return _job_get_by_id(job_id)
 
 
+def job_heartbeats_update(worker_id, job_ids, updated_at):
+    """Set updated_at of the given jobs assigned to worker_id.
+
+    Returns the number of jobs updated.
+    """
+    jobs = models.Job.__table__
+    session = get_session()
+    updated = 0
+    # NOTE: A repeated id would be counted once per chunk it lands in.
+    for ids in _chunks(sorted(set(job_ids)), _IN_CLAUSE_SIZE):
+        update = jobs.update()\
+            .where(sa_sql.and_(jobs.c.id.in_(ids),
+                               jobs.c.worker_id == worker_id))\
+            .values(updated_at=updated_at)
+        updated += session.execute(update).rowcount
+    return updated
+
+
 def job_delete(job_id):
     session = get_session()
     job_ref = _job_get_by_id(job_id)
@@ -601,6 +1182,16 @@ def _set_job_metadata(job_ref, metadata):
         job_ref.job_metadata.append(metadata_ref)
 
 
+def _job_not_found(job_id):
+    msg = _('Job %s could not be found') % job_id
+    return exception.NotFound(message=msg)
+
+
+def _job_meta_not_found(job_id, key):
+    msg = _('Meta %(key)s could not be found for Job %(job_id)s')
+    return exception.NotFound(message=msg % locals())
+
+
 @force_dict
 def job_meta_create(job_id, values):
     values['job_id'] = job_id
@@ -613,19 +1204,7 @@ def job_meta_create(job_id, values):
     except sqlalchemy.exc.IntegrityError:
         raise exception.Duplicate()
 
-    return _job_meta_get_by_id(meta_ref['id'])
-
-
-def _job_meta_get_by_id(meta_id):
-    session = get_session()
-    try:
-        meta = session.query(models.JobMetadata)\
-                      .filter_by(id=meta_id)\
-                      .one()
-    except sa_orm.exc.NoResultFound:
-        raise exception.NotFound()
-
-    return meta
+    return meta_ref
 
 
 def _job_meta_get_all_by_job_id(job_id):
@@ -640,17 +1219,16 @@ def _job_meta_get_all_by_job_id(job_id):
     return meta
 
 
-def _job_meta_get(job_id, key):
-    session = get_session()
-    try:
-        meta = session.query(models.JobMetadata)\
-                      .filter_by(job_id=job_id)\
-                      .filter_by(key=key)\
-                      .one()
-    except sa_orm.exc.NoResultFound:
-        raise exception.NotFound()
+def _job_meta_get(session, job_id, key):
+    metadata = _meta_get_with_parent(session, models.Job,
+                                     models.JobMetadata, 'job_id', job_id,
+                                     key)
+    if metadata is None:
+        raise _job_not_found(job_id)
+    if not metadata:
+        raise _job_meta_not_found(job_id, key)
 
-    return meta
+    return metadata[0]
 
 
 @force_dict
@@ -660,21 +1238,19 @@ def job_meta_get_all_by_job_id(job_id):
 
 @force_dict
 def job_meta_get(job_id, key):
-    return _job_meta_get(job_id, key)
+    return _job_meta_get(get_session(), job_id, key)
 
 
 @force_dict
 def job_meta_update(job_id, key, values):
-    _job_get_by_id(job_id)
     session = get_session()
-    meta_ref = _job_meta_get(job_id, key)
+    meta_ref = _job_meta_get(session, job_id, key)
     meta_ref.update(values)
     meta_ref.save(session=session)
     return meta_ref
 
 
 def job_meta_delete(job_id, key):
-    job_get_by_id(job_id)
     session = get_session()
-    meta_ref = _job_meta_get(job_id, key)
-    meta_ref.delete(session=session)
+    if not _meta_delete(session, models.JobMetadata, 'job_id', job_id, key):
+        _job_meta_get(session, job_id, key)
@@ -20,10 +20,18 @@
 SQLAlchemy models for glance data
 """
 
+import operator
+
 from sqlalchemy import Column, Integer, String
+from sqlalchemy import event
+from sqlalchemy import Index
+from sqlalchemy.engine import reflection
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import ForeignKey, DateTime, Text
-from sqlalchemy.orm import relationship, backref, object_mapper
+from sqlalchemy.orm import class_mapper, mapper, relationship, backref
+from sqlalchemy.orm import ColumnProperty, RelationshipProperty
+from sqlalchemy.orm import object_mapper
+from sqlalchemy.orm.interfaces import ONETOMANY
 from sqlalchemy import UniqueConstraint
 
 import qonos.db.sqlalchemy.api
@@ -67,6 +75,9 @@ class ModelBase(object):
     def __getitem__(self, key):
         return getattr(self, key)
 
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
     def __iter__(self):
         self._i = iter(object_mapper(self).columns)
         return self
@@ -87,6 +98,51 @@ class ModelBase(object):
     def to_dict(self):
         return self.__dict__.copy()
 
+    def serialize(self):
+        """Convert to a dict of column values and loaded collections.
+
+        Uses the accessors compiled for the model class when its mapper
+        was configured, so no mapper lookup happens per object.
+        """
+        cls = self.__class__
+        if '_serializer' not in cls.__dict__:
+            _compile_serializer(class_mapper(cls), cls)
+        names, getter, collections = cls._serializer
+
+        state = self.__dict__
+        try:
+            values = dict(zip(names, getter(state)))
+        except KeyError:
+            # NOTE: Unloaded or expired columns are loaded on access.
+            values = dict((name, getattr(self, name)) for name in names)
+        for name in collections:
+            if name in state:
+                values[name] = [child.serialize() for child in state[name]]
+        return values
+
+
+def _compile_serializer(mapper, cls):
+    """Precompute the column accessors used by ModelBase.serialize."""
+    names = []
+    collections = []
+    for prop in mapper.iterate_properties:
+        if isinstance(prop, ColumnProperty):
+            names.append(prop.key)
+        elif (isinstance(prop, RelationshipProperty) and
+                prop.direction is ONETOMANY):
+            collections.append(prop.key)
+    names = tuple(names)
+    collections = tuple(collections)
+    cls._serializer = (names, operator.itemgetter(*names), collections)
+
+
+def _compile_serializers():
+    # NOTE: Backrefs add collections to the parent mapper when the child
+    # mapper is configured, so wait until every mapper is configured.
+    for model in (Schedule, ScheduleMetadata, Worker, Job, JobMetadata,
+                  JobFault):
+        _compile_serializer(class_mapper(model), model)
+
 
 class Schedule(BASE, ModelBase):
     """Represents a schedule in the datastore"""
@@ -162,6 +218,29 @@ class JobFault(BASE, ModelBase):
     schedule_data = Column(Text)
 
 
+# Claiming the next job filters on action and walks jobs by created_at.
+Index('ix_jobs_action_created_at', Job.action, Job.created_at)
+Index('ix_jobs_hard_timeout', Job.hard_timeout)
+Index('ix_jobs_created_at_id', Job.created_at, Job.id)
+# Due schedules are found by next_run range, optionally for one tenant.
+Index('ix_schedules_next_run', Schedule.next_run)
+Index('ix_schedules_tenant_id_next_run', Schedule.tenant_id,
+      Schedule.next_run)
+Index('ix_schedules_created_at_id', Schedule.created_at, Schedule.id)
+# Schedulers follow changes to schedules by updated_at.
+Index('ix_schedules_updated_at', Schedule.updated_at)
+# Schedules are looked up by metadata key and value.
+# NOTE: value is a TEXT column, MySQL can only index a prefix of it. The
+# length applies to the last column only, giving (key, value(255)), which
+# needs InnoDB large index prefixes (the default since MySQL 5.7.7).
+Index('ix_schedule_metadata_key_value', ScheduleMetadata.key,
+      ScheduleMetadata.value, mysql_length=255)
+Index('ix_workers_created_at_id', Worker.created_at, Worker.id)
+
+
+event.listen(mapper, 'after_configured', _compile_serializers)
+
+
 def register_models(engine):
     """
     Creates database tables for all models with the given engine
@@ -169,6 +248,23 @@ def register_models(engine):
     models = (Schedule, ScheduleMetadata, Worker, Job, JobFault)
     for model in models:
         model.metadata.create_all(engine)
+    sync_indexes(engine)
+
+
+def sync_indexes(engine):
+    """
+    Creates the model indexes missing from existing tables
+
+    create_all only creates indexes along with a new table, so databases
+    created before an index was added get it here.
+    """
+    inspector = reflection.Inspector.from_engine(engine)
+    for table in BASE.metadata.sorted_tables:
+        existing = set(index['name']
+                       for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
 
 
 def unregister_models(engine):
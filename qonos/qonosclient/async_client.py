@@ -0,0 +1,52 @@
+import inspect
+
+import eventlet
+from eventlet.green import httplib
+
+from qonos.qonosclient import client
+
+
+class AsyncClient(object):
+    """Runs Client requests concurrently in green threads.
+
+    Every request method of Client is mirrored here, except the lazy
+    iter_* methods. Calling one starts the request and returns a
+    GreenThread; its wait() returns the result or raises the error.
+    At most concurrency requests run at once, calls beyond that block
+    until one finishes. Requests use green sockets, so no monkey
+    patching is needed, and share a pool of keep-alive connections.
+    """
+
+    def __init__(self, endpoint, port, concurrency=100, pool_size=None,
+                 idle_timeout=60):
+        if pool_size is None:
+            pool_size = concurrency
+        self.client = client.Client(endpoint, port, pool_size=pool_size,
+                                    idle_timeout=idle_timeout,
+                                    connection_class=httplib.HTTPConnection)
+        self.pool = eventlet.GreenPool(concurrency)
+
+    def waitall(self):
+        """Wait for every started request to finish."""
+        self.pool.waitall()
+
+    def close(self):
+        """Close the idle connections of the pool."""
+        self.client.close()
+
+
+def _async_method(name):
+    method = getattr(client.Client, name)
+
+    def spawn(self, *args, **kwargs):
+        return self.pool.spawn(getattr(self.client, name), *args, **kwargs)
+
+    spawn.__name__ = name
+    spawn.__doc__ = method.__doc__
+    return spawn
+
+
+for _name, _method in inspect.getmembers(client.Client, inspect.ismethod):
+    if (not _name.startswith('_') and not _name.startswith('iter_') and
+            not hasattr(AsyncClient, _name)):
+        setattr(AsyncClient, _name, _async_method(_name))
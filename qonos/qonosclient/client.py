@@ -1,4 +1,11 @@
+import collections
 import httplib
+import select
+import socket
+import threading
+import time
+import urllib
+import urlparse
 
 from qonos.openstack.common import timeutils
 
@@ -10,18 +17,140 @@ except ImportError:
 from qonos.qonosclient import exception
 
 
+# NOTE: Only requests that can safely run twice are retried.
+_RETRY_METHODS = ('GET', 'PUT', 'DELETE')
+
+
+def _is_connection_usable(conn):
+    """Whether an idle connection is still open and has nothing to read.
+
+    The server may close a keep-alive connection while it sits idle, which
+    shows as the socket becoming readable at end of file.
+    """
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        # NOTE: httplib connects on the first request.
+        return True
+    try:
+        readable = select.select([sock], [], [], 0)[0]
+        # NOTE: Data the server sent unprompted cannot be a response to the
+        # next request, so the connection is dropped either way.
+        return not readable
+    except (socket.error, select.error, ValueError):
+        return False
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of keep-alive HTTP connections to one endpoint.
+
+    Keeps at most size idle connections and closes those idle for longer
+    than idle_timeout seconds instead of reusing them.
+    """
+
+    def __init__(self, endpoint, port, size=10, idle_timeout=60,
+                 connection_class=None):
+        self.endpoint = endpoint
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.connection_class = connection_class
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return an idle connection, or a new one, and whether it is new.
+
+        Idle connections the server has closed are dropped.
+        """
+        while True:
+            expired = []
+            conn = None
+            with self._lock:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    if time.time() - last_used > self.idle_timeout:
+                        # NOTE: The remaining connections are idle even
+                        # longer.
+                        expired = [conn] + [c for c, t in self._idle]
+                        self._idle.clear()
+                        conn = None
+            for expired_conn in expired:
+                expired_conn.close()
+
+            if conn is None:
+                return self.connect(), True
+            if _is_connection_usable(conn):
+                return conn, False
+            conn.close()
+
+    def connect(self):
+        """Return a new connection, bypassing the idle ones."""
+        connection_class = self.connection_class or httplib.HTTPConnection
+        return connection_class(self.endpoint, self.port)
+
+    def put(self, conn):
+        """Return a connection whose last response was read completely."""
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, last_used in idle:
+            conn.close()
+
+
 class Client(object):
 
-    def __init__(self, endpoint, port):
+    def __init__(self, endpoint, port, pool_size=10, idle_timeout=60,
+                 connection_class=None):
         self.endpoint = endpoint
         self.port = port
+        self.pool = ConnectionPool(endpoint, port, size=pool_size,
+                                   idle_timeout=idle_timeout,
+                                   connection_class=connection_class)
+
+    def close(self):
+        """Close the idle connections of the pool."""
+        self.pool.close()
 
     def _do_request(self, method, url, body=None):
-        conn = httplib.HTTPConnection(self.endpoint, self.port)
         body = json.dumps(body)
-        conn.request(method, url, body=body,
-                     headers={'Content-Type': 'application/json'})
-        response = conn.getresponse()
+        headers = {'Content-Type': 'application/json'}
+        conn, new = self.pool.get()
+        try:
+            conn.request(method, url, body=body, headers=headers)
+            response = conn.getresponse()
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            # NOTE: The server may have closed an idle connection, so a
+            # request failing on a reused one is retried once on a new
+            # connection, unless it may already have been handled.
+            if new or method not in _RETRY_METHODS:
+                raise
+            conn = self.pool.connect()
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                response = conn.getresponse()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                raise
+
+        try:
+            response_body = response.read()
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
+
         if response.status == 404:
             raise exception.NotFound('Resource Not Found')
 
@@ -29,14 +158,37 @@ class Client(object):
             raise exception.Duplicate('Resource Exists')
 
         if method != 'DELETE':
-            body = response.read()
-            if body != '':
-                return json.loads(body)
+            if response_body != '':
+                return json.loads(response_body)
+
+    def _iter_pages(self, path, key, filter_args=None, page_size=None):
+        """Lazily yield the items of a list, following its next links."""
+        params = dict(filter_args or {})
+        if page_size is not None:
+            params['limit'] = page_size
+        url = path
+        if params:
+            url = '%s?%s' % (path, urllib.urlencode(params))
+
+        while url is not None:
+            response = self._do_request('GET', url)
+            for item in response[key]:
+                yield item
+
+            url = None
+            for link in response.get('%s_links' % key, []):
+                if link['rel'] == 'next':
+                    next_url = urlparse.urlparse(link['href'])
+                    url = '%s?%s' % (path, next_url.query)
 
     ######## workers
 
     def list_workers(self):
-        return self._do_request('GET', '/v1/workers')['workers']
+        return list(self.iter_workers())
+
+    def iter_workers(self, page_size=None):
+        return self._iter_pages('/v1/workers', 'workers',
+                                page_size=page_size)
 
     def create_worker(self, host):
         body = {'worker': {'host': host}}
@@ -48,19 +200,26 @@ class Client(object):
     def delete_worker(self, worker_id):
         self._do_request('DELETE', '/v1/workers/%s' % worker_id)
 
-    def get_next_job(self, worker_id, action):
-        body = {'action': action}
+    def get_next_job(self, worker_id, action, max_jobs=1, wait=None):
+        body = {'action': action, 'max_jobs': max_jobs}
+        if wait is not None:
+            body['wait'] = wait
         return self._do_request('POST', '/v1/workers/%s/jobs' % worker_id,
-                                body)
+                                body)['jobs']
+
+    def job_heartbeats(self, worker_id, job_ids):
+        body = {'heartbeat': timeutils.isotime(), 'job_ids': job_ids}
+        path = '/v1/workers/%s/heartbeats' % worker_id
+        return self._do_request('PUT', path, body)['updated']
 
     ######## schedules
 
     def list_schedules(self, filter_args={}):
-        path = '/v1/schedules%s'
-        query = '?'
-        for key in filter_args:
-            query += ('%s=%s&' % (key, filter_args[key]))
-        return self._do_request('GET', path % query)['schedules']
+        return list(self.iter_schedules(filter_args=filter_args))
+
+    def iter_schedules(self, filter_args={}, page_size=None):
+        return self._iter_pages('/v1/schedules', 'schedules',
+                                filter_args=filter_args, page_size=page_size)
 
     def create_schedule(self, schedule):
         return self._do_request('POST', '/v1/schedules', schedule)['schedule']
@@ -76,6 +235,21 @@ class Client(object):
     def delete_schedule(self, schedule_id):
         self._do_request('DELETE', '/v1/schedules/%s' % schedule_id)
 
+    def claim_due_schedules(self, due_before=None, limit=None):
+        body = {}
+        if due_before is not None:
+            body['due_before'] = due_before
+        if limit is not None:
+            body['limit'] = limit
+        return self._do_request('POST', '/v1/schedules/claim', body)['jobs']
+
+    def recompute_schedules_next_run(self, start_time=None):
+        body = {}
+        if start_time is not None:
+            body['start_time'] = start_time
+        path = '/v1/schedules/next_run'
+        return self._do_request('POST', path, body)['updated']
+
     ######## schedule metadata
 
     def list_schedule_meta(self, schedule_id):
@@ -103,12 +277,19 @@ class Client(object):
     ######## jobs
 
     def list_jobs(self):
-        return self._do_request('GET', '/v1/jobs')['jobs']
+        return list(self.iter_jobs())
+
+    def iter_jobs(self, page_size=None):
+        return self._iter_pages('/v1/jobs', 'jobs', page_size=page_size)
 
     def create_job(self, schedule_id):
         job = {'job': {'schedule_id': schedule_id}}
         return self._do_request('POST', 'v1/jobs', job)['job']
 
+    def create_jobs(self, schedule_ids):
+        body = {'schedule_ids': schedule_ids}
+        return self._do_request('POST', '/v1/jobs/batch', body)['results']
+
     def get_job(self, job_id):
         path = '/v1/jobs/%s' % job_id
         return self._do_request('GET', path)['job']
@@ -144,5 +325,6 @@ class Client(object):
         return self._do_request('GET', path)['meta']['value']
 
 
-def create_client(endpoint, port):
-    return Client(endpoint, port)
+def create_client(endpoint, port, pool_size=10, idle_timeout=60):
+    return Client(endpoint, port, pool_size=pool_size,
+                  idle_timeout=idle_timeout)
@@ -1,7 +1,9 @@
 import datetime
+import heapq
 import logging as pylog
 import time
 
+from qonos.common import utils
 from qonos.openstack.common import cfg
 from qonos.openstack.common.gettextutils import _
 from qonos.openstack.common import timeutils
@@ -15,16 +17,49 @@ scheduler_opts = [
     cfg.StrOpt('api_endpoint', default='localhost'),
     cfg.IntOpt('api_port', default=8080),
     cfg.BoolOpt('daemonized', default=False),
+    cfg.IntOpt('job_create_batch_size', default=100,
+               help=_('Maximum number of jobs to create per API request')),
+    cfg.BoolOpt('claim_schedules', default=False,
+                help=_('Have the API claim due schedules and advance their '
+                       'next run instead of listing schedules by time '
+                       'window. Allows running several schedulers.')),
+    cfg.BoolOpt('in_memory_schedules', default=False,
+                help=_('Keep schedules in memory ordered by next run and '
+                       'create their jobs when due, instead of listing '
+                       'schedules by time window. Changes are fetched '
+                       'with the updated_since filter.')),
+    cfg.FloatOpt('schedule_refresh_interval', default=1.0,
+                 help=_('Interval to fetch changed schedules in seconds '
+                        'with in_memory_schedules')),
+    cfg.IntOpt('schedule_resync_interval', default=600,
+               help=_('Interval to reload all schedules in seconds with '
+                      'in_memory_schedules, dropping deleted ones')),
+    cfg.ListOpt('spread_windows', default=[],
+                help=_('Windows in seconds to spread runs of schedules due '
+                       'at the same time over, as action:seconds pairs. '
+                       'Each schedule runs at a fixed offset within the '
+                       'window of its action, derived from its id. Not '
+                       'used with claim_schedules.')),
+    cfg.IntOpt('shard_count', default=1,
+               help=_('Number of schedulers splitting the schedules '
+                      'between them by id')),
+    cfg.IntOpt('shard', default=0,
+               help=_('Part of the schedules this scheduler handles, from '
+                      '0 to shard_count - 1')),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(scheduler_opts, group='scheduler')
 
+_CRON_KEYS = ('minute', 'hour', 'day_of_month', 'month', 'day_of_week')
+
 
 class Scheduler(object):
     def __init__(self, client_factory):
         self.client = client_factory(CONF.scheduler.api_endpoint,
                                      CONF.scheduler.api_port)
+        self.spread_windows = parse_spread_windows(
+            CONF.scheduler.spread_windows)
 
     def run(self, run_once=False):
         LOG.debug(_('Starting qonos scheduler service'))
@@ -38,7 +73,13 @@ class Scheduler(object):
                         hasattr(handler.stream, 'fileno')):
                     open_files.append(handler.stream)
             with daemon.DaemonContext(files_preserve=open_files):
-                self._run_loop(run_once)
+                self._run(run_once)
+        else:
+            self._run(run_once)
+
+    def _run(self, run_once=False):
+        if CONF.scheduler.in_memory_schedules:
+            self._run_in_memory_loop(run_once)
         else:
             self._run_loop(run_once)
 
@@ -66,9 +107,25 @@ class Scheduler(object):
 
     def enqueue_jobs(self, previous_run=None, current_run=None):
         LOG.debug(_('Creating new jobs'))
+        if CONF.scheduler.claim_schedules:
+            self.claim_jobs(current_run)
+            return
+
         schedules = self.get_schedules(previous_run, current_run)
-        for schedule in schedules:
-            self.client.create_job(schedule['id'])
+        self.create_jobs([schedule['id'] for schedule in schedules])
+
+    def create_jobs(self, schedule_ids):
+        """Create jobs in batches, returning the ids that failed."""
+        failed = []
+        batch_size = max(CONF.scheduler.job_create_batch_size, 1)
+        for i in xrange(0, len(schedule_ids), batch_size):
+            results = self.client.create_jobs(schedule_ids[i:i + batch_size])
+            for result in results:
+                if 'error' in result:
+                    LOG.warn(_('Unable to create job for schedule %s: %s') %
+                             (result['schedule_id'], result['error']))
+                    failed.append(result['schedule_id'])
+        return failed
 
     def get_schedules(self, previous_run=None, current_run=None):
         filter_args = {'next_run_before': current_run}
@@ -76,5 +133,203 @@ class Scheduler(object):
         # TODO(ameade): change api to not require both query params
         year_one = timeutils.isotime(datetime.datetime(1970, 1, 1))
         filter_args['next_run_after'] = previous_run or year_one
+        filter_args.update(self._shard_filter_args())
+
+        if not self.spread_windows:
+            return self.client.list_schedules(filter_args=filter_args)
+
+        # NOTE: Spread schedules run up to the longest window after their
+        # next_run, so the window listed starts that much earlier.
+        after = _parse_time(filter_args['next_run_after'])
+        before = _parse_time(current_run or timeutils.isotime())
+        max_spread = datetime.timedelta(
+            seconds=max(self.spread_windows.values()))
+        filter_args['next_run_after'] = timeutils.isotime(after - max_spread)
+        schedules = self.client.list_schedules(filter_args=filter_args)
+        return [schedule for schedule in schedules
+                if after <= self._spread_next_run(schedule) < before]
+
+    def _spread_next_run(self, schedule):
+        offset = utils.spread_offset(
+            schedule['id'], self.spread_windows.get(schedule['action'], 0))
+        return (_parse_time(schedule['next_run']) +
+                datetime.timedelta(seconds=offset))
+
+    def _shard_filter_args(self):
+        if CONF.scheduler.shard_count <= 1:
+            return {}
+        return {'shard': CONF.scheduler.shard,
+                'shard_count': CONF.scheduler.shard_count}
+
+    def claim_jobs(self, current_run=None):
+        batch_size = max(CONF.scheduler.job_create_batch_size, 1)
+        while True:
+            jobs = self.client.claim_due_schedules(due_before=current_run,
+                                                   limit=batch_size)
+            # NOTE: A batch is also short when another scheduler claimed
+            # some of its schedules first, so only an empty one means none
+            # are left.
+            if not jobs:
+                break
+
+    def _run_in_memory_loop(self, run_once=False):
+        queue = ScheduleQueue(self.spread_windows)
+        updated_since = self.load_schedules(queue)
+        next_refresh = time.time() + CONF.scheduler.schedule_refresh_interval
+        next_resync = time.time() + CONF.scheduler.schedule_resync_interval
+
+        while True:
+            self.create_due_jobs(queue, timeutils.utcnow())
+            if run_once:
+                break
+
+            now = time.time()
+            if now >= next_resync:
+                updated_since = self.load_schedules(queue)
+                next_resync = now + CONF.scheduler.schedule_resync_interval
+                next_refresh = now + CONF.scheduler.schedule_refresh_interval
+            elif now >= next_refresh:
+                updated_since = self.load_schedules(queue, updated_since)
+                next_refresh = now + CONF.scheduler.schedule_refresh_interval
+
+            # sleep until the next schedule is due or changes are fetched
+            wake_at = min(next_refresh, next_resync)
+            next_run = queue.next_run()
+            if next_run is not None:
+                due_in = next_run - timeutils.utcnow()
+                wake_at = min(wake_at, time.time() + due_in.total_seconds())
+            seconds = wake_at - time.time()
+            if seconds > 0:
+                time.sleep(seconds)
+
+    def load_schedules(self, queue, updated_since=None):
+        """Put new and changed schedules in the queue.
+
+        Without updated_since all schedules are loaded and those missing
+        from the API are removed. Returns the updated_since to pass for
+        the following changes.
+        """
+        full_load = updated_since is None
+        filter_args = self._shard_filter_args()
+        if not full_load:
+            filter_args['updated_since'] = updated_since
+
+        schedule_ids = set()
+        for schedule in self.client.list_schedules(filter_args=filter_args):
+            schedule_ids.add(schedule['id'])
+            # NOTE: API times have second resolution and updated_since
+            # matches changes at that time too, so changes made in the
+            # same second are fetched again on the next refresh.
+            if updated_since is None or schedule['updated_at'] > updated_since:
+                updated_since = schedule['updated_at']
+            queue.put(schedule)
+
+        if full_load:
+            for schedule_id in queue.schedule_ids() - schedule_ids:
+                queue.remove(schedule_id)
+        return updated_since
+
+    def create_due_jobs(self, queue, now):
+        schedule_ids = queue.pop_due(now)
+        if schedule_ids:
+            LOG.debug(_('Creating new jobs'))
+            for schedule_id in self.create_jobs(schedule_ids):
+                queue.remove(schedule_id)
+
+
+class ScheduleQueue(object):
+    """Schedules in a heap ordered by next run.
+
+    Changed and removed schedules leave their old entries in the heap,
+    those are skipped when they come up. Next runs are delayed by the
+    offset of each schedule within the spread window of its action.
+    """
+
+    def __init__(self, spread_windows=None):
+        self.spread_windows = spread_windows or {}
+        self._heap = []
+        # schedule id -> ((cron fields, next_run from the API, action),
+        #                 spread offset, next_run)
+        self._schedules = {}
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def schedule_ids(self):
+        return set(self._schedules)
+
+    def put(self, schedule):
+        """Add a schedule as returned by the API, unless it is unchanged.
+
+        A schedule keeps the next run computed here after its jobs were
+        created until the API returns a different next_run or cron
+        fields, as creating jobs does not advance next_run in the API.
+        """
+        fields = tuple(schedule.get(key) for key in _CRON_KEYS)
+        loaded = (fields, schedule.get('next_run'), schedule.get('action'))
+        current = self._schedules.get(schedule['id'])
+        if current is not None and current[0] == loaded:
+            return
+
+        offset = datetime.timedelta(seconds=utils.spread_offset(
+            schedule['id'], self.spread_windows.get(loaded[2], 0)))
+        next_run = None
+        if loaded[1] is not None:
+            next_run = _parse_time(loaded[1]) + offset
+        self._push(schedule['id'], loaded, offset, next_run)
+
+    def remove(self, schedule_id):
+        self._schedules.pop(schedule_id, None)
+
+    def next_run(self):
+        """Return the earliest next run, or None if nothing is queued."""
+        while self._heap:
+            next_run, schedule_id = self._heap[0]
+            current = self._schedules.get(schedule_id)
+            if current is not None and current[2] == next_run:
+                return next_run
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now):
+        """Return the ids of schedules due at now and queue their next run.
+        """
+        due = []
+        while True:
+            next_run = self.next_run()
+            if next_run is None or next_run > now:
+                return due
+            schedule_id = heapq.heappop(self._heap)[1]
+            due.append(schedule_id)
+            loaded, offset, next_run = self._schedules[schedule_id]
+            try:
+                next_run = utils.compile_cron(*loaded[0])\
+                                .next_after(now - offset) + offset
+            except ValueError:
+                next_run = None
+            self._push(schedule_id, loaded, offset, next_run)
+
+    def _push(self, schedule_id, loaded, offset, next_run):
+        self._schedules[schedule_id] = (loaded, offset, next_run)
+        if next_run is not None:
+            heapq.heappush(self._heap, (next_run, schedule_id))
+
+
+def parse_spread_windows(values):
+    """Returns a dict of action to seconds from action:seconds pairs."""
+    spread_windows = {}
+    for value in values:
+        action, sep, seconds = value.rpartition(':')
+        try:
+            seconds = int(seconds)
+        except ValueError:
+            seconds = -1
+        if not sep or seconds < 0:
+            msg = _('Spread windows must be action:seconds pairs, not %s')
+            raise ValueError(msg % value)
+        spread_windows[action] = seconds
+    return spread_windows
+
 
-        return self.client.list_schedules(filter_args=filter_args)
+def _parse_time(value):
+    return timeutils.normalize_time(timeutils.parse_isotime(value))
@@ -1,3 +1,4 @@
+import datetime
 import uuid
 from datetime import timedelta
 
@@ -90,6 +91,37 @@ class TestSchedulesDBApi(utils.BaseTestCase):
         self.assertEqual(len(schedules), 1)
         self.assertEqual(schedules[0]['id'], self.schedule_1['id'])
 
+    def test_schedule_get_all_paginated(self):
+        schedule_3 = self._create_basic_schedule()
+        expected = [self.schedule_1['id'], self.schedule_2['id'],
+                    schedule_3['id']]
+        actual = []
+        filter_args = {'limit': 2}
+        while True:
+            schedules = self.db_api.schedule_get_all(filter_args=filter_args)
+            self.assertTrue(len(schedules) <= 2)
+            actual.extend([schedule['id'] for schedule in schedules])
+            if len(schedules) < 2:
+                break
+            filter_args['marker'] = schedules[-1]['id']
+        self.assertEqual(sorted(actual), sorted(expected))
+        self.assertEqual(len(actual), 3)
+
+    def test_schedule_get_all_paginated_with_filter(self):
+        filter_args = {'tenant_id': str(TENANT_1), 'limit': 1}
+        schedules = self.db_api.schedule_get_all(filter_args=filter_args)
+        self.assertEqual(len(schedules), 1)
+        self.assertEqual(schedules[0]['id'], self.schedule_1['id'])
+        self.assertEqual(len(schedules[0]['schedule_metadata']), 1)
+        filter_args['marker'] = schedules[0]['id']
+        schedules = self.db_api.schedule_get_all(filter_args=filter_args)
+        self.assertEqual(len(schedules), 0)
+
+    def test_schedule_get_all_marker_not_found(self):
+        filter_args = {'marker': str(uuid.uuid4())}
+        self.assertRaises(exception.NotFound, self.db_api.schedule_get_all,
+                          filter_args=filter_args)
+
     def test_schedule_get_all_tenant_id_filter(self):
         filters = {}
         filters['tenant_id'] = str(TENANT_1)
@@ -116,6 +148,36 @@ class TestSchedulesDBApi(utils.BaseTestCase):
         schedules = self.db_api.schedule_get_all(filter_args=filters)
         self.assertEqual(len(schedules), 2)
 
+    def test_schedule_get_updated_since_filter(self):
+        updated_since = self.schedule_2['updated_at'] + timedelta(seconds=1)
+        timeutils.set_time_override(updated_since)
+        self.db_api.schedule_update(self.schedule_1['id'], {'hour': 4})
+        timeutils.clear_time_override()
+
+        filters = {'updated_since': updated_since}
+        schedules = self.db_api.schedule_get_all(filter_args=filters)
+        self.assertEqual(len(schedules), 1)
+        self.assertEqual(schedules[0]['id'], self.schedule_1['id'])
+
+        filters = {'updated_since': self.schedule_1['created_at']}
+        schedules = self.db_api.schedule_get_all(filter_args=filters)
+        self.assertEqual(len(schedules), 2)
+
+    def test_schedule_get_shard_filter(self):
+        for i in range(10):
+            self._create_basic_schedule()
+        all_ids = set(schedule['id']
+                      for schedule in self.db_api.schedule_get_all())
+
+        shard_ids = set()
+        for shard in range(3):
+            filters = {'shard': shard, 'shard_count': 3}
+            schedules = self.db_api.schedule_get_all(filter_args=filters)
+            ids = set(schedule['id'] for schedule in schedules)
+            self.assertFalse(ids & shard_ids)
+            shard_ids |= ids
+        self.assertEqual(shard_ids, all_ids)
+
     def test_schedule_get_by_id(self):
         fixture = {
             'tenant_id': str(uuid.uuid4()),
@@ -144,6 +206,115 @@ class TestSchedulesDBApi(utils.BaseTestCase):
         self.assertNotEqual(actual['created_at'], None)
         self.assertNotEqual(actual['updated_at'], None)
 
+    def test_schedule_get_by_ids(self):
+        schedule_ids = [self.schedule_1['id'], str(uuid.uuid4()),
+                        self.schedule_2['id']]
+        schedules = self.db_api.schedule_get_by_ids(schedule_ids)
+        self.assertEqual(len(schedules), 2)
+        schedules = dict((s['id'], s) for s in schedules)
+        metadata = schedules[self.schedule_1['id']]['schedule_metadata']
+        self.assertEqual(len(metadata), 1)
+        self.assertEqual(metadata[0]['key'], 'instance_id')
+        self.assertEqual(metadata[0]['value'], 'my_instance_1')
+        self.assertEqual(
+            len(schedules[self.schedule_2['id']]['schedule_metadata']), 0)
+
+    def test_schedule_get_by_ids_none_found(self):
+        schedules = self.db_api.schedule_get_by_ids([str(uuid.uuid4())])
+        self.assertEqual(schedules, [])
+
+    def test_schedule_claim_due(self):
+        due_before = self.schedule_1['next_run']
+        timeutils.set_time_override(due_before)
+        jobs = self.db_api.schedule_claim_due(due_before)
+        timeutils.clear_time_override()
+
+        self.assertEqual(len(jobs), 1)
+        job = jobs[0]
+        self.assertEqual(job['schedule_id'], self.schedule_1['id'])
+        self.assertEqual(job['tenant_id'], self.schedule_1['tenant_id'])
+        self.assertEqual(job['action'], self.schedule_1['action'])
+        self.assertEqual(job['status'], 'queued')
+        self.assertEqual(len(job['job_metadata']), 1)
+        self.assertEqual(job['job_metadata'][0]['key'], 'instance_id')
+        self.assertEqual(job['job_metadata'][0]['value'], 'my_instance_1')
+
+        schedule = self.db_api.schedule_get_by_id(self.schedule_1['id'])
+        self.assertEqual(schedule['next_run'],
+                         due_before + timedelta(days=1))
+        self.assertEqual(schedule['last_scheduled'], due_before)
+        self.assertEqual(len(self.db_api.job_get_all()), 1)
+
+    def test_schedule_claim_due_only_once(self):
+        due_before = self.schedule_2['next_run']
+        jobs = self.db_api.schedule_claim_due(due_before)
+        self.assertEqual(len(jobs), 2)
+        jobs = self.db_api.schedule_claim_due(due_before)
+        self.assertEqual(len(jobs), 0)
+        self.assertEqual(len(self.db_api.job_get_all()), 2)
+
+    def test_schedule_claim_due_limit(self):
+        due_before = self.schedule_2['next_run']
+        jobs = self.db_api.schedule_claim_due(due_before, limit=1)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['schedule_id'], self.schedule_1['id'])
+        jobs = self.db_api.schedule_claim_due(due_before, limit=1)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['schedule_id'], self.schedule_2['id'])
+
+    def test_schedule_claim_due_nothing_due(self):
+        due_before = self.schedule_1['next_run'] - timedelta(seconds=1)
+        jobs = self.db_api.schedule_claim_due(due_before)
+        self.assertEqual(jobs, [])
+
+    def test_schedules_recompute_next_run(self):
+        start_time = self.schedule_2['next_run'] + timedelta(days=3)
+        updated = self.db_api.schedules_recompute_next_run(start_time)
+        self.assertEqual(updated, 2)
+
+        schedule_1 = self.db_api.schedule_get_by_id(self.schedule_1['id'])
+        self.assertEqual(schedule_1['next_run'],
+                         self.schedule_1['next_run'] + timedelta(days=4))
+        schedule_2 = self.db_api.schedule_get_by_id(self.schedule_2['id'])
+        self.assertEqual(schedule_2['next_run'],
+                         self.schedule_2['next_run'] + timedelta(days=4))
+        jobs = self.db_api.schedule_claim_due(schedule_1['next_run'])
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['schedule_id'], self.schedule_1['id'])
+
+    def test_schedules_recompute_next_run_shared_fields(self):
+        fixture = {
+            'tenant_id': unit_utils.TENANT2,
+            'action': 'snapshot',
+            'minute': 30,
+            'hour': 2,
+        }
+        schedule = self.db_api.schedule_create(fixture)
+        start_time = self.schedule_1['next_run']
+        updated = self.db_api.schedules_recompute_next_run(start_time)
+        self.assertEqual(updated, 3)
+
+        expected = start_time + timedelta(days=1)
+        for schedule_id in (self.schedule_1['id'], schedule['id']):
+            schedule = self.db_api.schedule_get_by_id(schedule_id)
+            self.assertEqual(schedule['next_run'], expected)
+
+    def test_schedules_recompute_next_run_never_fires(self):
+        fixture = {
+            'tenant_id': unit_utils.TENANT2,
+            'action': 'snapshot',
+            'minute': 0,
+            'hour': 0,
+            'day_of_month': 31,
+            'month': 2,
+        }
+        schedule = self.db_api.schedule_create(fixture)
+        start_time = self.schedule_1['next_run']
+        updated = self.db_api.schedules_recompute_next_run(start_time)
+        self.assertEqual(updated, 2)
+        schedule = self.db_api.schedule_get_by_id(schedule['id'])
+        self.assertEqual(schedule.get('next_run'), None)
+
     def test_schedule_get_by_id_not_found(self):
         schedule_id = str(uuid.uuid4())
         self.assertRaises(exception.NotFound,
@@ -420,6 +591,22 @@ class TestWorkersDBApi(utils.BaseTestCase):
         workers = self.db_api.worker_get_all()
         self.assertEqual(len(workers), 2)
 
+    def test_worker_get_all_paginated(self):
+        first = self.db_api.worker_get_all(filter_args={'limit': 1})
+        self.assertEqual(len(first), 1)
+        filter_args = {'limit': 1, 'marker': first[0]['id']}
+        second = self.db_api.worker_get_all(filter_args=filter_args)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0]['id'], second[0]['id'])
+        filter_args = {'limit': 1, 'marker': second[0]['id']}
+        self.assertEqual(self.db_api.worker_get_all(filter_args=filter_args),
+                         [])
+
+    def test_worker_get_all_marker_not_found(self):
+        filter_args = {'marker': str(uuid.uuid4())}
+        self.assertRaises(exception.NotFound, self.db_api.worker_get_all,
+                          filter_args=filter_args)
+
     def test_worker_get_by_id(self):
         actual = self.db_api.worker_get_by_id(self.worker_1['id'])
         self.assertEquals(actual['id'], self.worker_1['id'])
@@ -574,6 +761,59 @@ class TestJobsDBApi(utils.BaseTestCase):
         self.assertEqual(metadata[0]['value'],
                          fixture['job_metadata'][0]['value'])
 
+    def test_job_create_many(self):
+        fixtures = [
+            {
+                'action': 'snapshot',
+                'tenant_id': unit_utils.TENANT1,
+                'schedule_id': unit_utils.SCHEDULE_UUID1,
+                'status': 'queued',
+            },
+            {
+                'action': 'snapshot',
+                'tenant_id': unit_utils.TENANT2,
+                'schedule_id': unit_utils.SCHEDULE_UUID2,
+                'status': 'queued',
+                'job_metadata': [
+                    {
+                        'key': 'instance_id',
+                        'value': 'my_instance',
+                    },
+                ],
+            },
+        ]
+
+        timeutils.set_time_override()
+        now = timeutils.utcnow()
+        jobs = self.db_api.job_create_many(fixtures)
+        timeutils.clear_time_override()
+
+        self.assertEqual(len(jobs), 2)
+        for job, fixture in zip(jobs, fixtures):
+            self.assertTrue(uuidutils.is_uuid_like(job['id']))
+            self.assertEqual(job['schedule_id'], fixture['schedule_id'])
+            self.assertEqual(job['tenant_id'], fixture['tenant_id'])
+            self.assertEqual(job['worker_id'], None)
+            self.assertEqual(job['retry_count'], 0)
+            self.assertEqual(job['timeout'], now + timedelta(seconds=30))
+            self.assertEqual(job['hard_timeout'],
+                             now + timedelta(seconds=30))
+        self.assertEqual(len(jobs[0]['job_metadata']), 0)
+        metadata = jobs[1]['job_metadata']
+        self.assertEqual(len(metadata), 1)
+        self.assertEqual(metadata[0]['key'], 'instance_id')
+        self.assertEqual(metadata[0]['value'], 'my_instance')
+        self.assertEqual(len(self.db_api.job_get_all()), 4)
+
+    def test_job_create_many_missing_value(self):
+        fixtures = [
+            {'action': 'snapshot', 'tenant_id': unit_utils.TENANT1},
+            {'action': 'snapshot'},
+        ]
+        self.assertRaises(exception.MissingValue,
+                          self.db_api.job_create_many, fixtures)
+        self.assertEqual(len(self.db_api.job_get_all()), 2)
+
     def test_jobs_cleanup_hard_timed_out(self):
         workers = self.db_api.job_get_all()
         self.assertEqual(len(workers), 2)
@@ -588,6 +828,40 @@ class TestJobsDBApi(utils.BaseTestCase):
         workers = self.db_api.job_get_all()
         self.assertEqual(len(workers), 2)
 
+    def test_job_get_all_paginated(self):
+        job_3 = self._create_basic_job()
+        jobs = self.db_api.job_get_all(filter_args={'limit': 2})
+        self.assertEqual(len(jobs), 2)
+        filter_args = {'limit': 2, 'marker': jobs[-1]['id']}
+        jobs.extend(self.db_api.job_get_all(filter_args=filter_args))
+        self.assertEqual(len(jobs), 3)
+        self.assertEqual(sorted([job['id'] for job in jobs]),
+                         sorted([self.job_1['id'], self.job_2['id'],
+                                 job_3['id']]))
+        for job in jobs:
+            self.assertTrue('job_metadata' in job)
+
+    def test_job_get_all_paginated_same_created_at(self):
+        timeutils.set_time_override()
+        job_ids = set([self._create_basic_job()['id'] for i in range(3)])
+        timeutils.clear_time_override()
+        job_ids.update([self.job_1['id'], self.job_2['id']])
+
+        seen = []
+        filter_args = {'limit': 1}
+        jobs = self.db_api.job_get_all(filter_args=filter_args)
+        while jobs:
+            seen.append(jobs[0]['id'])
+            filter_args['marker'] = jobs[0]['id']
+            jobs = self.db_api.job_get_all(filter_args=filter_args)
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), job_ids)
+
+    def test_job_get_all_marker_not_found(self):
+        filter_args = {'marker': str(uuid.uuid4())}
+        self.assertRaises(exception.NotFound, self.db_api.job_get_all,
+                          filter_args=filter_args)
+
     def test_job_get_by_id(self):
         expected = self.job_1
         actual = self.db_api.job_get_by_id(self.job_1['id'])
@@ -623,6 +897,33 @@ class TestJobsDBApi(utils.BaseTestCase):
         self.assertRaises(exception.NotFound,
                           self.db_api.job_status_get_by_id, str(uuid.uuid4))
 
+    def test_job_updated_at_update(self):
+        updated_at = datetime.datetime(2012, 11, 16, 18, 41, 43)
+        self.db_api.job_updated_at_update(self.job_1['id'], updated_at)
+        job = self.db_api.job_get_by_id(self.job_1['id'])
+        self.assertEqual(job['updated_at'], updated_at)
+        self.assertEqual(job['status'], self.job_1['status'])
+
+    def test_job_updated_at_update_job_not_found(self):
+        self.assertRaises(exception.NotFound,
+                          self.db_api.job_updated_at_update,
+                          str(uuid.uuid4()), timeutils.utcnow())
+
+    def test_job_status_update(self):
+        timeutils.set_time_override()
+        timeutils.advance_time_seconds(10)
+        self.db_api.job_status_update(self.job_1['id'], 'done')
+        job = self.db_api.job_get_by_id(self.job_1['id'])
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['updated_at'], timeutils.utcnow())
+        self.assertEqual(job['worker_id'], self.job_1['worker_id'])
+        timeutils.clear_time_override()
+
+    def test_job_status_update_job_not_found(self):
+        self.assertRaises(exception.NotFound,
+                          self.db_api.job_status_update,
+                          str(uuid.uuid4()), 'done')
+
     def test_job_update(self):
         fixture = {
             'status': 'error',
@@ -640,6 +941,23 @@ class TestJobsDBApi(utils.BaseTestCase):
         self.assertEqual(updated['status'], 'error')
         self.assertEqual(updated['retry_count'], 2)
 
+    def test_job_heartbeats_update(self):
+        updated_at = datetime.datetime(2012, 11, 16, 18, 41, 43)
+        job_ids = [self.job_1['id'], self.job_2['id'], str(uuid.uuid4())]
+        updated = self.db_api.job_heartbeats_update(unit_utils.WORKER_UUID1,
+                                                    job_ids, updated_at)
+        self.assertEqual(updated, 1)
+        job_1 = self.db_api.job_get_by_id(self.job_1['id'])
+        self.assertEqual(job_1['updated_at'], updated_at)
+        job_2 = self.db_api.job_get_by_id(self.job_2['id'])
+        self.assertEqual(job_2['updated_at'], self.job_2['updated_at'])
+
+    def test_job_heartbeats_update_none(self):
+        updated_at = datetime.datetime(2012, 11, 16, 18, 41, 43)
+        updated = self.db_api.job_heartbeats_update(unit_utils.WORKER_UUID1,
+                                                    [], updated_at)
+        self.assertEqual(updated, 0)
+
     def test_job_update_metadata(self):
         fixture = {
             'job_metadata': [
@@ -862,3 +1180,47 @@ class TestJobsDBGetNextJobApi(utils.BaseTestCase):
         self.assertEqual(job['timeout'], timeout)
         self.assertEqual(job['hard_timeout'], hard_timeout)
         self.assertEqual(job['retry_count'], expected['retry_count'] + 1)
+
+    def test_get_next_job_assigns_each_job_once(self):
+        timeutils.set_time_override()
+        fixture_3 = self.job_fixture_1.copy()
+        fixture_3['schedule_id'] = unit_utils.SCHEDULE_UUID2
+        self._create_jobs(10, self.job_fixture_1, fixture_3)
+        job_1 = db_api.job_get_and_assign_next_by_action(
+            'snapshot', unit_utils.WORKER_UUID1)
+        job_2 = db_api.job_get_and_assign_next_by_action(
+            'snapshot', unit_utils.WORKER_UUID2)
+        self.assertEqual(job_1['id'], self.jobs[0]['id'])
+        self.assertEqual(job_1['worker_id'], unit_utils.WORKER_UUID1)
+        self.assertEqual(job_2['id'], self.jobs[1]['id'])
+        self.assertEqual(job_2['worker_id'], unit_utils.WORKER_UUID2)
+        self.assertRaises(exception.NotFound,
+                          db_api.job_get_and_assign_next_by_action,
+                          'snapshot', uuidutils.generate_uuid())
+
+    def test_get_next_jobs_max_jobs(self):
+        timeutils.set_time_override()
+        fixture_3 = self.job_fixture_1.copy()
+        fixture_3['schedule_id'] = unit_utils.SCHEDULE_UUID2
+        self._create_jobs(1, self.job_fixture_1, self.job_fixture_2,
+                          fixture_3)
+        jobs = db_api.jobs_get_and_assign_next_by_action(
+            'snapshot', unit_utils.WORKER_UUID1, 5)
+        self.assertEqual([job['id'] for job in jobs],
+                         [self.jobs[0]['id'], self.jobs[2]['id']])
+        for job in jobs:
+            self.assertEqual(job['worker_id'], unit_utils.WORKER_UUID1)
+            self.assertEqual(job['retry_count'], 1)
+
+        jobs = db_api.jobs_get_and_assign_next_by_action(
+            'snapshot', unit_utils.WORKER_UUID1, 5)
+        self.assertEqual(jobs, [])
+
+    def test_get_next_jobs_max_jobs_limits_jobs(self):
+        timeutils.set_time_override()
+        fixture_3 = self.job_fixture_1.copy()
+        fixture_3['schedule_id'] = unit_utils.SCHEDULE_UUID2
+        self._create_jobs(10, self.job_fixture_1, fixture_3)
+        jobs = db_api.jobs_get_and_assign_next_by_action(
+            'snapshot', unit_utils.WORKER_UUID1, 1)
+        self.assertEqual([job['id'] for job in jobs], [self.jobs[0]['id']])
@@ -8,6 +8,7 @@ from qonos.openstack.common import cfg
 from qonos.openstack.common import timeutils
 from qonos.openstack.common import wsgi
 from qonos.tests import utils as utils
+from qonos.qonosclient import async_client
 from qonos.qonosclient import client
 from qonos.qonosclient import exception as client_exc
 
@@ -43,6 +44,7 @@ class TestApi(utils.BaseTestCase):
         for worker in workers:
             self.client.delete_worker(worker['id'])
 
+        self.client.close()
         self.service.stop()
 
     def test_workers_workflow(self):
@@ -90,7 +92,9 @@ class TestApi(utils.BaseTestCase):
 
         self.client.create_job(schedule['id'])
 
-        next_job = self.client.get_next_job(worker['id'], 'snapshot')
+        next_jobs = self.client.get_next_job(worker['id'], 'snapshot')
+        self.assertEqual(len(next_jobs), 1)
+        next_job = next_jobs[0]
         self.assertIsNotNone(next_job.get('id'))
         self.assertEqual(next_job['schedule_id'], schedule['id'])
         self.assertEqual(next_job['tenant_id'], schedule['tenant_id'])
@@ -99,6 +103,20 @@ class TestApi(utils.BaseTestCase):
         self.assertMetadataInList(next_job['job_metadata'], meta1)
         self.assertMetadataInList(next_job['job_metadata'], meta2)
 
+        # get several jobs for worker
+        self.client.create_jobs([schedule['id']])
+        self.client.create_jobs([schedule['id']])
+        next_jobs = self.client.get_next_job(worker['id'], 'snapshot',
+                                             max_jobs=3)
+        self.assertEqual(len(next_jobs), 2)
+        for next_job in next_jobs:
+            self.assertEqual(next_job['worker_id'], worker['id'])
+            self.assertEqual(next_job['schedule_id'], schedule['id'])
+
+        # heartbeat jobs of worker
+        job_ids = [next_job['id'] for next_job in next_jobs]
+        self.assertEqual(self.client.job_heartbeats(worker['id'], job_ids), 2)
+
         # get job for worker no jobs left for action
         self.assertRaises(client_exc.NotFound, self.client.get_next_job,
                           worker['id'], 'snapshot')
@@ -190,6 +208,25 @@ class TestApi(utils.BaseTestCase):
         schedules = self.client.list_schedules(filter_args=filter)
         self.assertEqual(len(schedules), 0)
 
+        #claim due schedules
+        jobs = self.client.claim_due_schedules(
+            due_before='2011-11-30T15:23:00Z')
+        self.assertEqual(len(jobs), 0)
+        jobs = self.client.claim_due_schedules(
+            due_before=schedule['next_run'], limit=10)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['schedule_id'], schedule['id'])
+        claimed = self.client.get_schedule(schedule['id'])
+        self.assertTrue(claimed['next_run'] > schedule['next_run'])
+        self.client.delete_job(jobs[0]['id'])
+
+        #recompute next runs
+        updated = self.client.recompute_schedules_next_run(
+            start_time=schedule['next_run'])
+        self.assertEqual(updated, 1)
+        recomputed = self.client.get_schedule(schedule['id'])
+        self.assertEqual(recomputed['next_run'], claimed['next_run'])
+
         #update schedule
         request = {'schedule': {'hour': 14}}
         updated_schedule = self.client.update_schedule(schedule['id'], request)
@@ -200,6 +237,12 @@ class TestApi(utils.BaseTestCase):
         self.assertEqual(updated_schedule['hour'], request['schedule']['hour'])
         self.assertNotEqual(updated_schedule['hour'], schedule['hour'])
 
+        #list schedules, updated_since filter
+        filter = {'updated_since': updated_schedule['updated_at']}
+        schedules = self.client.list_schedules(filter_args=filter)
+        self.assertEqual(len(schedules), 1)
+        self.assertEqual(schedules[0]['id'], schedule['id'])
+
         # delete schedule
         self.client.delete_schedule(schedule['id'])
 
@@ -293,6 +336,16 @@ class TestApi(utils.BaseTestCase):
         self.assertMetadataInList(new_job['job_metadata'], meta1)
         self.assertMetadataInList(new_job['job_metadata'], meta2)
 
+        # create jobs in a batch
+        results = self.client.create_jobs([schedule['id'], 'missing'])
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]['schedule_id'], schedule['id'])
+        self.assertEqual(results[0]['job']['schedule_id'], schedule['id'])
+        self.assertMetadataInList(results[0]['job']['job_metadata'], meta1)
+        self.assertEqual(results[1]['schedule_id'], 'missing')
+        self.assertTrue('error' in results[1])
+        self.client.delete_job(results[0]['job']['id'])
+
         # list jobs
         jobs = self.client.list_jobs()
         self.assertEqual(len(jobs), 1)
@@ -301,6 +354,14 @@ class TestApi(utils.BaseTestCase):
         self.assertEqual(jobs[0]['status'], new_job['status'])
         self.assertEqual(jobs[0]['retry_count'], new_job['retry_count'])
 
+        # iterate jobs one page at a time
+        results = self.client.create_jobs([schedule['id']])
+        jobs = list(self.client.iter_jobs(page_size=1))
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(set([job['id'] for job in jobs]),
+                         set([new_job['id'], results[0]['job']['id']]))
+        self.client.delete_job(results[0]['job']['id'])
+
         # get job
         job = self.client.get_job(new_job['id'])
         self.assertEqual(job['id'], new_job['id'])
@@ -345,3 +406,34 @@ class TestApi(utils.BaseTestCase):
         # make sure job no longer exists
         self.assertRaises(client_exc.NotFound, self.client.get_job,
                           job['id'])
+
+    def test_async_client(self):
+        request = {
+            'schedule':
+            {
+                'tenant_id': TENANT1,
+                'action': 'snapshot',
+                'minute': 30,
+                'hour': 12,
+            }
+        }
+        schedule = self.client.create_schedule(request)
+
+        api_client = async_client.AsyncClient('localhost', self.port,
+                                              concurrency=5)
+        requests = [api_client.create_job(schedule['id']) for i in range(10)]
+        jobs = [request.wait() for request in requests]
+        self.assertEqual(len(set(job['id'] for job in jobs)), 10)
+
+        requests = [api_client.job_heartbeat(job['id']) for job in jobs]
+        api_client.waitall()
+        for request in requests:
+            request.wait()
+
+        requests = [api_client.get_job(job['id']) for job in jobs]
+        for job, request in zip(jobs, requests):
+            self.assertEqual(request.wait()['id'], job['id'])
+
+        request = api_client.get_job('unknown')
+        self.assertRaises(client_exc.NotFound, request.wait)
+        api_client.close()
@@ -0,0 +1,85 @@
+import signal
+
+import eventlet
+import eventlet.event
+from eventlet.green import httplib
+from eventlet.green import socket
+
+from qonos.api import api
+from qonos.tests import utils as test_utils
+
+
+class TestAPI(test_utils.BaseTestCase):
+
+    def test_simple_db_refuses_workers(self):
+        self.stubs.Set(api.CONF, 'db_api', 'qonos.db.simple.api')
+        self.config(workers=2, group='api')
+        self.assertRaises(RuntimeError, api.API(None).run)
+
+
+class FakeDbApi(object):
+
+    def __init__(self):
+        self.disposed = 0
+
+    def dispose_engine(self):
+        self.disposed += 1
+
+
+class TestAPIService(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestAPIService, self).setUp()
+        self.addCleanup(signal.signal, signal.SIGHUP,
+                        signal.getsignal(signal.SIGHUP))
+        self.release = eventlet.event.Event()
+        self.db_api = FakeDbApi()
+        self.service = api.APIService(self._app,
+                                      eventlet.listen(('127.0.0.1', 0)),
+                                      self.db_api)
+        self.service.start()
+        self.port = self.service.sock.getsockname()[1]
+
+    def _app(self, environ, start_response):
+        self.release.wait()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return ['done']
+
+    def _get(self):
+        conn = httplib.HTTPConnection('127.0.0.1', self.port)
+        conn.request('GET', '/')
+        response = conn.getresponse()
+        return response.status, response.read()
+
+    def _wait_for_active(self, count):
+        while self.service.active != count:
+            eventlet.sleep(0.01)
+
+    def test_stop_finishes_requests_in_flight(self):
+        request = eventlet.spawn(self._get)
+        self._wait_for_active(1)
+        stopping = eventlet.spawn(self.service.stop)
+        eventlet.sleep(0.2)
+        self.assertFalse(self.service.stopped.ready())
+        self.release.send()
+        self.assertEqual(request.wait(), (200, 'done'))
+        stopping.wait()
+        self.assertTrue(self.service.stopped.ready())
+        self.assertEqual(self.db_api.disposed, 0)
+
+    def test_stop_closes_idle_connections(self):
+        idle = eventlet.connect(('127.0.0.1', self.port))
+        eventlet.sleep(0.1)
+        self.service.stop()
+        self.assertEqual(idle.recv(1), '')
+        self.assertEqual(self.service.connections, {})
+
+    def test_stop_gives_up_after_drain_timeout(self):
+        self.config(drain_timeout=0, group='api')
+        request = eventlet.spawn(self._get)
+        self._wait_for_active(1)
+        self.service.stop()
+        self.assertTrue(self.service.stopped.ready())
+        self.assertEqual(self.db_api.disposed, 1)
+        self.assertRaises((httplib.HTTPException, socket.error),
+                          request.wait)
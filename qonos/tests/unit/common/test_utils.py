@@ -1,4 +1,8 @@
 import datetime
+import random
+import uuid
+
+from croniter.croniter import croniter
 
 from qonos.common import utils
 from qonos.openstack.common import timeutils
@@ -61,3 +65,175 @@ class TestUtils(test_utils.BaseTestCase):
                                                       hour=hour)
 
         self.assertTrue(next_run > timeutils.utcnow())
+
+    def test_cron_string_to_next_datetime_start_time(self):
+        start_time = datetime.datetime(2012, 11, 27, 2, 30)
+        next_run = utils.cron_string_to_next_datetime(minute=0,
+                                                      start_time=start_time)
+        self.assertEqual(next_run, datetime.datetime(2012, 11, 27, 3, 0))
+
+    def test_schedule_to_next_run(self):
+        start_time = datetime.datetime(2012, 11, 27, 2, 30)
+        schedule = {'minute': 15, 'hour': 4, 'day_of_month': None}
+        next_run = utils.schedule_to_next_run(schedule, start_time)
+        self.assertEqual(next_run, datetime.datetime(2012, 11, 27, 4, 15))
+
+    def test_spread_offset(self):
+        offsets = [utils.spread_offset(str(uuid.uuid4()), 60)
+                   for i in range(1000)]
+        self.assertTrue(min(offsets) >= 0)
+        self.assertTrue(max(offsets) < 60)
+        self.assertTrue(len(set(offsets)) > 50)
+        schedule_id = str(uuid.uuid4())
+        self.assertEqual(utils.spread_offset(schedule_id, 60),
+                         utils.spread_offset(schedule_id, 60))
+        self.assertEqual(utils.spread_offset(schedule_id, 0), 0)
+
+    def test_shard_id_range(self):
+        self.assertEqual(utils.shard_id_range(0, 1), (None, None))
+        self.assertEqual(utils.shard_id_range(0, 4), (None, '40000000'))
+        self.assertEqual(utils.shard_id_range(1, 4),
+                         ('40000000', '80000000'))
+        self.assertEqual(utils.shard_id_range(3, 4), ('c0000000', None))
+
+
+class TestCronExpression(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCronExpression, self).setUp()
+        self.start_time = datetime.datetime(2012, 11, 27, 2, 30)
+
+    def _next_after(self, *fields):
+        return utils.CronExpression(*fields).next_after(self.start_time)
+
+    def test_parse_fields(self):
+        expression = utils.CronExpression('*/15', '1-3', '1,15', 'jan-mar',
+                                          'mon-fri/2')
+        self.assertEqual(expression.minutes, 1 | 1 << 15 | 1 << 30 | 1 << 45)
+        self.assertEqual(expression.hours, 1 << 1 | 1 << 2 | 1 << 3)
+        self.assertEqual(expression.days, 1 << 1 | 1 << 15)
+        self.assertEqual(expression.months, 1 << 1 | 1 << 2 | 1 << 3)
+        self.assertEqual(expression.days_of_week, 1 << 1 | 1 << 3 | 1 << 5)
+
+    def test_parse_sunday_as_seven(self):
+        expression = utils.CronExpression(day_of_week='5-7')
+        self.assertEqual(expression.days_of_week, 1 | 1 << 5 | 1 << 6)
+
+    def test_parse_invalid(self):
+        for fields in (('60',), ('*', '24'), ('*', '*', '0'),
+                       ('*', '*', '*', 'foo'), ('5-1',), ('*/0',)):
+            self.assertRaises(ValueError, utils.CronExpression, *fields)
+
+    def test_next_after(self):
+        self.assertEqual(self._next_after(0),
+                         datetime.datetime(2012, 11, 27, 3, 0))
+        self.assertEqual(self._next_after(30, 2),
+                         datetime.datetime(2012, 11, 28, 2, 30))
+        self.assertEqual(self._next_after('*/7', '1-3', '*', '*', 'mon-fri'),
+                         datetime.datetime(2012, 11, 27, 2, 35))
+        self.assertEqual(self._next_after(0, 0, '*', 'jan,jun'),
+                         datetime.datetime(2013, 1, 1, 0, 0))
+
+    def test_next_after_step_one_from_value(self):
+        start_time = datetime.datetime(2013, 7, 2, 15, 33)
+        expression = utils.CronExpression(0, '*', '*', '*', '1/1')
+        self.assertEqual(expression.next_after(start_time),
+                         datetime.datetime(2013, 7, 2, 16, 0))
+        expression = utils.CronExpression('10/1')
+        self.assertEqual(expression.next_after(start_time),
+                         datetime.datetime(2013, 7, 2, 15, 34))
+
+    def test_next_after_skips_seconds(self):
+        start_time = datetime.datetime(2012, 11, 27, 2, 29, 59, 999)
+        expression = utils.CronExpression(30, 2)
+        self.assertEqual(expression.next_after(start_time),
+                         datetime.datetime(2012, 11, 27, 2, 30))
+
+    def test_next_after_day_of_month_or_week(self):
+        self.assertEqual(self._next_after(0, 0, 1, '*', 'mon'),
+                         datetime.datetime(2012, 12, 1, 0, 0))
+        self.assertEqual(self._next_after(0, 0, '*', '*', 7),
+                         datetime.datetime(2012, 12, 2, 0, 0))
+
+    def test_next_after_leap_day(self):
+        self.assertEqual(self._next_after(0, 0, 29, 2),
+                         datetime.datetime(2016, 2, 29, 0, 0))
+
+    def test_next_after_never(self):
+        self.assertRaises(ValueError, self._next_after, 0, 0, 31, 2)
+
+    def test_next_after_matches_croniter(self):
+        rand = random.Random(2)
+
+        def field(low, high):
+            kind = rand.random()
+            if kind < 0.4:
+                return '*'
+            elif kind < 0.6:
+                return str(rand.randint(low, high))
+            elif kind < 0.8:
+                first = rand.randint(low, high)
+                return '%d-%d/%d' % (first, rand.randint(first, high),
+                                     rand.randint(1, 5))
+            elif kind < 0.85:
+                return '*/%d' % rand.randint(2, 10)
+            elif kind < 0.9:
+                return '%d/%d' % (rand.randint(low, high),
+                                  rand.randint(1, 5))
+            return ','.join(str(rand.randint(low, high)) for i in range(3))
+
+        for i in range(500):
+            fields = [field(0, 59), field(0, 23), field(1, 31),
+                      field(1, 12), field(0, 6)]
+            # NOTE: croniter skips the first days of March when it starts
+            # from the end of February, so start early in the month.
+            start_time = datetime.datetime(rand.randint(2012, 2020),
+                                           rand.randint(1, 12),
+                                           rand.randint(1, 20),
+                                           rand.randint(0, 23),
+                                           rand.randint(0, 59))
+            try:
+                expected = croniter(' '.join(fields), start_time).get_next(
+                    datetime.datetime)
+            except Exception:
+                continue
+            actual = utils.CronExpression(*fields).next_after(start_time)
+            self.assertEqual(actual, expected, (fields, start_time))
+
+    def test_next_n(self):
+        expression = utils.CronExpression(0, '*/8')
+        self.assertEqual(expression.next_n(self.start_time, 4),
+                         [datetime.datetime(2012, 11, 27, 8, 0),
+                          datetime.datetime(2012, 11, 27, 16, 0),
+                          datetime.datetime(2012, 11, 28, 0, 0),
+                          datetime.datetime(2012, 11, 28, 8, 0)])
+
+    def test_fire_times(self):
+        expression = utils.CronExpression(30, '*/8')
+        end_time = datetime.datetime(2012, 11, 28, 8, 30)
+        self.assertEqual(expression.fire_times(self.start_time, end_time),
+                         [datetime.datetime(2012, 11, 27, 8, 30),
+                          datetime.datetime(2012, 11, 27, 16, 30),
+                          datetime.datetime(2012, 11, 28, 0, 30),
+                          datetime.datetime(2012, 11, 28, 8, 30)])
+        self.assertEqual(expression.fire_times(end_time, end_time), [])
+
+    def test_compile_cron_cached(self):
+        expression = utils.compile_cron(30, 2)
+        self.assertTrue(utils.compile_cron('30', '2', '', None) is
+                        expression)
+        self.assertFalse(utils.compile_cron(30, 3) is expression)
+
+
+class TestLRUCache(test_utils.BaseTestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
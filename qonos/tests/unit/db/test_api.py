@@ -0,0 +1,28 @@
+from eventlet import tpool
+
+import qonos.db
+from qonos.tests import utils as utils
+
+
+class TestGetApi(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestGetApi, self).setUp()
+        self.stubs.Set(qonos.db.CONF, 'db_api', 'qonos.db.simple.api')
+
+    def tearDown(self):
+        super(TestGetApi, self).tearDown()
+        tpool.killall()
+
+    def test_get_api(self):
+        db_api = qonos.db.get_api()
+        self.assertFalse(isinstance(db_api, tpool.Proxy))
+
+    def test_get_api_tpool(self):
+        self.config(sql_use_tpool=True)
+        db_api = qonos.db.get_api()
+        self.assertTrue(isinstance(db_api, tpool.Proxy))
+        worker = db_api.worker_create({'host': 'host-1'})
+        self.assertEqual(db_api.worker_get_by_id(worker['id'])['host'],
+                         'host-1')
+        db_api.reset()
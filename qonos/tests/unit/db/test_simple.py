@@ -0,0 +1,354 @@
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import eventlet
+
+import qonos.db.simple.api as db_api
+from qonos.openstack.common import timeutils
+from qonos.tests import utils as utils
+
+
+class TestSimpleIndexes(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestSimpleIndexes, self).setUp()
+        self.now = datetime.datetime(2012, 11, 27, 2, 30)
+
+    def tearDown(self):
+        super(TestSimpleIndexes, self).tearDown()
+        timeutils.clear_time_override()
+        db_api.reset()
+
+    def _create_schedule(self, **kwargs):
+        values = {
+            'tenant_id': 'tenant-1',
+            'action': 'snapshot',
+            'minute': 30,
+            'hour': 2,
+            'next_run': self.now,
+        }
+        values.update(kwargs)
+        return db_api.schedule_create(values)
+
+    def _create_job(self, **kwargs):
+        values = {
+            'tenant_id': 'tenant-1',
+            'action': 'snapshot',
+        }
+        values.update(kwargs)
+        return db_api.job_create(values)
+
+    def test_sorted_index(self):
+        index = db_api.SortedIndex()
+        for key, item_id in ((3, 'c'), (1, 'a'), (2, 'b'), (2, 'a')):
+            index.add(key, item_id)
+        self.assertEqual(list(index.range()), ['a', 'a', 'b', 'c'])
+        self.assertEqual(list(index.range(2, 3)), ['a', 'b'])
+        self.assertEqual(list(index.after(2, 'a')), ['b', 'c'])
+        index.remove(2, 'a')
+        index.remove(5, 'missing')
+        self.assertEqual(list(index.range(2)), ['b', 'c'])
+
+    def test_schedule_update_reindexes(self):
+        schedule = self._create_schedule(
+            schedule_metadata=[{'key': 'instance_id', 'value': 'inst-1'}])
+        later = self.now + datetime.timedelta(hours=1)
+        db_api.schedule_update(schedule['id'], {
+            'tenant_id': 'tenant-2',
+            'next_run': later,
+            'schedule_metadata': [{'key': 'instance_id', 'value': 'inst-2'}],
+        })
+
+        def get_ids(**filter_args):
+            schedules = db_api.schedule_get_all(filter_args=filter_args)
+            return [s['id'] for s in schedules]
+
+        self.assertEqual(get_ids(tenant_id='tenant-1'), [])
+        self.assertEqual(get_ids(tenant_id='tenant-2'), [schedule['id']])
+        self.assertEqual(get_ids(instance_id='inst-1'), [])
+        self.assertEqual(get_ids(instance_id='inst-2'), [schedule['id']])
+        self.assertEqual(get_ids(next_run_before=later), [])
+        self.assertEqual(get_ids(next_run_after=later), [schedule['id']])
+
+    def test_schedule_delete_unindexes(self):
+        schedule = self._create_schedule(
+            schedule_metadata=[{'key': 'instance_id', 'value': 'inst-1'}])
+        db_api.schedule_delete(schedule['id'])
+        self.assertEqual(len(db_api.INDEXES['schedules']), 0)
+        self.assertEqual(len(db_api.INDEXES['schedules_by_next_run']), 0)
+        self.assertFalse(db_api.INDEXES['schedules_by_tenant'])
+        self.assertFalse(db_api.INDEXES['schedules_by_metadata'])
+
+    def test_schedule_get_all_returns_copies(self):
+        schedule = self._create_schedule(
+            schedule_metadata=[{'key': 'instance_id', 'value': 'inst-1'}])
+        fetched = db_api.schedule_get_all()[0]
+        fetched['tenant_id'] = 'changed'
+        fetched['schedule_metadata'][0]['value'] = 'changed'
+        actual = db_api.schedule_get_by_id(schedule['id'])
+        self.assertEqual(actual['tenant_id'], 'tenant-1')
+        self.assertEqual(actual['schedule_metadata'][0]['value'], 'inst-1')
+
+    def test_schedule_get_all_many(self):
+        for i in range(200):
+            self._create_schedule(tenant_id='tenant-%d' % (i % 4),
+                                  next_run=self.now +
+                                  datetime.timedelta(minutes=i))
+        schedules = db_api.schedule_get_all(filter_args={
+            'tenant_id': 'tenant-1',
+            'next_run_after': self.now + datetime.timedelta(minutes=50),
+            'next_run_before': self.now + datetime.timedelta(minutes=100),
+        })
+        self.assertEqual([s['next_run'].minute for s in schedules],
+                         [(30 + i) % 60 for i in range(53, 100, 4)])
+
+    def test_claim_order_after_timeout(self):
+        timeutils.set_time_override(self.now)
+        job_1 = self._create_job()
+        timeutils.advance_time_seconds(1)
+        job_2 = self._create_job()
+
+        claimed = db_api.job_get_and_assign_next_by_action('snapshot', 'w1')
+        self.assertEqual(claimed['id'], job_1['id'])
+
+        db_api.job_update(job_1['id'],
+                          {'timeout': self.now + datetime.timedelta(
+                              seconds=2)})
+        timeutils.advance_time_seconds(2)
+        claimed = db_api.jobs_get_and_assign_next_by_action('snapshot',
+                                                            'w2', 2)
+        self.assertEqual([job['id'] for job in claimed],
+                         [job_1['id'], job_2['id']])
+        self.assertEqual(claimed[0]['retry_count'], 2)
+
+    def test_claim_skips_deleted_and_exhausted_jobs(self):
+        timeutils.set_time_override(self.now)
+        job_1 = self._create_job()
+        timeutils.advance_time_seconds(1)
+        job_2 = self._create_job(retry_count=db_api._job_get_max_retry(
+            'snapshot'))
+        timeutils.advance_time_seconds(1)
+        job_3 = self._create_job()
+        db_api.job_delete(job_1['id'])
+
+        claimed = db_api.jobs_get_and_assign_next_by_action('snapshot',
+                                                            'w1', 3)
+        self.assertEqual([job['id'] for job in claimed], [job_3['id']])
+        self.assertEqual(db_api.job_get_by_id(job_2['id'])['worker_id'],
+                         None)
+
+
+class TestSimpleConcurrentClaims(utils.BaseTestCase):
+
+    CLAIMERS = 300
+    JOBS = 1500
+
+    def setUp(self):
+        super(TestSimpleConcurrentClaims, self).setUp()
+        for i in range(self.JOBS):
+            job = db_api.job_create({'tenant_id': 'tenant-1',
+                                     'action': 'snapshot'})
+            # NOTE: Each update leaves another claim index entry behind,
+            # so concurrent claimers race for the same jobs.
+            for retry_count in (0, 0):
+                db_api.job_update(job['id'], {'retry_count': retry_count})
+        self.claims = {}
+
+    def tearDown(self):
+        super(TestSimpleConcurrentClaims, self).tearDown()
+        db_api.reset()
+
+    def _claim(self, worker_id, sleep):
+        claimed = []
+        while True:
+            jobs = db_api.jobs_get_and_assign_next_by_action(
+                'snapshot', worker_id, random.randint(1, 5))
+            if not jobs:
+                break
+            job_ids = [job['id'] for job in jobs]
+            for job_id in job_ids:
+                db_api.job_status_update(job_id, 'processing')
+            db_api.job_heartbeats_update(worker_id, job_ids,
+                                         timeutils.utcnow())
+            claimed.extend(jobs)
+            sleep(0)
+        self.claims[worker_id] = claimed
+
+    def _assert_claimed_once(self):
+        claimed_ids = []
+        for worker_id, jobs in self.claims.iteritems():
+            for job in jobs:
+                self.assertEqual(job['worker_id'], worker_id)
+                self.assertEqual(job['retry_count'], 1)
+            claimed_ids.extend(job['id'] for job in jobs)
+        self.assertEqual(len(self.claims), self.CLAIMERS)
+        self.assertEqual(len(claimed_ids), self.JOBS)
+        self.assertEqual(len(set(claimed_ids)), self.JOBS)
+        for job in db_api.job_get_all():
+            self.assertEqual(job['status'], 'processing')
+            self.assertEqual(job['retry_count'], 1)
+
+    def test_threads(self):
+        check_interval = sys.getcheckinterval()
+        # NOTE: Switch threads as often as possible to provoke races
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=self._claim,
+                                        args=('worker-%d' % i, time.sleep))
+                       for i in range(self.CLAIMERS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(check_interval)
+        self._assert_claimed_once()
+
+    def test_green_threads(self):
+        pool = eventlet.GreenPool(self.CLAIMERS)
+        for i in range(self.CLAIMERS):
+            pool.spawn_n(self._claim, 'worker-%d' % i, eventlet.sleep)
+        pool.waitall()
+        self._assert_claimed_once()
+
+
+class TestSimplePersistence(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestSimplePersistence, self).setUp()
+        self.db_dir = tempfile.mkdtemp()
+        self.config(simple_db_dir=self.db_dir)
+        db_api.configure_db()
+
+    def tearDown(self):
+        super(TestSimplePersistence, self).tearDown()
+        self._close()
+        db_api.reset()
+        shutil.rmtree(self.db_dir)
+
+    def _close(self):
+        if db_api._JOURNAL is not None:
+            db_api._JOURNAL.close()
+            db_api._JOURNAL = None
+
+    def _restart(self):
+        self._close()
+        db_api.reset()
+        db_api.configure_db()
+
+    def _populate(self):
+        schedule = db_api.schedule_create({
+            'tenant_id': 'tenant-1',
+            'action': 'snapshot',
+            'minute': 30,
+            'next_run': datetime.datetime(2012, 11, 27, 2, 30),
+            'schedule_metadata': [{'key': 'instance_id', 'value': 'inst-1'}],
+        })
+        db_api.schedule_meta_update(schedule['id'], 'instance_id',
+                                    {'value': 'inst-2'})
+        deleted = db_api.schedule_create({'tenant_id': 'tenant-1',
+                                          'action': 'snapshot'})
+        db_api.schedule_delete(deleted['id'])
+
+        jobs = [db_api.job_create({
+            'tenant_id': 'tenant-1',
+            'action': 'snapshot',
+            'job_metadata': [{'key': 'instance_id', 'value': 'inst-1'}],
+        }) for i in range(3)]
+        db_api.job_get_and_assign_next_by_action('snapshot', 'worker-1')
+        db_api.job_meta_update(jobs[1]['id'], 'instance_id',
+                               {'value': 'inst-2'})
+        db_api.job_meta_delete(jobs[2]['id'], 'instance_id')
+        db_api.job_delete(jobs[0]['id'])
+
+        worker = db_api.worker_create({'host': 'host-1'})
+        db_api.worker_create({'host': 'host-2'})
+        db_api.worker_delete(worker['id'])
+
+    def _get_all(self):
+        return (db_api.schedule_get_all(), db_api.job_get_all(),
+                db_api.worker_get_all())
+
+    def test_failed_journal_append_releases_locks(self):
+        def append(changes):
+            raise IOError('No space left on device')
+
+        self.stubs.Set(db_api._JOURNAL, 'append', append)
+        self.assertRaises(IOError, db_api.worker_create, {'host': 'host-1'})
+        self.stubs.UnsetAll()
+
+        created = []
+        thread = threading.Thread(
+            target=lambda: created.append(
+                db_api.worker_create({'host': 'host-2'})))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(created[0]['host'], 'host-2')
+
+    def test_recover_from_journal(self):
+        self._populate()
+        expected = self._get_all()
+        self._restart()
+        self.assertEqual(self._get_all(), expected)
+        self.assertEqual(db_api._JOURNAL.generation, 0)
+
+        schedules = db_api.schedule_get_all({'instance_id': 'inst-2'})
+        self.assertEqual(len(schedules), 1)
+        job = db_api.job_get_and_assign_next_by_action('snapshot',
+                                                       'worker-2')
+        self.assertEqual(job['id'], expected[1][0]['id'])
+
+    def test_recover_from_snapshot(self):
+        self.config(simple_db_snapshot_interval=5)
+        self._restart()
+        self._populate()
+        expected = self._get_all()
+        self.assertTrue(db_api._JOURNAL.generation > 0)
+        self.assertTrue(db_api._JOURNAL.records < 5)
+        self._restart()
+        self.assertEqual(self._get_all(), expected)
+        self.assertEqual(os.listdir(self.db_dir).count('snapshot'), 1)
+        self.assertEqual(
+            len([name for name in os.listdir(self.db_dir)
+                 if name.startswith('journal-')]), 1)
+
+    def test_recover_drops_torn_record(self):
+        worker = db_api.worker_create({'host': 'host-1'})
+        journal_path = os.path.join(self.db_dir, 'journal-0')
+        size = os.path.getsize(journal_path)
+        with open(journal_path, 'ab') as journal_file:
+            journal_file.write('\x00\x00\x01\x00torn')
+        self._restart()
+        self.assertEqual(os.path.getsize(journal_path), size)
+        self.assertEqual([w['id'] for w in db_api.worker_get_all()],
+                         [worker['id']])
+
+        db_api.worker_create({'host': 'host-2'})
+        self._restart()
+        self.assertEqual(len(db_api.worker_get_all()), 2)
+
+    def test_reset_is_persisted(self):
+        self._populate()
+        db_api.reset()
+        self._restart()
+        self.assertEqual(self._get_all(), ([], [], []))
+
+    def test_changes_during_snapshot(self):
+        self._populate()
+        db_api._JOURNAL.snapshot_interval = 0
+        started = db_api._start_snapshot()
+        worker = db_api.worker_create({'host': 'host-3'})
+        self.assertEqual(db_api._start_snapshot(), None)
+        db_api._JOURNAL.finish_snapshot(*started)
+        expected = self._get_all()
+        self.assertTrue(worker['id'] in [w['id'] for w in expected[2]])
+        self._restart()
+        self.assertEqual(self._get_all(), expected)
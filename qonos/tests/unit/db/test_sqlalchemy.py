@@ -1,4 +1,18 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+
+import eventlet
+import sqlalchemy
+from sqlalchemy.dialects import mysql
+from sqlalchemy.engine import reflection
+from sqlalchemy import schema
+
+from qonos.common import exception
 import qonos.db.sqlalchemy.api as db_api
+from qonos.db.sqlalchemy import models
 from qonos.tests import utils as utils
 
 
@@ -37,3 +51,453 @@ class TestSqlalchemySpecificApi(utils.BaseTestCase):
         self.assertTrue(isinstance(value[0], dict))
         self.assertEqual(value[0].get('foo'), 'bar')
         self.assertFalse('_sa_instance_state' in value[1])
+
+    def test_force_dict_model(self):
+        @db_api.force_dict
+        def return_object():
+            job = models.Job()
+            job.update({'id': 'job-1', 'action': 'snapshot',
+                        'tenant_id': 'tenant-1'})
+            meta = models.JobMetadata()
+            meta.update({'key': 'foo', 'value': 'bar'})
+            job.job_metadata.append(meta)
+            return job
+
+        value = return_object()
+        self.assertEqual(value['id'], 'job-1')
+        self.assertEqual(value['action'], 'snapshot')
+        self.assertEqual(value['worker_id'], None)
+        self.assertFalse('_sa_instance_state' in value)
+        self.assertEqual(len(value['job_metadata']), 1)
+        meta = value['job_metadata'][0]
+        self.assertEqual(meta['key'], 'foo')
+        self.assertEqual(meta['value'], 'bar')
+        self.assertFalse('parent' in meta)
+        self.assertFalse('_sa_instance_state' in meta)
+
+    def test_force_dict_model_unloaded_collection(self):
+        @db_api.force_dict
+        def return_object():
+            worker = models.Worker()
+            worker.update({'id': 'worker-1', 'host': 'foo'})
+            return [worker]
+
+        value = return_object()
+        self.assertEqual(value, [{'id': 'worker-1', 'host': 'foo',
+                                  'created_at': None, 'updated_at': None}])
+
+
+class TestSqlalchemyModels(utils.BaseTestCase):
+
+    def _get_index_names(self, engine, table_name):
+        inspector = reflection.Inspector.from_engine(engine)
+        return set(index['name']
+                   for index in inspector.get_indexes(table_name))
+
+    def test_register_models_creates_indexes(self):
+        engine = sqlalchemy.create_engine('sqlite://')
+        models.register_models(engine)
+        indexes = self._get_index_names(engine, 'jobs')
+        self.assertTrue('ix_jobs_action_created_at' in indexes)
+        indexes = self._get_index_names(engine, 'schedules')
+        self.assertTrue('ix_schedules_next_run' in indexes)
+
+    def test_schedule_metadata_key_value_index(self):
+        engine = sqlalchemy.create_engine('sqlite://')
+        models.register_models(engine)
+        inspector = reflection.Inspector.from_engine(engine)
+        indexes = dict((index['name'], index['column_names'])
+                       for index in inspector.get_indexes('schedule_metadata'))
+        self.assertEqual(indexes['ix_schedule_metadata_key_value'],
+                         ['key', 'value'])
+
+    def test_schedule_metadata_key_value_index_mysql_prefix(self):
+        table = models.ScheduleMetadata.__table__
+        index = [index for index in table.indexes
+                 if index.name == 'ix_schedule_metadata_key_value'][0]
+        ddl = str(schema.CreateIndex(index).compile(
+            dialect=mysql.dialect()))
+        self.assertTrue(ddl.endswith('(`key`, value(255))'), ddl)
+
+    def test_sync_indexes_creates_missing_indexes(self):
+        engine = sqlalchemy.create_engine('sqlite://')
+        models.register_models(engine)
+        engine.execute('DROP INDEX ix_jobs_action_created_at')
+        self.assertFalse('ix_jobs_action_created_at' in
+                         self._get_index_names(engine, 'jobs'))
+
+        models.sync_indexes(engine)
+        self.assertTrue('ix_jobs_action_created_at' in
+                        self._get_index_names(engine, 'jobs'))
+
+
+class TestSqlalchemyPool(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestSqlalchemyPool, self).setUp()
+        self.engine = sqlalchemy.create_engine(
+            'sqlite://', poolclass=db_api._MeteredQueuePool,
+            pool_size=1, max_overflow=0, pool_timeout=0.1)
+        self.stubs.Set(db_api, '_ENGINE', self.engine)
+        db_api.reset_pool_stats()
+
+    def test_pool_stats(self):
+        self.engine.connect().close()
+        conn = self.engine.connect()
+        stats = db_api.pool_stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['timeouts'], 0)
+        self.assertEqual(stats['checked_out'], 1)
+        self.assertEqual(stats['checked_out_max'], 1)
+        self.assertEqual(stats['size'], 1)
+        conn.close()
+        self.assertEqual(db_api.pool_stats()['checked_out'], 0)
+
+    def test_pool_stats_timeout(self):
+        conn = self.engine.connect()
+        self.assertRaises(sqlalchemy.exc.TimeoutError, self.engine.connect)
+        conn.close()
+        stats = db_api.pool_stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertTrue(stats['wait_max'] >= 0.1)
+        self.assertTrue(stats['wait_total'] >= stats['wait_max'])
+
+    def test_reset_pool_stats(self):
+        self.engine.connect().close()
+        db_api.reset_pool_stats()
+        self.assertEqual(db_api.pool_stats()['checkouts'], 0)
+
+
+class TestSqlalchemySessionScope(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestSqlalchemySessionScope, self).setUp()
+        self.test_dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.test_dir, 'scope.sqlite')
+        self.engine = sqlalchemy.create_engine('sqlite:///%s' % db_file)
+        models.register_models(self.engine)
+        self.stubs.Set(db_api, '_ENGINE', self.engine)
+        self.stubs.Set(db_api, '_MAKER', None)
+        self.checkouts = []
+        sqlalchemy.event.listen(self.engine, 'checkout',
+                                lambda *args: self.checkouts.append(args))
+
+    def tearDown(self):
+        super(TestSqlalchemySessionScope, self).tearDown()
+        self.engine.dispose()
+        shutil.rmtree(self.test_dir)
+
+    def _create_and_read(self):
+        worker = db_api.worker_create({'host': 'host-1'})
+        db_api.worker_get_by_id(worker['id'])
+        db_api.job_create({'action': 'snapshot', 'tenant_id': 'tenant-1',
+                           'worker_id': worker['id']})
+        return worker
+
+    def test_session_scope_uses_one_connection(self):
+        with db_api.session_scope():
+            self._create_and_read()
+        self.assertEqual(len(self.checkouts), 1)
+        self.assertEqual(len(db_api.job_get_all()), 1)
+
+    def test_session_per_call_outside_scope(self):
+        self._create_and_read()
+        self.assertTrue(len(self.checkouts) > 1)
+        self.assertFalse(db_api.get_session() is db_api.get_session())
+
+    def test_session_scope_rolls_back_on_error(self):
+        def fail():
+            with db_api.session_scope():
+                self._create_and_read()
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(db_api.worker_get_all(), [])
+        self.assertEqual(db_api.job_get_all(), [])
+
+    def test_session_scope_rolls_back_killed_green_thread(self):
+        def create():
+            with db_api.session_scope():
+                db_api.worker_create({'host': 'host-1'})
+                eventlet.sleep(5)
+
+        rollbacks = []
+        sqlalchemy.event.listen(self.engine, 'rollback', rollbacks.append)
+        thread = eventlet.spawn(create)
+        eventlet.sleep(0.1)
+        thread.kill()
+        self.assertEqual(len(rollbacks), 1)
+        self.assertEqual(db_api.worker_get_all(), [])
+
+    def test_nested_session_scope_joins_outer(self):
+        def fail():
+            with db_api.session_scope():
+                session = db_api.get_session()
+                with db_api.session_scope():
+                    self.assertTrue(db_api.get_session() is session)
+                    db_api.worker_create({'host': 'host-1'})
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(db_api.worker_get_all(), [])
+
+    def test_session_scope_with_transactional_calls(self):
+        with db_api.session_scope():
+            worker = self._create_and_read()
+            db_api.worker_delete(worker['id'])
+        self.assertEqual(db_api.worker_get_all(), [])
+
+
+class TestSqlalchemyMetadataQueries(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestSqlalchemyMetadataQueries, self).setUp()
+        self.test_dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.test_dir, 'meta.sqlite')
+        self.engine = sqlalchemy.create_engine('sqlite:///%s' % db_file)
+        models.register_models(self.engine)
+        self.stubs.Set(db_api, '_ENGINE', self.engine)
+        self.stubs.Set(db_api, '_MAKER', None)
+
+        self.schedule = db_api.schedule_create({
+            'tenant_id': 'tenant-1', 'action': 'snapshot', 'minute': 30,
+            'schedule_metadata': [{'key': 'instance_id', 'value': 'i-1'}]})
+        self.job = db_api.job_create({
+            'action': 'snapshot', 'tenant_id': 'tenant-1',
+            'job_metadata': [{'key': 'instance_id', 'value': 'i-1'}]})
+
+        self.statements = []
+        sqlalchemy.event.listen(
+            self.engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args:
+            self.statements.append(statement))
+
+    def tearDown(self):
+        super(TestSqlalchemyMetadataQueries, self).tearDown()
+        self.engine.dispose()
+        shutil.rmtree(self.test_dir)
+
+    def assertStatements(self, count, func, *args):
+        del self.statements[:]
+        result = func(*args)
+        self.assertEqual(len(self.statements), count, self.statements)
+        return result
+
+    def assertStatementsRaise(self, count, exc, func, *args):
+        del self.statements[:]
+        self.assertRaises(exc, func, *args)
+        self.assertEqual(len(self.statements), count, self.statements)
+
+    def test_schedule_meta_queries(self):
+        schedule_id = self.schedule['id']
+        meta = self.assertStatements(2, db_api.schedule_meta_create,
+                                     schedule_id,
+                                     {'key': 'foo', 'value': 'bar'})
+        self.assertEqual(meta['value'], 'bar')
+        self.assertStatements(1, db_api.schedule_meta_get_all, schedule_id)
+        meta = self.assertStatements(1, db_api.schedule_meta_get,
+                                     schedule_id, 'foo')
+        self.assertEqual(meta['value'], 'bar')
+        meta = self.assertStatements(2, db_api.schedule_meta_update,
+                                     schedule_id, 'foo', {'value': 'baz'})
+        self.assertEqual(meta['value'], 'baz')
+        self.assertStatements(1, db_api.schedule_meta_delete, schedule_id,
+                              'foo')
+
+    def test_schedule_meta_not_found_queries(self):
+        self.assertStatementsRaise(1, exception.NotFound,
+                                   db_api.schedule_meta_get,
+                                   self.schedule['id'], 'foo')
+        self.assertStatementsRaise(1, exception.NotFound,
+                                   db_api.schedule_meta_get_all, 'missing')
+        self.assertStatementsRaise(2, exception.NotFound,
+                                   db_api.schedule_meta_delete,
+                                   'missing', 'instance_id')
+
+    def test_job_meta_queries(self):
+        job_id = self.job['id']
+        self.assertStatements(1, db_api.job_meta_create, job_id,
+                              {'key': 'foo', 'value': 'bar'})
+        self.assertStatements(1, db_api.job_meta_get, job_id, 'foo')
+        meta = self.assertStatements(2, db_api.job_meta_update, job_id,
+                                     'foo', {'value': 'baz'})
+        self.assertEqual(meta['value'], 'baz')
+        self.assertStatements(1, db_api.job_meta_delete, job_id, 'foo')
+        self.assertStatementsRaise(2, exception.NotFound,
+                                   db_api.job_meta_delete, job_id, 'foo')
+
+
+class FakeDialect(object):
+
+    def __init__(self, name, server_version_info):
+        self.name = name
+        self.server_version_info = server_version_info
+
+
+class FakeEngine(object):
+
+    def __init__(self, dialect):
+        self.dialect = dialect
+
+
+class TestSqlalchemyJobClaim(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestSqlalchemyJobClaim, self).setUp()
+        self.test_dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.test_dir, 'claim.sqlite')
+        self.engine = sqlalchemy.create_engine('sqlite:///%s' % db_file)
+        models.register_models(self.engine)
+        self.stubs.Set(db_api, '_ENGINE', self.engine)
+        self.stubs.Set(db_api, '_MAKER', None)
+
+    def tearDown(self):
+        super(TestSqlalchemyJobClaim, self).tearDown()
+        self.engine.dispose()
+        shutil.rmtree(self.test_dir)
+
+    def _create_jobs(self, count):
+        created_at = datetime.datetime(2012, 11, 1)
+        jobs = []
+        for i in range(count):
+            jobs.append(db_api.job_create({'action': 'snapshot',
+                                           'tenant_id': 'tenant-1',
+                                           'created_at': created_at}))
+            created_at += datetime.timedelta(seconds=1)
+        return jobs
+
+    def _stub_dialect(self, name, server_version_info):
+        dialect = FakeDialect(name, server_version_info)
+        self.stubs.Set(db_api, '_ENGINE', FakeEngine(dialect))
+
+    def test_claim_strategy_auto_sqlite(self):
+        self.assertEqual(db_api._job_claim_strategy(), 'compare_and_swap')
+
+    def test_claim_strategy_auto_postgresql(self):
+        self._stub_dialect('postgresql', (9, 6))
+        self.assertEqual(db_api._job_claim_strategy(), 'skip_locked')
+
+    def test_claim_strategy_auto_old_postgresql(self):
+        self._stub_dialect('postgresql', (9, 4, 1))
+        self.assertEqual(db_api._job_claim_strategy(), 'compare_and_swap')
+
+    def test_claim_strategy_configured(self):
+        self._stub_dialect('postgresql', (9, 6))
+        self.config(sql_job_claim_strategy='compare_and_swap')
+        self.assertEqual(db_api._job_claim_strategy(), 'compare_and_swap')
+
+    def test_claim_strategy_invalid(self):
+        self.config(sql_job_claim_strategy='skip-locked')
+        try:
+            db_api._job_claim_strategy()
+        except exception.QonosException as e:
+            self.assertTrue("'skip-locked'" in str(e))
+        else:
+            self.fail('Expected QonosException')
+
+    def test_compare_and_swap_skips_job_assigned_after_read(self):
+        jobs = self._create_jobs(2)
+        get_candidates = db_api._job_get_claim_candidates
+
+        def fake_get_candidates(session, now, action, limit):
+            candidates = get_candidates(session, now, action, limit)
+            # Another worker takes the oldest job before this one updates
+            self.stubs.Set(db_api, '_job_get_claim_candidates',
+                           get_candidates)
+            db_api.job_get_and_assign_next_by_action(action, 'worker-2')
+            return candidates
+
+        self.stubs.Set(db_api, '_job_get_claim_candidates',
+                       fake_get_candidates)
+        job = db_api.job_get_and_assign_next_by_action('snapshot', 'worker-1')
+        self.assertEqual(job['id'], jobs[1]['id'])
+        self.assertEqual(job['worker_id'], 'worker-1')
+        self.assertEqual(job['retry_count'], 1)
+        self.assertEqual(db_api.job_get_by_id(jobs[0]['id'])['worker_id'],
+                         'worker-2')
+
+    def test_compare_and_swap_replaces_jobs_assigned_after_read(self):
+        jobs = self._create_jobs(4)
+        get_candidates = db_api._job_get_claim_candidates
+
+        def fake_get_candidates(session, now, action, limit):
+            candidates = get_candidates(session, now, action, limit)
+            # Another worker takes the oldest job before this one updates
+            self.stubs.Set(db_api, '_job_get_claim_candidates',
+                           get_candidates)
+            db_api.job_get_and_assign_next_by_action(action, 'worker-2')
+            return candidates
+
+        self.stubs.Set(db_api, '_job_get_claim_candidates',
+                       fake_get_candidates)
+        claimed = db_api.jobs_get_and_assign_next_by_action('snapshot',
+                                                            'worker-1', 2)
+        self.assertEqual([job['id'] for job in claimed],
+                         [jobs[1]['id'], jobs[2]['id']])
+        for job in claimed:
+            self.assertEqual(job['worker_id'], 'worker-1')
+            self.assertEqual(job['retry_count'], 1)
+
+    def test_compare_and_swap_same_worker_claims_disjoint_jobs(self):
+        jobs = self._create_jobs(4)
+        get_candidates = db_api._job_get_claim_candidates
+        other = []
+
+        def fake_get_candidates(session, now, action, limit):
+            candidates = get_candidates(session, now, action, limit)
+            # Another processor of this worker claims the same jobs
+            self.stubs.Set(db_api, '_job_get_claim_candidates',
+                           get_candidates)
+            other.extend(db_api.jobs_get_and_assign_next_by_action(
+                action, 'worker-1', 2))
+            return candidates
+
+        self.stubs.Set(db_api, '_job_get_claim_candidates',
+                       fake_get_candidates)
+        claimed = db_api.jobs_get_and_assign_next_by_action('snapshot',
+                                                            'worker-1', 2)
+        self.assertEqual([job['id'] for job in other],
+                         [jobs[0]['id'], jobs[1]['id']])
+        self.assertEqual([job['id'] for job in claimed],
+                         [jobs[2]['id'], jobs[3]['id']])
+        for job in claimed + other:
+            self.assertEqual(job['retry_count'], 1)
+
+    def test_concurrent_claims_assign_each_job_once(self):
+        jobs = self._create_jobs(40)
+        claimed = []
+        errors = []
+
+        def claim(worker_id):
+            try:
+                while True:
+                    jobs = db_api.jobs_get_and_assign_next_by_action(
+                        'snapshot', worker_id, 3)
+                    if not jobs:
+                        break
+                    claimed.extend(job['id'] for job in jobs)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=claim, args=('worker-%d' % i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(claimed), sorted(job['id'] for job in jobs))
+
+    def test_job_heartbeats_update_repeated_id(self):
+        self.stubs.Set(db_api, '_IN_CLAUSE_SIZE', 1)
+        jobs = self._create_jobs(2)
+        claimed = db_api.jobs_get_and_assign_next_by_action('snapshot',
+                                                            'worker-1', 2)
+        job_ids = [jobs[0]['id'], jobs[1]['id'], jobs[0]['id']]
+        updated_at = datetime.datetime(2012, 11, 16, 18, 41, 43)
+        updated = db_api.job_heartbeats_update('worker-1', job_ids,
+                                               updated_at)
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(updated, 2)
@@ -0,0 +1,50 @@
+import eventlet
+
+from qonos.qonosclient import async_client
+from qonos.qonosclient import exception
+from qonos.tests import utils as test_utils
+
+
+class TestAsyncClient(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestAsyncClient, self).setUp()
+        self.client = async_client.AsyncClient('localhost', 8080,
+                                               concurrency=2)
+        self.running = 0
+        self.max_running = 0
+
+        def fake_heartbeat(job_id):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            eventlet.sleep(0.01)
+            self.running -= 1
+            return job_id
+
+        self.stubs.Set(self.client.client, 'job_heartbeat', fake_heartbeat)
+
+    def test_mirrors_client_methods(self):
+        for name in ('list_schedules', 'create_job', 'get_next_job',
+                     'job_heartbeat', 'update_job_status'):
+            self.assertTrue(callable(getattr(self.client, name)))
+        self.assertFalse(hasattr(self.client, 'iter_jobs'))
+        self.assertFalse(hasattr(self.client, '_do_request'))
+
+    def test_results(self):
+        requests = [self.client.job_heartbeat('job-%d' % i) for i in range(5)]
+        self.assertEqual([request.wait() for request in requests],
+                         ['job-%d' % i for i in range(5)])
+
+    def test_bounded_concurrency(self):
+        for i in range(5):
+            self.client.job_heartbeat('job-%d' % i)
+        self.client.waitall()
+        self.assertEqual(self.max_running, 2)
+
+    def test_errors_raised_on_wait(self):
+        def fake_get_job(job_id):
+            raise exception.NotFound('Resource Not Found')
+
+        self.stubs.Set(self.client.client, 'get_job', fake_get_job)
+        request = self.client.get_job('job-1')
+        self.assertRaises(exception.NotFound, request.wait)
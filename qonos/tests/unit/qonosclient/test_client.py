@@ -0,0 +1,197 @@
+import httplib
+import socket
+import time
+
+from qonos.qonosclient import client
+from qonos.qonosclient import exception
+from qonos.tests import utils as test_utils
+
+
+class FakeResponse(object):
+
+    def __init__(self, status=200, body='{}', will_close=False,
+                 error=None):
+        self.status = status
+        self.body = body
+        self.will_close = will_close
+        self.error = error
+
+    def read(self):
+        if self.error is not None:
+            raise self.error
+        return self.body
+
+
+class FakeConnection(object):
+
+    created = []
+
+    def __init__(self, endpoint, port):
+        self.requests = []
+        self.responses = []
+        self.error = None
+        self.closed = False
+        self.sock = None
+        FakeConnection.created.append(self)
+
+    def request(self, method, url, body=None, headers=None):
+        if self.error is not None:
+            raise self.error
+        self.requests.append((method, url))
+
+    def getresponse(self):
+        if self.responses:
+            return self.responses.pop(0)
+        return FakeResponse()
+
+    def close(self):
+        self.closed = True
+
+
+class TestClient(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestClient, self).setUp()
+        FakeConnection.created = []
+        self.stubs.Set(httplib, 'HTTPConnection', FakeConnection)
+        self.client = client.Client('localhost', 8080)
+
+    def test_connection_reused(self):
+        self.client._do_request('GET', '/v1/workers')
+        self.client._do_request('GET', '/v1/jobs')
+        self.assertEqual(len(FakeConnection.created), 1)
+        self.assertEqual(FakeConnection.created[0].requests,
+                         [('GET', '/v1/workers'), ('GET', '/v1/jobs')])
+
+    def test_connection_closed_by_server(self):
+        self.client._do_request('GET', '/v1/workers')
+        conn = FakeConnection.created[0]
+        conn.responses.append(FakeResponse(will_close=True))
+        self.client._do_request('GET', '/v1/workers')
+        self.assertTrue(conn.closed)
+        self.client._do_request('GET', '/v1/workers')
+        self.assertEqual(len(FakeConnection.created), 2)
+
+    def test_not_found_connection_reused(self):
+        conn, new = self.client.pool.get()
+        conn.responses.append(FakeResponse(status=404, body=''))
+        self.client.pool.put(conn)
+        self.assertRaises(exception.NotFound, self.client._do_request,
+                          'GET', '/v1/workers/foo')
+        self.client._do_request('GET', '/v1/workers')
+        self.assertEqual(len(FakeConnection.created), 1)
+
+    def test_reconnect_broken_connection(self):
+        self.client._do_request('GET', '/v1/workers')
+        conn = FakeConnection.created[0]
+        conn.error = socket.error('Connection reset by peer')
+        self.client._do_request('GET', '/v1/workers')
+        self.assertTrue(conn.closed)
+        self.assertEqual(len(FakeConnection.created), 2)
+        self.assertEqual(FakeConnection.created[1].requests,
+                         [('GET', '/v1/workers')])
+
+    def test_broken_connection_post_not_retried(self):
+        self.client._do_request('GET', '/v1/workers')
+        conn = FakeConnection.created[0]
+        conn.error = socket.error('Connection reset by peer')
+        self.assertRaises(socket.error, self.client._do_request,
+                          'POST', '/v1/workers/1/jobs', {'action': 'a'})
+        self.assertTrue(conn.closed)
+        self.assertEqual(len(FakeConnection.created), 1)
+
+    def _connect_socket_pair(self, conn):
+        conn.sock, self.server_sock = socket.socketpair()
+        self.addCleanup(conn.sock.close)
+        self.addCleanup(self.server_sock.close)
+
+    def test_open_idle_connection_reused(self):
+        self.client._do_request('GET', '/v1/workers')
+        conn = FakeConnection.created[0]
+        self._connect_socket_pair(conn)
+        self.client._do_request('POST', '/v1/jobs', {'job': {}})
+        self.assertEqual(len(FakeConnection.created), 1)
+        self.assertFalse(conn.closed)
+
+    def test_idle_connection_closed_by_server_dropped(self):
+        self.client._do_request('GET', '/v1/workers')
+        conn = FakeConnection.created[0]
+        self._connect_socket_pair(conn)
+        self.server_sock.close()
+        self.client._do_request('POST', '/v1/jobs', {'job': {}})
+        self.assertTrue(conn.closed)
+        self.assertEqual(conn.requests, [('GET', '/v1/workers')])
+        self.assertEqual(len(FakeConnection.created), 2)
+        self.assertEqual(FakeConnection.created[1].requests,
+                         [('POST', '/v1/jobs')])
+
+    def test_broken_connection_retried_once_on_new_connection(self):
+        conns = [self.client.pool.get()[0] for i in range(3)]
+        for conn in conns:
+            conn.error = socket.error('Connection reset by peer')
+            self.client.pool.put(conn)
+        self.client._do_request('GET', '/v1/workers')
+        self.assertEqual(len(FakeConnection.created), 4)
+        self.assertEqual(FakeConnection.created[3].requests,
+                         [('GET', '/v1/workers')])
+        self.assertEqual([conn.closed for conn in conns],
+                         [False, False, True])
+
+    def test_broken_connection_retry_fails(self):
+        def broken_connection(endpoint, port):
+            conn = FakeConnection(endpoint, port)
+            conn.error = socket.error('Connection refused')
+            return conn
+
+        self.client._do_request('GET', '/v1/workers')
+        FakeConnection.created[0].error = socket.error('Connection reset')
+        self.stubs.Set(httplib, 'HTTPConnection', broken_connection)
+        self.assertRaises(socket.error, self.client._do_request,
+                          'GET', '/v1/workers')
+        self.assertEqual(len(FakeConnection.created), 2)
+        self.assertTrue(FakeConnection.created[1].closed)
+
+    def test_read_error_not_retried(self):
+        self.client._do_request('GET', '/v1/workers')
+        conn = FakeConnection.created[0]
+        conn.responses.append(FakeResponse(error=socket.error('reset')))
+        self.assertRaises(socket.error, self.client._do_request,
+                          'GET', '/v1/workers')
+        self.assertTrue(conn.closed)
+        self.assertEqual(len(FakeConnection.created), 1)
+
+    def test_new_connection_error_raised(self):
+        def broken_connection(endpoint, port):
+            conn = FakeConnection(endpoint, port)
+            conn.error = socket.error('Connection refused')
+            return conn
+
+        self.stubs.Set(httplib, 'HTTPConnection', broken_connection)
+        self.assertRaises(socket.error, self.client._do_request,
+                          'GET', '/v1/workers')
+        self.assertEqual(len(FakeConnection.created), 1)
+
+    def test_idle_connections_expire(self):
+        self.client = client.Client('localhost', 8080, idle_timeout=60)
+        self.client._do_request('GET', '/v1/workers')
+        now = time.time()
+        self.stubs.Set(time, 'time', lambda: now + 61)
+        self.client._do_request('GET', '/v1/workers')
+        self.assertTrue(FakeConnection.created[0].closed)
+        self.assertEqual(len(FakeConnection.created), 2)
+
+    def test_pool_size(self):
+        pool = client.ConnectionPool('localhost', 8080, size=1)
+        conns = [pool.get()[0] for i in range(2)]
+        for conn in conns:
+            pool.put(conn)
+        self.assertFalse(conns[0].closed)
+        self.assertTrue(conns[1].closed)
+        self.assertEqual(pool.get(), (conns[0], False))
+
+    def test_close(self):
+        self.client._do_request('GET', '/v1/workers')
+        self.client.close()
+        self.assertTrue(FakeConnection.created[0].closed)
+        self.client._do_request('GET', '/v1/workers')
+        self.assertEqual(len(FakeConnection.created), 2)
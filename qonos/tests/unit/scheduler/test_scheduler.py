@@ -2,6 +2,7 @@ import datetime
 import mox
 import time
 
+from qonos.common import utils
 from qonos.openstack.common import timeutils
 from qonos.scheduler import scheduler
 from qonos.tests import utils as test_utils
@@ -66,11 +67,54 @@ class TestScheduler(test_utils.BaseTestCase):
             return [{'id': unit_utils.SCHEDULE_UUID1}]
 
         self.stubs.Set(self.scheduler, 'get_schedules', fake)
-        self.client.create_job(mox.IgnoreArg())
+        self.client.create_jobs([unit_utils.SCHEDULE_UUID1]).AndReturn([])
         self.mox.ReplayAll()
         self.scheduler.enqueue_jobs()
         self.mox.VerifyAll()
 
+    def test_enqueue_jobs_in_batches(self):
+        self.config(job_create_batch_size=2, group='scheduler')
+        schedule_ids = [unit_utils.SCHEDULE_UUID1, unit_utils.SCHEDULE_UUID2,
+                        unit_utils.JOB_UUID1]
+
+        def fake(*args, **kwargs):
+            return [{'id': schedule_id} for schedule_id in schedule_ids]
+
+        self.stubs.Set(self.scheduler, 'get_schedules', fake)
+        self.client.create_jobs(schedule_ids[:2]).AndReturn([])
+        error = {'schedule_id': schedule_ids[2], 'error': 'not found'}
+        self.client.create_jobs(schedule_ids[2:]).AndReturn([error])
+        self.mox.ReplayAll()
+        self.scheduler.enqueue_jobs()
+        self.mox.VerifyAll()
+
+    def test_enqueue_jobs_claim_schedules(self):
+        self.config(claim_schedules=True, job_create_batch_size=2,
+                    group='scheduler')
+        current_run = timeutils.isotime()
+        self.client.claim_due_schedules(due_before=current_run, limit=2)\
+            .AndReturn([{'id': unit_utils.JOB_UUID1},
+                        {'id': unit_utils.JOB_UUID2}])
+        self.client.claim_due_schedules(due_before=current_run, limit=2)\
+            .AndReturn([])
+        self.mox.ReplayAll()
+        self.scheduler.enqueue_jobs(current_run=current_run)
+        self.mox.VerifyAll()
+
+    def test_enqueue_jobs_claim_schedules_after_short_batch(self):
+        self.config(claim_schedules=True, job_create_batch_size=2,
+                    group='scheduler')
+        current_run = timeutils.isotime()
+        self.client.claim_due_schedules(due_before=current_run, limit=2)\
+            .AndReturn([{'id': unit_utils.JOB_UUID1}])
+        self.client.claim_due_schedules(due_before=current_run, limit=2)\
+            .AndReturn([{'id': unit_utils.JOB_UUID2}])
+        self.client.claim_due_schedules(due_before=current_run, limit=2)\
+            .AndReturn([])
+        self.mox.ReplayAll()
+        self.scheduler.enqueue_jobs(current_run=current_run)
+        self.mox.VerifyAll()
+
     def test_get_schedules(self):
         timeutils.set_time_override()
         previous_run = timeutils.isotime()
@@ -94,3 +138,179 @@ class TestScheduler(test_utils.BaseTestCase):
         self.mox.ReplayAll()
         self.scheduler.get_schedules(current_run=current_run)
         self.mox.VerifyAll()
+
+    def test_get_schedules_sharded(self):
+        self.config(shard=1, shard_count=3, group='scheduler')
+        current_run = timeutils.isotime()
+        epoch = timeutils.isotime(datetime.datetime(1970, 1, 1))
+        filter_args = {'next_run_after': epoch,
+                       'next_run_before': current_run,
+                       'shard': 1, 'shard_count': 3}
+        self.client.list_schedules(filter_args=filter_args).AndReturn([])
+        self.mox.ReplayAll()
+        self.scheduler.get_schedules(current_run=current_run)
+        self.mox.VerifyAll()
+
+    def test_get_schedules_spread(self):
+        self.config(spread_windows=['snapshot:600'], group='scheduler')
+        self.scheduler = scheduler.Scheduler(lambda *args: self.client)
+        offsets = {}
+        schedules = []
+        for schedule_id in (unit_utils.SCHEDULE_UUID1,
+                            unit_utils.SCHEDULE_UUID2, unit_utils.JOB_UUID1):
+            offsets[schedule_id] = utils.spread_offset(schedule_id, 600)
+            schedules.append(_api_schedule(schedule_id,
+                                           '2012-11-27T02:00:00Z',
+                                           action='snapshot'))
+        offset = sorted(offsets.values())[1]
+        previous_run = datetime.datetime(2012, 11, 27, 2, 0) + \
+            datetime.timedelta(seconds=offset)
+        current_run = previous_run + datetime.timedelta(seconds=1)
+
+        next_run_after = previous_run - datetime.timedelta(seconds=600)
+        filter_args = {'next_run_after': timeutils.isotime(next_run_after),
+                       'next_run_before': timeutils.isotime(current_run)}
+        self.client.list_schedules(filter_args=filter_args)\
+            .AndReturn(schedules)
+        self.mox.ReplayAll()
+        schedules = self.scheduler.get_schedules(
+            timeutils.isotime(previous_run), timeutils.isotime(current_run))
+        self.mox.VerifyAll()
+        self.assertEqual([offsets[schedule['id']] for schedule in schedules],
+                         [offset])
+
+    def test_parse_spread_windows(self):
+        self.assertEqual(scheduler.parse_spread_windows(['a:60', 'b:c:0']),
+                         {'a': 60, 'b:c': 0})
+        for value in ('a', 'a:-1', 'a:b'):
+            self.assertRaises(ValueError, scheduler.parse_spread_windows,
+                              [value])
+
+    def test_run_in_memory_loop(self):
+        self.config(in_memory_schedules=True, group='scheduler')
+        timeutils.set_time_override(datetime.datetime(2012, 11, 27, 2, 0))
+        schedules = [
+            _api_schedule(unit_utils.SCHEDULE_UUID1, '2012-11-27T01:30:00Z',
+                          minute=30, hour=1),
+            _api_schedule(unit_utils.SCHEDULE_UUID2, '2012-11-27T03:30:00Z',
+                          minute=30, hour=3),
+        ]
+        self.client.list_schedules(filter_args={}).AndReturn(schedules)
+        self.client.create_jobs([unit_utils.SCHEDULE_UUID1]).AndReturn([])
+        self.mox.ReplayAll()
+        self.scheduler.run(run_once=True)
+        self.mox.VerifyAll()
+        timeutils.clear_time_override()
+
+    def test_load_schedules(self):
+        queue = scheduler.ScheduleQueue()
+        queue.put(_api_schedule(unit_utils.SCHEDULE_UUID2,
+                                '2012-11-27T03:30:00Z'))
+        schedules = [
+            _api_schedule(unit_utils.SCHEDULE_UUID1, '2012-11-27T01:30:00Z',
+                          updated_at='2012-11-26T00:00:02Z'),
+            _api_schedule(unit_utils.JOB_UUID1, '2012-11-27T01:30:00Z',
+                          updated_at='2012-11-26T00:00:01Z'),
+        ]
+        self.client.list_schedules(filter_args={}).AndReturn(schedules)
+        filter_args = {'updated_since': '2012-11-26T00:00:02Z'}
+        self.client.list_schedules(filter_args=filter_args).AndReturn([])
+        self.mox.ReplayAll()
+        updated_since = self.scheduler.load_schedules(queue)
+        self.assertEqual(updated_since, '2012-11-26T00:00:02Z')
+        self.assertEqual(queue.schedule_ids(),
+                         set([unit_utils.SCHEDULE_UUID1,
+                              unit_utils.JOB_UUID1]))
+
+        updated_since = self.scheduler.load_schedules(queue, updated_since)
+        self.assertEqual(updated_since, '2012-11-26T00:00:02Z')
+        self.assertEqual(len(queue), 2)
+        self.mox.VerifyAll()
+
+    def test_create_due_jobs_removes_failed(self):
+        queue = scheduler.ScheduleQueue()
+        for schedule_id in (unit_utils.SCHEDULE_UUID1,
+                            unit_utils.SCHEDULE_UUID2):
+            queue.put(_api_schedule(schedule_id, '2012-11-27T01:30:00Z'))
+        error = {'schedule_id': unit_utils.SCHEDULE_UUID2,
+                 'error': 'not found'}
+        self.client.create_jobs(mox.SameElementsAs(
+            [unit_utils.SCHEDULE_UUID1, unit_utils.SCHEDULE_UUID2]))\
+            .AndReturn([error])
+        self.mox.ReplayAll()
+        self.scheduler.create_due_jobs(
+            queue, datetime.datetime(2012, 11, 27, 2, 0))
+        self.mox.VerifyAll()
+        self.assertEqual(queue.schedule_ids(),
+                         set([unit_utils.SCHEDULE_UUID1]))
+
+
+class TestScheduleQueue(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestScheduleQueue, self).setUp()
+        self.queue = scheduler.ScheduleQueue()
+        self.queue.put(_api_schedule(unit_utils.SCHEDULE_UUID1,
+                                     '2012-11-27T02:30:00Z',
+                                     minute=30, hour=2))
+        self.queue.put(_api_schedule(unit_utils.SCHEDULE_UUID2,
+                                     '2012-11-27T03:30:00Z',
+                                     minute=30, hour=3))
+
+    def test_pop_due(self):
+        self.assertEqual(self.queue.next_run(),
+                         datetime.datetime(2012, 11, 27, 2, 30))
+        due = self.queue.pop_due(datetime.datetime(2012, 11, 27, 2, 29))
+        self.assertEqual(due, [])
+        due = self.queue.pop_due(datetime.datetime(2012, 11, 27, 2, 30))
+        self.assertEqual(due, [unit_utils.SCHEDULE_UUID1])
+        self.assertEqual(self.queue.next_run(),
+                         datetime.datetime(2012, 11, 27, 3, 30))
+        due = self.queue.pop_due(datetime.datetime(2012, 11, 27, 4, 0))
+        self.assertEqual(due, [unit_utils.SCHEDULE_UUID2])
+        self.assertEqual(self.queue.next_run(),
+                         datetime.datetime(2012, 11, 28, 2, 30))
+
+    def test_put_unchanged_keeps_next_run(self):
+        self.queue.pop_due(datetime.datetime(2012, 11, 27, 2, 30))
+        self.queue.put(_api_schedule(unit_utils.SCHEDULE_UUID1,
+                                     '2012-11-27T02:30:00Z',
+                                     minute=30, hour=2))
+        due = self.queue.pop_due(datetime.datetime(2012, 11, 27, 3, 0))
+        self.assertEqual(due, [])
+
+    def test_put_changed(self):
+        self.queue.put(_api_schedule(unit_utils.SCHEDULE_UUID1,
+                                     '2012-11-27T04:30:00Z',
+                                     minute=30, hour=4))
+        self.assertEqual(len(self.queue), 2)
+        due = self.queue.pop_due(datetime.datetime(2012, 11, 27, 4, 0))
+        self.assertEqual(due, [unit_utils.SCHEDULE_UUID2])
+
+    def test_spread(self):
+        offset = utils.spread_offset(unit_utils.SCHEDULE_UUID1, 600)
+        queue = scheduler.ScheduleQueue({'snapshot': 600})
+        queue.put(_api_schedule(unit_utils.SCHEDULE_UUID1,
+                                '2012-11-27T02:30:00Z', action='snapshot',
+                                minute=30, hour=2))
+        next_run = datetime.datetime(2012, 11, 27, 2, 30, 0)
+        spread = datetime.timedelta(seconds=offset)
+        self.assertEqual(queue.next_run(), next_run + spread)
+        due = queue.pop_due(next_run + spread)
+        self.assertEqual(due, [unit_utils.SCHEDULE_UUID1])
+        self.assertEqual(queue.next_run(),
+                         next_run + datetime.timedelta(days=1) + spread)
+
+    def test_remove(self):
+        self.queue.remove(unit_utils.SCHEDULE_UUID1)
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.next_run(),
+                         datetime.datetime(2012, 11, 27, 3, 30))
+
+
+def _api_schedule(schedule_id, next_run, updated_at='2012-11-26T00:00:00Z',
+                  **cron_fields):
+    schedule = {'id': schedule_id, 'next_run': next_run,
+                'updated_at': updated_at}
+    schedule.update(cron_fields)
+    return schedule
@@ -0,0 +1,58 @@
+import contextlib
+
+from qonos.api.v1 import api_utils
+from qonos.api.v1 import job_waiters
+from qonos.tests import utils as test_utils
+from qonos.tests.unit import utils as unit_test_utils
+
+
+class FakeDbApi(object):
+
+    def __init__(self):
+        self.scopes = []
+
+    @contextlib.contextmanager
+    def session_scope(self):
+        self.scopes.append('open')
+        yield
+        self.scopes.append('committed')
+
+
+class FakeController(object):
+
+    unscoped_actions = ('wait',)
+
+    def __init__(self, test):
+        self.test = test
+        self.db_api = FakeDbApi()
+
+    def create(self, request):
+        job_waiters.notify('snapshot')
+        self.test.assertEqual(self.test.notified, [])
+        return self.db_api.scopes[:]
+
+    def wait(self, request):
+        return self.db_api.scopes[:]
+
+
+class TestResource(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestResource, self).setUp()
+        self.notified = []
+        self.stubs.Set(job_waiters._WAITERS, 'notify', self.notified.append)
+        self.controller = FakeController(self)
+        self.resource = api_utils.Resource(self.controller)
+
+    def test_action_runs_in_session_scope(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        self.assertEqual(self.resource.execute_action('create', request),
+                         ['open'])
+        self.assertEqual(self.controller.db_api.scopes,
+                         ['open', 'committed'])
+        self.assertEqual(self.notified, ['snapshot'])
+
+    def test_unscoped_action(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        self.assertEqual(self.resource.execute_action('wait', request), [])
+        self.assertEqual(self.controller.db_api.scopes, [])
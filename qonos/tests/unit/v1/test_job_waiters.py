@@ -0,0 +1,55 @@
+import eventlet
+
+from qonos.api.v1 import job_waiters
+from qonos.tests import utils as test_utils
+
+
+class TestJobWaiters(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestJobWaiters, self).setUp()
+        self.waiters = job_waiters.JobWaiters()
+
+    def test_wait_timeout(self):
+        self.assertFalse(self.waiters.wait('snapshot', 0.01))
+
+    def test_notify_wakes_waiters(self):
+        waiting = [eventlet.spawn(self.waiters.wait, 'snapshot', 5)
+                   for i in range(3)]
+        eventlet.sleep(0)
+        self.waiters.notify('snapshot')
+        self.assertEqual([gt.wait() for gt in waiting], [True, True, True])
+
+    def test_notify_other_action(self):
+        waiting = eventlet.spawn(self.waiters.wait, 'snapshot', 0.05)
+        eventlet.sleep(0)
+        self.waiters.notify('backup')
+        self.assertFalse(waiting.wait())
+
+    def test_notify_without_waiters(self):
+        self.waiters.notify('snapshot')
+        self.assertFalse(self.waiters.wait('snapshot', 0.01))
+
+    def test_held_notify_waits_for_block_exit(self):
+        waiting = eventlet.spawn(self.waiters.wait, 'snapshot', 5)
+        eventlet.sleep(0)
+        self.stubs.Set(job_waiters, '_WAITERS', self.waiters)
+        with job_waiters.held():
+            job_waiters.notify('snapshot')
+            eventlet.sleep(0)
+            self.assertFalse(waiting.dead)
+        self.assertTrue(waiting.wait())
+
+    def test_held_notify_dropped_on_error(self):
+        notified = []
+        self.stubs.Set(self.waiters, 'notify', notified.append)
+        self.stubs.Set(job_waiters, '_WAITERS', self.waiters)
+
+        def fail():
+            with job_waiters.held():
+                job_waiters.notify('snapshot')
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        job_waiters.notify('backup')
+        self.assertEqual(notified, ['backup'])
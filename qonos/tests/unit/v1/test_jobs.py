@@ -1,6 +1,7 @@
 import uuid
 import webob.exc
 
+from qonos.api.v1 import job_waiters
 from qonos.api.v1 import jobs
 from qonos.common import exception
 import qonos.db.simple.api as db_api
@@ -80,6 +81,50 @@ class TestJobsApi(test_utils.BaseTestCase):
             self.assertEqual(set([s[k] for s in jobs]),
                              set([self.job_1[k], self.job_2[k]]))
 
+    def test_list_with_limit(self):
+        request = unit_test_utils.get_fake_request(path='/v1/jobs?limit=1',
+                                                   method='GET')
+        response = self.controller.list(request)
+        self.assertEqual(len(response['jobs']), 1)
+        links = response['jobs_links']
+        self.assertEqual(len(links), 1)
+        self.assertEqual(links[0]['rel'], 'next')
+        self.assertTrue('marker=%s' % response['jobs'][0]['id']
+                        in links[0]['href'])
+
+        path = '/v1/jobs?limit=1&marker=%s' % response['jobs'][0]['id']
+        request = unit_test_utils.get_fake_request(path=path, method='GET')
+        next_page = self.controller.list(request)
+        self.assertEqual(len(next_page['jobs']), 1)
+        self.assertNotEqual(next_page['jobs'][0]['id'],
+                            response['jobs'][0]['id'])
+
+    def test_list_last_page_has_no_links(self):
+        request = unit_test_utils.get_fake_request(path='/v1/jobs?limit=3',
+                                                   method='GET')
+        response = self.controller.list(request)
+        self.assertEqual(len(response['jobs']), 2)
+        self.assertEqual(response['jobs_links'], [])
+
+    def test_list_limit_capped(self):
+        self.config(api_limit_max=1)
+        request = unit_test_utils.get_fake_request(method='GET')
+        response = self.controller.list(request)
+        self.assertEqual(len(response['jobs']), 1)
+        self.assertEqual(len(response['jobs_links']), 1)
+
+    def test_list_bad_limit(self):
+        request = unit_test_utils.get_fake_request(path='/v1/jobs?limit=0',
+                                                   method='GET')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.list, request)
+
+    def test_list_marker_not_found(self):
+        path = '/v1/jobs?marker=%s' % uuid.uuid4()
+        request = unit_test_utils.get_fake_request(path=path, method='GET')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.list, request)
+
     def test_create(self):
         request = unit_test_utils.get_fake_request(method='POST')
         fixture = {'job': {'schedule_id': self.schedule_1['id']}}
@@ -92,6 +137,14 @@ class TestJobsApi(test_utils.BaseTestCase):
         self.assertEqual(job['status'], 'queued')
         self.assertEqual(len(job['job_metadata']), 0)
 
+    def test_create_notifies_waiters(self):
+        notified = []
+        self.stubs.Set(job_waiters, 'notify', notified.append)
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'job': {'schedule_id': self.schedule_1['id']}}
+        self.controller.create(request, fixture)
+        self.assertEqual(notified, [self.schedule_1['action']])
+
     def test_create_with_metadata(self):
         request = unit_test_utils.get_fake_request(method='POST')
         fixture = {'job': {'schedule_id': self.schedule_2['id']}}
@@ -108,6 +161,67 @@ class TestJobsApi(test_utils.BaseTestCase):
         self.assertEqual(job['job_metadata'][0]['value'],
                          self.schedule_2['schedule_metadata'][0]['value'])
 
+    def test_create_batch(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        schedule_ids = [self.schedule_1['id'], self.schedule_2['id']]
+        fixture = {'schedule_ids': schedule_ids}
+        results = self.controller.create_batch(request, fixture)['results']
+        self.assertEqual(len(results), 2)
+        for schedule, result in zip([self.schedule_1, self.schedule_2],
+                                    results):
+            self.assertEqual(result['schedule_id'], schedule['id'])
+            job = result['job']
+            self.assertIsNotNone(job.get('id'))
+            self.assertEqual(job['schedule_id'], schedule['id'])
+            self.assertEqual(job['tenant_id'], schedule['tenant_id'])
+            self.assertEqual(job['action'], schedule['action'])
+            self.assertEqual(job['status'], 'queued')
+        self.assertEqual(len(results[0]['job']['job_metadata']), 0)
+        self.assertEqual(len(results[1]['job']['job_metadata']), 1)
+        self.assertEqual(len(db_api.job_get_all()), 4)
+
+    def test_create_batch_notifies_waiters(self):
+        notified = []
+        self.stubs.Set(job_waiters, 'notify', notified.append)
+        request = unit_test_utils.get_fake_request(method='POST')
+        schedule_ids = [self.schedule_1['id'], self.schedule_2['id']]
+        fixture = {'schedule_ids': schedule_ids}
+        self.controller.create_batch(request, fixture)
+        self.assertEqual(notified, ['snapshot'])
+
+    def test_create_batch_schedule_not_found(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        schedule_id = str(uuid.uuid4())
+        fixture = {'schedule_ids': [schedule_id, self.schedule_1['id']]}
+        results = self.controller.create_batch(request, fixture)['results']
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]['schedule_id'], schedule_id)
+        self.assertFalse('job' in results[0])
+        self.assertTrue('error' in results[0])
+        self.assertEqual(results[1]['job']['schedule_id'],
+                         self.schedule_1['id'])
+        self.assertEqual(len(db_api.job_get_all()), 3)
+
+    def test_create_batch_duplicate_schedule_ids(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'schedule_ids': [self.schedule_1['id'],
+                                    self.schedule_1['id']]}
+        results = self.controller.create_batch(request, fixture)['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(db_api.job_get_all()), 3)
+
+    def test_create_batch_invalid_schedule_id(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'schedule_ids': [self.schedule_1['id'], {'id': 1}]}
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.create_batch, request, fixture)
+        self.assertEqual(len(db_api.job_get_all()), 2)
+
+    def test_create_batch_no_schedule_ids(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.create_batch, request, {})
+
     def test_get(self):
         request = unit_test_utils.get_fake_request(method='GET')
         job = self.controller.get(request, self.job_1['id']).get('job')
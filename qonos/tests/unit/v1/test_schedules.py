@@ -1,3 +1,4 @@
+from datetime import timedelta
 import uuid
 import webob.exc
 
@@ -5,6 +6,7 @@ from qonos.api.v1 import schedules
 from qonos.db.simple import api as db_api
 from qonos.common import exception
 from qonos.common import utils as qonos_utils
+from qonos.openstack.common import timeutils
 from qonos.tests import utils as test_utils
 from qonos.tests.unit import utils as unit_utils
 
@@ -58,6 +60,92 @@ class TestSchedulesApi(test_utils.BaseTestCase):
         schedules = self.controller.list(request).get('schedules')
         self.assertEqual(len(schedules), 1)
 
+    def test_list_with_limit_keeps_filters(self):
+        path = '/v1/schedules?limit=1&tenant_id=%s' % unit_utils.TENANT1
+        request = unit_utils.get_fake_request(path=path, method='GET')
+        response = self.controller.list(request)
+        self.assertEqual(len(response['schedules']), 1)
+        href = response['schedules_links'][0]['href']
+        self.assertTrue('tenant_id=%s' % unit_utils.TENANT1 in href)
+        self.assertTrue('marker=%s' % self.schedule_1['id'] in href)
+
+    def test_list_marker_not_found(self):
+        path = '/v1/schedules?marker=%s' % uuid.uuid4()
+        request = unit_utils.get_fake_request(path=path, method='GET')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.list, request)
+
+    def test_list_updated_since_filtered(self):
+        updated_since = self.schedule_2['updated_at'] + timedelta(seconds=1)
+        timeutils.set_time_override(updated_since)
+        db_api.schedule_update(self.schedule_1['id'], {'hour': 4})
+        timeutils.clear_time_override()
+
+        path = '?updated_since=%s' % timeutils.isotime(updated_since)
+        request = unit_utils.get_fake_request(path=path, method='GET')
+        schedules = self.controller.list(request)['schedules']
+        self.assertEqual(len(schedules), 1)
+        self.assertEqual(schedules[0]['id'], self.schedule_1['id'])
+
+    def test_list_shard_filtered(self):
+        path = '?shard=0&shard_count=1&tenant_id=%s' % unit_utils.TENANT1
+        request = unit_utils.get_fake_request(path=path, method='GET')
+        schedules = self.controller.list(request)['schedules']
+        self.assertEqual(len(schedules), 1)
+
+    def test_list_bad_shard(self):
+        for path in ('?shard=1&shard_count=1', '?shard=a&shard_count=2',
+                     '?shard_count=0'):
+            request = unit_utils.get_fake_request(path=path, method='GET')
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.list, request)
+
+    def test_claim_due(self):
+        due_before = self.schedule_1['next_run']
+        request = unit_utils.get_fake_request(method='POST')
+        body = {'due_before': timeutils.isotime(due_before)}
+        jobs = self.controller.claim_due(request, body)['jobs']
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['schedule_id'], self.schedule_1['id'])
+        self.assertEqual(jobs[0]['status'], 'queued')
+        schedule = db_api.schedule_get_by_id(self.schedule_1['id'])
+        self.assertTrue(schedule['next_run'] > due_before)
+
+        jobs = self.controller.claim_due(request, body)['jobs']
+        self.assertEqual(len(jobs), 0)
+
+    def test_claim_due_nothing_due(self):
+        request = unit_utils.get_fake_request(method='POST')
+        jobs = self.controller.claim_due(request, None)['jobs']
+        self.assertEqual(len(jobs), 0)
+
+    def test_claim_due_bad_time_format(self):
+        request = unit_utils.get_fake_request(method='POST')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.claim_due, request,
+                          {'due_before': 'blah'})
+
+    def test_claim_due_bad_limit(self):
+        request = unit_utils.get_fake_request(method='POST')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.claim_due, request,
+                          {'limit': 0})
+
+    def test_recompute_next_run(self):
+        start_time = self.schedule_1['next_run'] + timedelta(days=1)
+        request = unit_utils.get_fake_request(method='POST')
+        body = {'start_time': timeutils.isotime(start_time)}
+        response = self.controller.recompute_next_run(request, body)
+        self.assertEqual(response['updated'], 2)
+        schedule = db_api.schedule_get_by_id(self.schedule_1['id'])
+        self.assertTrue(schedule['next_run'] > start_time)
+
+    def test_recompute_next_run_bad_time_format(self):
+        request = unit_utils.get_fake_request(method='POST')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.recompute_next_run, request,
+                          {'start_time': 'blah'})
+
     def test_get(self):
         request = unit_utils.get_fake_request(method='GET')
         actual = self.controller.get(request,
@@ -1,9 +1,14 @@
+import time
 import uuid
+
+import eventlet
 import webob.exc
 
+from qonos.api.v1 import job_waiters
 from qonos.api.v1 import workers
 from qonos.common import exception
 import qonos.db.simple.api as db_api
+from qonos.openstack.common import timeutils
 from qonos.tests import utils as test_utils
 from qonos.tests.unit import utils as unit_test_utils
 
@@ -88,6 +93,19 @@ class TestWorkersApi(test_utils.BaseTestCase):
             self.assertEqual(set([s[k] for s in workers]),
                              set([self.worker_1[k], self.worker_2[k]]))
 
+    def test_list_with_limit(self):
+        path = '/v1/workers?limit=1'
+        request = unit_test_utils.get_fake_request(path=path, method='GET')
+        response = self.controller.list(request)
+        self.assertEqual(len(response['workers']), 1)
+        self.assertEqual(len(response['workers_links']), 1)
+
+    def test_list_marker_not_found(self):
+        path = '/v1/workers?marker=%s' % uuid.uuid4()
+        request = unit_test_utils.get_fake_request(path=path, method='GET')
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.list, request)
+
     def test_get(self):
         request = unit_test_utils.get_fake_request(method='GET')
         actual = self.controller.get(request,
@@ -130,7 +148,161 @@ class TestWorkersApi(test_utils.BaseTestCase):
     def test_get_next_job_for_action(self):
         request = unit_test_utils.get_fake_request(method='POST')
         fixture = {'action': 'snapshot'}
-        job = self.controller.get_next_job(request,
-                                           unit_test_utils.WORKER_UUID1,
-                                           fixture)
-        self.assertEqual(unit_test_utils.WORKER_UUID1, job['worker_id'])
+        jobs = self.controller.get_next_job(request,
+                                            unit_test_utils.WORKER_UUID1,
+                                            fixture)['jobs']
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(self.job_1['id'], jobs[0]['id'])
+        self.assertEqual(unit_test_utils.WORKER_UUID1, jobs[0]['worker_id'])
+
+    def _create_unassigned_jobs(self, count):
+        fixture = {
+            'schedule_id': self.schedule_1['id'],
+            'tenant_id': unit_test_utils.TENANT1,
+            'action': 'snapshot',
+        }
+        return [db_api.job_create(fixture) for i in range(count)]
+
+    def test_get_next_job_max_jobs(self):
+        self._create_unassigned_jobs(3)
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'action': 'snapshot', 'max_jobs': 3}
+        jobs = self.controller.get_next_job(request,
+                                            unit_test_utils.WORKER_UUID1,
+                                            fixture)['jobs']
+        self.assertEqual(len(jobs), 3)
+        self.assertEqual(len(set(job['id'] for job in jobs)), 3)
+        for job in jobs:
+            self.assertEqual(unit_test_utils.WORKER_UUID1, job['worker_id'])
+
+        fixture = {'action': 'snapshot', 'max_jobs': 3}
+        jobs = self.controller.get_next_job(request,
+                                            unit_test_utils.WORKER_UUID2,
+                                            fixture)['jobs']
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(unit_test_utils.WORKER_UUID2, jobs[0]['worker_id'])
+
+    def test_get_next_job_max_jobs_capped(self):
+        self.config(api_claim_max=2)
+        self._create_unassigned_jobs(3)
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'action': 'snapshot', 'max_jobs': 10}
+        jobs = self.controller.get_next_job(request,
+                                            unit_test_utils.WORKER_UUID1,
+                                            fixture)['jobs']
+        self.assertEqual(len(jobs), 2)
+
+    def test_get_next_job_invalid_max_jobs(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        for max_jobs in (0, -1, 'foo', None):
+            fixture = {'action': 'snapshot', 'max_jobs': max_jobs}
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.get_next_job, request,
+                              unit_test_utils.WORKER_UUID1, fixture)
+
+    def _claim_unassigned_jobs(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'action': 'snapshot'}
+        self.controller.get_next_job(request, unit_test_utils.WORKER_UUID2,
+                                     fixture)
+
+    def test_get_next_job_wait_woken_by_new_job(self):
+        self._claim_unassigned_jobs()
+
+        def create_job():
+            job = self._create_unassigned_jobs(1)[0]
+            job_waiters.notify(job['action'])
+            return job
+
+        creator = eventlet.spawn_after(0.01, create_job)
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'action': 'snapshot', 'wait': 5}
+        start = time.time()
+        jobs = self.controller.get_next_job(request,
+                                            unit_test_utils.WORKER_UUID1,
+                                            fixture)['jobs']
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual([job['id'] for job in jobs], [creator.wait()['id']])
+
+    def test_get_next_job_wait_polls_database(self):
+        self._claim_unassigned_jobs()
+        self.config(job_wait_poll_interval=0.01)
+        creator = eventlet.spawn_after(0.01, self._create_unassigned_jobs, 1)
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'action': 'snapshot', 'wait': 5}
+        jobs = self.controller.get_next_job(request,
+                                            unit_test_utils.WORKER_UUID1,
+                                            fixture)['jobs']
+        self.assertEqual([job['id'] for job in jobs],
+                         [creator.wait()[0]['id']])
+
+    def test_get_next_job_wait_timeout(self):
+        self._claim_unassigned_jobs()
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'action': 'snapshot', 'wait': 0.05}
+        start = time.time()
+        self.assertRaises(webob.exc.HTTPNotFound, self.controller.get_next_job,
+                          request, unit_test_utils.WORKER_UUID1, fixture)
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_get_next_job_wait_capped(self):
+        self._claim_unassigned_jobs()
+        self.config(job_wait_max=0)
+        request = unit_test_utils.get_fake_request(method='POST')
+        fixture = {'action': 'snapshot', 'wait': 60}
+        self.assertRaises(webob.exc.HTTPNotFound, self.controller.get_next_job,
+                          request, unit_test_utils.WORKER_UUID1, fixture)
+
+    def test_get_next_job_invalid_wait(self):
+        request = unit_test_utils.get_fake_request(method='POST')
+        for wait in (-1, 'foo', None):
+            fixture = {'action': 'snapshot', 'wait': wait}
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.get_next_job, request,
+                              unit_test_utils.WORKER_UUID1, fixture)
+
+    def test_update_heartbeats(self):
+        self._claim_unassigned_jobs()
+        request = unit_test_utils.get_fake_request(method='PUT')
+        fixture = {'job_ids': [self.job_1['id'], self.job_2['id']],
+                   'heartbeat': '2012-11-16T18:41:43Z'}
+        result = self.controller.update_heartbeats(
+            request, unit_test_utils.WORKER_UUID2, fixture)
+        self.assertEqual(result, {'updated': 2})
+        for job_id in (self.job_1['id'], self.job_2['id']):
+            self.assertEqual(db_api.job_updated_at_get_by_id(job_id),
+                             timeutils.parse_strtime('2012-11-16T18:41:43Z',
+                                                     '%Y-%m-%dT%H:%M:%SZ'))
+
+    def test_update_heartbeats_other_worker(self):
+        request = unit_test_utils.get_fake_request(method='PUT')
+        fixture = {'job_ids': [self.job_1['id'], self.job_2['id']]}
+        result = self.controller.update_heartbeats(
+            request, unit_test_utils.WORKER_UUID1, fixture)
+        self.assertEqual(result, {'updated': 0})
+
+    def test_update_heartbeats_default_now(self):
+        timeutils.set_time_override()
+        request = unit_test_utils.get_fake_request(method='PUT')
+        fixture = {'job_ids': [self.job_2['id']]}
+        self.controller.update_heartbeats(
+            request, unit_test_utils.WORKER_UUID2, fixture)
+        self.assertEqual(db_api.job_updated_at_get_by_id(self.job_2['id']),
+                         timeutils.utcnow())
+        timeutils.clear_time_override()
+
+    def test_update_heartbeats_invalid(self):
+        request = unit_test_utils.get_fake_request(method='PUT')
+        for fixture in ({}, {'job_ids': 'foo'},
+                        {'job_ids': [], 'heartbeat': 'foo'}):
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.update_heartbeats, request,
+                              unit_test_utils.WORKER_UUID1, fixture)
+
+    def test_update_heartbeats_invalid_job_id(self):
+        request = unit_test_utils.get_fake_request(method='PUT')
+        for job_id in ({'id': self.job_1['id']}, [self.job_1['id']], 1):
+            fixture = {'job_ids': [self.job_1['id'], job_id]}
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.update_heartbeats, request,
+                              unit_test_utils.WORKER_UUID1, fixture)
@@ -0,0 +1,244 @@
+import threading
+import time
+
+import eventlet
+
+from qonos.qonosclient import exception as client_exc
+from qonos.tests import utils as test_utils
+from qonos.worker import worker
+
+
+WORKER_ID = 'worker-1'
+
+
+class FakeClient(object):
+
+    def __init__(self, jobs=None):
+        self.jobs = list(jobs or [])
+        self.statuses = []
+        self.heartbeats = []
+        self.next_job_calls = []
+        self.deleted_workers = []
+
+    def create_worker(self, host):
+        return {'id': WORKER_ID, 'host': host}
+
+    def delete_worker(self, worker_id):
+        self.deleted_workers.append(worker_id)
+
+    def get_next_job(self, worker_id, action, max_jobs=1, wait=None):
+        self.next_job_calls.append((action, max_jobs, wait))
+        jobs = [job for job in self.jobs if job['action'] == action]
+        jobs = jobs[:max_jobs]
+        if not jobs:
+            raise client_exc.NotFound('Resource Not Found')
+        for job in jobs:
+            self.jobs.remove(job)
+        return jobs
+
+    def update_job_status(self, job_id, status):
+        self.statuses.append((job_id, status))
+
+    def job_heartbeats(self, worker_id, job_ids):
+        self.heartbeats.append((worker_id, sorted(job_ids)))
+        return len(job_ids)
+
+
+class FakeProcessor(worker.JobProcessor):
+
+    def __init__(self):
+        self.processed = []
+
+    def process_job(self, job):
+        self.processed.append(job['id'])
+
+
+class FailingProcessor(worker.JobProcessor):
+
+    def process_job(self, job):
+        raise Exception('Failed')
+
+
+class BlockingProcessor(worker.JobProcessor):
+    """Holds jobs until released, recording how many ran at once."""
+
+    def __init__(self, release):
+        self.release = release
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def process_job(self, job):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.release.wait()
+        with self.lock:
+            self.running -= 1
+
+
+def make_jobs(count, action='snapshot'):
+    return [{'id': 'job-%d' % i, 'action': action} for i in range(count)]
+
+
+class TestWorker(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestWorker, self).setUp()
+        self.client = FakeClient()
+
+    def _create_worker(self, **processors):
+        app = worker.Worker(lambda *args: self.client)
+        for action, processor in processors.iteritems():
+            app.register_processor(action, processor)
+        return app
+
+    def test_processors_from_config(self):
+        processor_path = '%s.FakeProcessor' % __name__
+        self.config(processors=['snapshot:%s' % processor_path],
+                    group='worker')
+        app = self._create_worker()
+        self.assertEqual(app.processors.keys(), ['snapshot'])
+        self.assertTrue(isinstance(app.processors['snapshot'],
+                                   FakeProcessor))
+
+    def test_run_once_processes_jobs(self):
+        self.client.jobs = make_jobs(3)
+        processor = FakeProcessor()
+        app = self._create_worker(snapshot=processor)
+        app.run(run_once=True)
+
+        self.assertEqual(sorted(processor.processed),
+                         ['job-0', 'job-1', 'job-2'])
+        for job_id in processor.processed:
+            self.assertTrue((job_id, 'processing') in self.client.statuses)
+            self.assertTrue((job_id, 'done') in self.client.statuses)
+        self.assertEqual(app.running_jobs, {})
+        self.assertEqual(self.client.deleted_workers, [WORKER_ID])
+
+    def test_run_once_claims_free_slots(self):
+        self.config(pool_size=2, job_wait=7, group='worker')
+        self.client.jobs = make_jobs(3)
+        processor = FakeProcessor()
+        app = self._create_worker(snapshot=processor)
+        app.run(run_once=True)
+
+        self.assertEqual(self.client.next_job_calls, [('snapshot', 2, 7)])
+        self.assertEqual(sorted(processor.processed), ['job-0', 'job-1'])
+
+    def test_no_wait_with_several_actions(self):
+        self.config(job_wait=7, group='worker')
+        app = self._create_worker(snapshot=FakeProcessor(),
+                                  backup=FakeProcessor())
+        app.run(run_once=True)
+        self.assertEqual(sorted(self.client.next_job_calls),
+                         [('backup', 4, 0), ('snapshot', 4, 0)])
+
+    def test_backs_off_when_api_fails(self):
+        self.config(job_wait=7, job_poll_interval=3, group='worker')
+
+        def get_next_job(*args, **kwargs):
+            raise Exception('Connection refused')
+
+        self.client.get_next_job = get_next_job
+        app = self._create_worker(snapshot=FakeProcessor())
+        app.pool = worker.create_job_pool()
+        app.running = True
+        slept = []
+        self.stubs.Set(app.pool, 'sleep', slept.append)
+        app._poll_for_next_job()
+        self.assertEqual(slept, [3])
+
+    def _poll_taking(self, seconds):
+        """Poll once with get_next_job taking seconds, returns sleeps."""
+        now = [time.time()]
+        get_next_job = self.client.get_next_job
+
+        def slow_get_next_job(*args, **kwargs):
+            now[0] += seconds
+            return get_next_job(*args, **kwargs)
+
+        self.stubs.Set(time, 'time', lambda: now[0])
+        self.client.get_next_job = slow_get_next_job
+        app = self._create_worker(snapshot=FakeProcessor())
+        app.pool = worker.create_job_pool()
+        app.running = True
+        slept = []
+        self.stubs.Set(app.pool, 'sleep', slept.append)
+        app._poll_for_next_job()
+        return slept
+
+    def test_no_back_off_after_long_poll_without_jobs(self):
+        self.config(job_wait=7, job_poll_interval=3, group='worker')
+        self.assertEqual(self._poll_taking(7), [])
+
+    def test_backs_off_when_long_poll_returns_early(self):
+        self.config(job_wait=7, job_poll_interval=3, group='worker')
+        self.assertEqual(self._poll_taking(0), [3])
+
+    def test_failed_job_status(self):
+        self.client.jobs = make_jobs(1)
+        app = self._create_worker(snapshot=FailingProcessor())
+        app.run(run_once=True)
+        self.assertEqual(self.client.statuses,
+                         [('job-0', 'processing'), ('job-0', 'error')])
+
+    def test_heartbeats_running_jobs(self):
+        self.config(heartbeat_interval=0, group='worker')
+        release = eventlet.event.Event()
+        self.client.jobs = make_jobs(2)
+        app = self._create_worker(snapshot=BlockingProcessor(release))
+        eventlet.spawn_after(0.05, release.send)
+        app.run(run_once=True)
+        self.assertTrue((WORKER_ID, ['job-0', 'job-1']) in
+                        self.client.heartbeats)
+
+    def test_green_pool_runs_jobs_concurrently(self):
+        release = eventlet.event.Event()
+        processor = BlockingProcessor(release)
+        self.client.jobs = make_jobs(6)
+        app = self._create_worker(snapshot=processor)
+        eventlet.spawn_after(0.01, release.send)
+        app.run(run_once=True)
+        self.assertEqual(processor.max_running, 4)
+
+    def test_thread_pool_runs_jobs_concurrently(self):
+        self.config(pool_type='thread', group='worker')
+        release = threading.Event()
+        processor = BlockingProcessor(release)
+        self.client.jobs = make_jobs(6)
+        app = self._create_worker(snapshot=processor)
+        threading.Timer(0.05, release.set).start()
+        app.run(run_once=True)
+        self.assertEqual(processor.max_running, 4)
+        self.assertEqual(len(self.client.statuses), 8)
+
+    def test_shutdown_drains_running_jobs(self):
+        self.config(pool_type='thread', group='worker')
+        release = threading.Event()
+        processor = BlockingProcessor(release)
+        self.client.jobs = make_jobs(2)
+        app = self._create_worker(snapshot=processor)
+
+        def poll(run_once=False):
+            for job in self.client.get_next_job(WORKER_ID, 'snapshot', 2):
+                app.running_jobs[job['id']] = job
+                app.pool.spawn(app._process_job, job)
+            app.shutdown()
+            release.set()
+
+        self.stubs.Set(app, '_poll_for_next_job', poll)
+        app.run()
+        self.assertFalse(app.running)
+        self.assertEqual(app.running_jobs, {})
+        self.assertEqual(len(self.client.statuses), 4)
+        self.assertEqual(self.client.deleted_workers, [WORKER_ID])
+
+    def test_drain_timeout(self):
+        self.config(pool_type='thread', drain_timeout=0, group='worker')
+        release = threading.Event()
+        self.client.jobs = make_jobs(1)
+        app = self._create_worker(snapshot=BlockingProcessor(release))
+        app.run(run_once=True)
+        self.assertEqual(app.running_jobs.keys(), ['job-0'])
+        release.set()
@@ -48,7 +48,7 @@ class BaseTestCase(unittest.TestCase):
         self.assertTrue(found)
 
 
-def import_test_cases(target_module, test_module, suffix=""):
+def import_test_cases(target_module, test_module, suffix="", mixin=None):
     """Adds test cases to target module.
 
     Adds all testcase classes in test_module to target_module and appends an
@@ -57,9 +57,12 @@ def import_test_cases(target_module, test_module, suffix=""):
     :param target_module: module which has an attribute set for each test case
     :param test_module: module containing test cases to copy
     :param suffix: an optional suffix to be added to each test case class name
+    :param mixin: an optional class placed before each test case class in
+                  the bases of the copy, e.g. to override setUp
 
     """
     for name, obj in inspect.getmembers(test_module):
         if inspect.isclass(obj) and issubclass(obj, BaseTestCase):
+            bases = (obj,) if mixin is None else (mixin, obj)
             setattr(target_module, name + suffix,
-                    type(name + suffix, (obj,), {}))
+                    type(name + suffix, bases, {}))
@@ -1,9 +1,15 @@
 import logging as pylog
+import socket
+import threading
 import time
 
+import eventlet
+
 from qonos.openstack.common import cfg
 from qonos.openstack.common.gettextutils import _
+from qonos.openstack.common import importutils
 import qonos.openstack.common.log as logging
+from qonos.qonosclient import exception as client_exc
 
 LOG = logging.getLogger(__name__)
 
@@ -13,16 +19,144 @@ worker_opts = [
     cfg.StrOpt('api_endpoint', default='localhost'),
     cfg.IntOpt('api_port', default=8080),
     cfg.BoolOpt('daemonized', default=False),
+    cfg.ListOpt('processors', default=[],
+                help=_('Job processors as action:module.Class entries, '
+                       'e.g. snapshot:mypackage.snapshot.SnapshotProcessor')),
+    cfg.StrOpt('pool_type', default='green',
+               help=_('Run jobs in "green" threads or in "thread"s')),
+    cfg.IntOpt('pool_size', default=4,
+               help=_('Maximum number of jobs run at once')),
+    cfg.IntOpt('job_wait', default=20,
+               help=_('Seconds the api holds a request for jobs when '
+                      'none are available and only one action is '
+                      'processed')),
+    cfg.IntOpt('heartbeat_interval', default=10,
+               help=_('Interval to send heartbeats of running jobs in '
+                      'seconds')),
+    cfg.IntOpt('drain_timeout', default=300,
+               help=_('Seconds to wait on shutdown for running jobs to '
+                      'finish')),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(worker_opts, group='worker')
 
 
+class JobProcessor(object):
+    """Runs jobs of one action. Subclasses implement process_job."""
+
+    def process_job(self, job):
+        """Run the job, raising an exception if it failed."""
+        raise NotImplementedError()
+
+
+class GreenJobPool(object):
+    """Runs a bounded number of jobs in green threads."""
+
+    def __init__(self, size):
+        self._pool = eventlet.GreenPool(size)
+
+    def free(self):
+        return self._pool.free()
+
+    def running(self):
+        return self._pool.running()
+
+    def spawn(self, func, *args):
+        self._pool.spawn_n(func, *args)
+
+    def spawn_background(self, func, *args):
+        eventlet.spawn_n(func, *args)
+
+    def sleep(self, seconds):
+        eventlet.sleep(seconds)
+
+    def wait_free(self, timeout):
+        with eventlet.Timeout(timeout, False):
+            self._pool.sem.acquire()
+            self._pool.sem.release()
+
+    def wait_all(self, timeout):
+        with eventlet.Timeout(timeout, False):
+            self._pool.waitall()
+
+
+class ThreadJobPool(object):
+    """Runs a bounded number of jobs in threads."""
+
+    def __init__(self, size):
+        self._size = size
+        self._running = 0
+        self._condition = threading.Condition()
+
+    def free(self):
+        with self._condition:
+            return self._size - self._running
+
+    def running(self):
+        with self._condition:
+            return self._running
+
+    def spawn(self, func, *args):
+        with self._condition:
+            self._running += 1
+        self.spawn_background(self._run, func, *args)
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+
+    def spawn_background(self, func, *args):
+        thread = threading.Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def _wait(self, ready, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            while not ready():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                self._condition.wait(remaining)
+
+    def wait_free(self, timeout):
+        self._wait(lambda: self._running < self._size, timeout)
+
+    def wait_all(self, timeout):
+        self._wait(lambda: self._running == 0, timeout)
+
+
+def create_job_pool():
+    if CONF.worker.pool_type == 'thread':
+        return ThreadJobPool(CONF.worker.pool_size)
+    return GreenJobPool(CONF.worker.pool_size)
+
+
 class Worker(object):
     def __init__(self, client_factory):
         self.client = client_factory(CONF.worker.api_endpoint,
                                      CONF.worker.api_port)
+        self.worker_id = None
+        self.running = False
+        self.processors = {}
+        self.running_jobs = {}
+        self.pool = None
+        for entry in CONF.worker.processors:
+            action, _sep, class_str = entry.partition(':')
+            self.register_processor(action.strip(),
+                                    importutils.import_object(
+                                        class_str.strip()))
+
+    def register_processor(self, action, processor):
+        self.processors[action] = processor
 
     def run(self, run_once=False):
         LOG.debug(_('Starting qonos worker service'))
@@ -40,20 +174,116 @@ class Worker(object):
         else:
             self._run_loop(run_once)
 
+    def shutdown(self):
+        """Stop claiming jobs; running jobs are drained by the run loop."""
+        LOG.info(_('Shutting down qonos worker service'))
+        self.running = False
+
     def _run_loop(self, run_once=False):
+        self.pool = create_job_pool()
+        self.running = True
+        self.worker_id = self.client.create_worker(socket.gethostname())['id']
+        self.pool.spawn_background(self._heartbeat_loop)
+        try:
+            while self.running:
+                self._poll_for_next_job(run_once)
 
-        while True:
-            self._poll_for_next_job(run_once)
+                if run_once:
+                    break
+        finally:
+            self.running = False
+            self._drain()
+            self.client.delete_worker(self.worker_id)
+
+    def _poll_for_next_job(self, run_once=False):
+        LOG.debug(_("Attempting to get next job from API"))
+        if not self.processors:
+            LOG.warn(_('No job processors configured'))
+            self.pool.sleep(CONF.worker.job_poll_interval)
+            return
 
-            # do work
+        if not self.pool.free():
+            self.pool.wait_free(CONF.worker.job_poll_interval)
+            return
 
-            if run_once:
+        # NOTE: Waiting on one action would delay jobs of the others.
+        wait = CONF.worker.job_wait if len(self.processors) == 1 else 0
+        found = False
+        failed = False
+        started = time.time()
+        for action in self.processors.keys():
+            free = self.pool.free()
+            if not free or not self.running:
                 break
+            jobs = self._get_next_jobs(action, free, wait)
+            if jobs is None:
+                failed = True
+                continue
+            for job in jobs:
+                found = True
+                self.running_jobs[job['id']] = job
+                self.pool.spawn(self._process_job, job)
 
-    def _poll_for_next_job(self, run_once=False):
-        LOG.debug(_("Attempting to get next job from API"))
-        while True:
-            time.sleep(CONF.worker.job_poll_interval)
+        # NOTE: A failed long poll returns at once, as does one the API
+        # cut short, so back off unless the API held it for the full wait.
+        held = wait and time.time() - started >= wait
+        if (failed or not (found or held)) and not run_once:
+            self.pool.sleep(CONF.worker.job_poll_interval)
+
+    def _get_next_jobs(self, action, max_jobs, wait):
+        """Claim jobs of action, returns None if the API call failed."""
+        try:
+            return self.client.get_next_job(self.worker_id, action,
+                                            max_jobs=max_jobs, wait=wait)
+        except client_exc.NotFound:
+            LOG.debug(_('No jobs found for action %s') % action)
+            return []
+        except Exception:
+            LOG.warn(_('Unable to get jobs for action %s') % action,
+                     exc_info=True)
+            return None
 
-            if run_once:
+    def _process_job(self, job):
+        processor = self.processors[job['action']]
+        try:
+            self._update_job_status(job, 'processing')
+            processor.process_job(job)
+        except Exception:
+            LOG.exception(_('Job %s failed') % job['id'])
+            self._update_job_status(job, 'error')
+        else:
+            self._update_job_status(job, 'done')
+        finally:
+            del self.running_jobs[job['id']]
+
+    def _update_job_status(self, job, status):
+        try:
+            self.client.update_job_status(job['id'], status)
+        except Exception:
+            LOG.exception(_('Unable to update status of job %s') % job['id'])
+
+    def _heartbeat_loop(self):
+        while True:
+            self.pool.sleep(CONF.worker.heartbeat_interval)
+            if not (self.running or self.running_jobs):
                 break
+            self._send_heartbeats()
+
+    def _send_heartbeats(self):
+        job_ids = self.running_jobs.keys()
+        if not job_ids:
+            return
+        try:
+            self.client.job_heartbeats(self.worker_id, job_ids)
+        except Exception:
+            LOG.exception(_('Unable to send heartbeats for jobs %s') %
+                          ', '.join(job_ids))
+
+    def _drain(self):
+        if self.pool.running():
+            LOG.info(_('Waiting for %d running jobs to finish') %
+                     self.pool.running())
+        self.pool.wait_all(CONF.worker.drain_timeout)
+        if self.running_jobs:
+            LOG.warn(_('Jobs still running at shutdown: %s') %
+                     ', '.join(self.running_jobs.keys()))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Measures client requests/sec against a local API with and without
+keep-alive connection pooling.
+
+Usage: tools/benchmarks/client_pool.py [number_of_requests]
+
+Starts the API in this process on the simple db driver and heartbeats a
+single job, the most frequent request workers make.
+"""
+
+import os
+import random
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.common import config
+from qonos.openstack.common import cfg
+from qonos.openstack.common import wsgi
+from qonos.qonosclient import client
+
+
+CONF = cfg.CONF
+
+
+def time_requests(api_client, job_id, count):
+    start = time.time()
+    for i in xrange(count):
+        api_client.job_heartbeat(job_id)
+    return count / (time.time() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    config.parse_args(args=[])
+    CONF.paste_deploy.config_file = os.path.join(possible_topdir, 'etc',
+                                                 'qonos-api-paste.ini')
+    port = random.randint(50000, 60000)
+    service = wsgi.Service()
+    service.start(config.load_paste_app('qonos-api'), port)
+    try:
+        setup_client = client.Client('localhost', port)
+        schedule = setup_client.create_schedule({'schedule': {
+            'tenant_id': 'tenant', 'action': 'snapshot', 'minute': '30'}})
+        job = setup_client.create_job(schedule['id'])
+
+        unpooled = client.Client('localhost', port, pool_size=0)
+        print 'new connection per request: %.0f requests/sec' % (
+            time_requests(unpooled, job['id'], count))
+
+        pooled = client.Client('localhost', port)
+        print 'pooled keep-alive:          %.0f requests/sec' % (
+            time_requests(pooled, job['id'], count))
+        pooled.close()
+    finally:
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
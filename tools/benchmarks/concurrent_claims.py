@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Measures job claim throughput as the number of concurrent workers grows.
+
+Usage: tools/benchmarks/concurrent_claims.py [jobs_per_run] [sql_connection]
+           [--sql_job_claim_strategy=STRATEGY]
+
+Each run loads a fresh set of jobs and starts workers in threads that
+claim jobs until none are left, then checks that no job was claimed
+twice. Defaults to 2000 jobs per run in a temporary SQLite file.
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.common import config
+from qonos.common import exception
+from qonos.db.sqlalchemy import api as db_api
+from qonos.db.sqlalchemy import models
+from qonos.openstack.common import cfg
+from qonos.openstack.common import uuidutils
+
+
+CONF = cfg.CONF
+WORKER_COUNTS = [1, 2, 4, 8, 16, 32]
+
+
+def load_jobs(engine, count):
+    now = datetime.datetime.utcnow()
+    rows = []
+    for i in xrange(count):
+        created_at = now - datetime.timedelta(seconds=count - i)
+        rows.append({
+            'id': uuidutils.generate_uuid(),
+            'created_at': created_at,
+            'updated_at': created_at,
+            'tenant_id': 'tenant',
+            'action': 'snapshot',
+            'retry_count': 0,
+            'timeout': now + datetime.timedelta(days=1),
+            'hard_timeout': now + datetime.timedelta(days=1),
+        })
+    engine.execute(models.Job.__table__.insert(), rows)
+
+
+def run(worker_count, job_count):
+    db_api.reset()
+    load_jobs(db_api._ENGINE, job_count)
+    claimed = []
+    errors = []
+
+    def claim(worker_id):
+        try:
+            while True:
+                job = db_api.job_get_and_assign_next_by_action('snapshot',
+                                                               worker_id)
+                claimed.append(job['id'])
+        except exception.NotFound:
+            pass
+        except Exception, e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=claim,
+                                args=(uuidutils.generate_uuid(),))
+               for i in range(worker_count)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    duplicates = len(claimed) - len(set(claimed))
+    print '%3d workers: %7.1f claims/sec, %d claimed, %d duplicates, ' \
+          '%d errors' % (worker_count, len(claimed) / elapsed, len(claimed),
+                         duplicates, len(errors))
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    options = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    job_count = int(args[0]) if args else 2000
+    db_file = None
+    if len(args) > 1:
+        sql_connection = args[1]
+    else:
+        db_file = tempfile.mktemp(suffix='.sqlite')
+        sql_connection = 'sqlite:///%s' % db_file
+
+    config.parse_args(args=options)
+    CONF.set_override('sql_connection', sql_connection)
+    db_api.configure_db()
+    print 'claim strategy: %s' % db_api._job_claim_strategy()
+    try:
+        for worker_count in WORKER_COUNTS:
+            run(worker_count, job_count)
+    finally:
+        if db_file is not None and os.path.exists(db_file):
+            os.remove(db_file)
+
+
+if __name__ == '__main__':
+    main()
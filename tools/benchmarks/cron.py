@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Compares next run computation of qonos.common.utils with croniter.
+
+Usage: tools/benchmarks/cron.py [number_of_schedules]
+
+Schedules get random daily, hourly and weekly cron fields as created
+through the API. Defaults to 10000 schedules.
+"""
+
+import datetime
+import os
+import random
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from croniter.croniter import croniter
+
+from qonos.common import utils
+
+
+def random_fields():
+    kind = random.random()
+    if kind < 0.6:
+        return (random.randrange(60), random.randrange(24), '*', '*', '*')
+    elif kind < 0.8:
+        return (random.randrange(60), '*', '*', '*', '*')
+    return (random.randrange(60), random.randrange(24), '*', '*',
+            random.randrange(7))
+
+
+def timed(label, count, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-38s %8.1fms %8.2fus each' % (label, elapsed * 1000,
+                                          elapsed * 1000000 / count)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    schedules = [random_fields() for i in xrange(count)]
+    start_time = datetime.datetime(2012, 11, 27, 2, 30)
+    end_time = start_time + datetime.timedelta(days=7)
+
+    def cron_string(fields):
+        return ' '.join(str(field) for field in fields)
+
+    timed('next run, croniter', count, lambda: [
+        croniter(cron_string(fields), start_time).get_next(
+            datetime.datetime)
+        for fields in schedules])
+    timed('next run, compiled each time', count, lambda: [
+        utils.CronExpression(*fields).next_after(start_time)
+        for fields in schedules])
+    utils.compile_cron(*schedules[0])
+    timed('next run, compile_cron', count, lambda: [
+        utils.compile_cron(*fields).next_after(start_time)
+        for fields in schedules])
+
+    def croniter_next_n():
+        for fields in schedules:
+            cron = croniter(cron_string(fields), start_time)
+            [cron.get_next(datetime.datetime) for i in xrange(10)]
+
+    timed('next 10 runs, croniter', count, croniter_next_n)
+    timed('next 10 runs, compile_cron', count, lambda: [
+        utils.compile_cron(*fields).next_n(start_time, 10)
+        for fields in schedules])
+
+    def croniter_window():
+        for fields in schedules:
+            cron = croniter(cron_string(fields), start_time)
+            while cron.get_next(datetime.datetime) <= end_time:
+                pass
+
+    timed('runs within a week, croniter', count, croniter_window)
+    timed('runs within a week, compile_cron', count, lambda: [
+        utils.compile_cron(*fields).fire_times(start_time, end_time)
+        for fields in schedules])
+
+
+if __name__ == '__main__':
+    main()
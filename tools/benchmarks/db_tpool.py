@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Measures how long other green threads of an API process are held up
+while db api calls run, with and without sql_use_tpool.
+
+Usage: tools/benchmarks/db_tpool.py [number_of_schedules] [sql_connection]
+
+Four green threads list every schedule, as a slow query would, while a
+fifth wakes up every 10ms like a cheap heartbeat request. Prints the
+longest time the cheap thread waited past its wake up and the time taken
+by the listings. Defaults to 20000 schedules in a temporary SQLite file.
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import eventlet
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.common import config
+import qonos.db
+from qonos.db.sqlalchemy import api as sqlalchemy_api
+from qonos.db.sqlalchemy import models
+from qonos.openstack.common import cfg
+from qonos.openstack.common import uuidutils
+
+
+CONF = cfg.CONF
+INSERT_CHUNK = 10000
+LISTINGS = 4
+TICK = 0.01
+
+
+def load_schedules(engine, count):
+    now = datetime.datetime.utcnow()
+    table = models.Schedule.__table__
+    for offset in xrange(0, count, INSERT_CHUNK):
+        rows = [{'id': uuidutils.generate_uuid(),
+                 'created_at': now,
+                 'updated_at': now,
+                 'tenant_id': 'tenant-%d' % (i % 1000),
+                 'action': 'snapshot',
+                 'minute': i % 60,
+                 'next_run': now}
+                for i in xrange(offset, min(offset + INSERT_CHUNK, count))]
+        engine.execute(table.insert(), rows)
+
+
+def run(db_api):
+    delays = []
+    done = []
+
+    def tick():
+        while len(done) < LISTINGS:
+            start = time.time()
+            eventlet.sleep(TICK)
+            delays.append(time.time() - start - TICK)
+
+    def listing():
+        db_api.schedule_get_all()
+        done.append(True)
+
+    start = time.time()
+    ticker = eventlet.spawn(tick)
+    listings = [eventlet.spawn(listing) for i in xrange(LISTINGS)]
+    [thread.wait() for thread in listings]
+    ticker.wait()
+    return max(delays), time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    db_file = None
+    if len(sys.argv) > 2:
+        sql_connection = sys.argv[2]
+    else:
+        db_file = tempfile.mktemp(suffix='.sqlite')
+        sql_connection = 'sqlite:///%s' % db_file
+
+    config.parse_args(args=[])
+    CONF.set_override('sql_connection', sql_connection)
+    CONF.set_override('db_api', 'qonos.db.sqlalchemy.api')
+    sqlalchemy_api.configure_db()
+    try:
+        sqlalchemy_api.reset()
+        load_schedules(sqlalchemy_api._ENGINE, count)
+
+        for use_tpool in (False, True):
+            CONF.set_override('sql_use_tpool', use_tpool)
+            delay, elapsed = run(qonos.db.get_api())
+            print '%-14s heartbeat held up %.3fs at most, ' \
+                  'listings took %.1fs' % (
+                      'tpool' if use_tpool else 'green thread',
+                      delay, elapsed)
+    finally:
+        if db_file is not None and os.path.exists(db_file):
+            os.remove(db_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Measures job claim latency on a large jobs table with and without the
+indexes declared in qonos.db.sqlalchemy.models.
+
+Usage: tools/benchmarks/job_claim.py [number_of_jobs] [sql_connection]
+
+Jobs are spread over ten actions and one in five is eligible to be
+claimed. Defaults to one million jobs in a temporary SQLite file.
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.common import config
+from qonos.db.sqlalchemy import api as db_api
+from qonos.db.sqlalchemy import models
+from qonos.openstack.common import cfg
+from qonos.openstack.common import uuidutils
+
+
+CONF = cfg.CONF
+ACTIONS = ['action-%d' % i for i in range(10)]
+CLAIMS = 200
+INSERT_CHUNK = 10000
+
+
+def load_jobs(engine, count):
+    now = datetime.datetime.utcnow()
+    start = now - datetime.timedelta(seconds=count)
+    table = models.Job.__table__
+    for offset in xrange(0, count, INSERT_CHUNK):
+        rows = []
+        for i in xrange(offset, min(offset + INSERT_CHUNK, count)):
+            eligible = random.random() < 0.2
+            created_at = start + datetime.timedelta(seconds=i)
+            rows.append({
+                'id': uuidutils.generate_uuid(),
+                'created_at': created_at,
+                'updated_at': created_at,
+                'tenant_id': 'tenant',
+                'action': random.choice(ACTIONS),
+                'worker_id': None if eligible else 'worker',
+                'retry_count': 0,
+                'timeout': now + datetime.timedelta(days=1),
+                'hard_timeout': now + datetime.timedelta(days=1),
+            })
+        engine.execute(table.insert(), rows)
+
+
+def drop_indexes(engine):
+    for table in models.BASE.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(engine)
+
+
+def time_claims():
+    timings = []
+    for i in xrange(CLAIMS):
+        start = time.time()
+        db_api.job_get_and_assign_next_by_action(random.choice(ACTIONS),
+                                                 'benchmark-worker')
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings[len(timings) / 2], sum(timings) / len(timings)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    db_file = None
+    if len(sys.argv) > 2:
+        sql_connection = sys.argv[2]
+    else:
+        db_file = tempfile.mktemp(suffix='.sqlite')
+        sql_connection = 'sqlite:///%s' % db_file
+
+    config.parse_args(args=[])
+    CONF.set_override('sql_connection', sql_connection)
+    # NOTE: the claims must all be eligible for the whole run
+    db_api.JOB_TYPES['default']['timeout_seconds'] = 24 * 3600
+    db_api.configure_db()
+    try:
+        db_api.reset()
+        drop_indexes(db_api._ENGINE)
+        load_start = time.time()
+        load_jobs(db_api._ENGINE, count)
+        print 'loaded %d jobs in %.1fs' % (count, time.time() - load_start)
+
+        median, mean = time_claims()
+        print 'without indexes: median %.2fms mean %.2fms' % (
+            median * 1000, mean * 1000)
+        models.sync_indexes(db_api._ENGINE)
+        median, mean = time_claims()
+        print 'with indexes:    median %.2fms mean %.2fms' % (
+            median * 1000, mean * 1000)
+    finally:
+        if db_file is not None and os.path.exists(db_file):
+            os.remove(db_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Compares recomputing next_run of every schedule one row at a time with
+qonos.db.sqlalchemy.api.schedules_recompute_next_run.
+
+Usage: tools/benchmarks/recompute_next_run.py [number_of_schedules]
+                                              [sql_connection]
+
+Schedules get random daily, hourly and weekly cron fields as created
+through the API. Defaults to one million schedules in a temporary
+SQLite file.
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.common import config
+from qonos.common import utils
+from qonos.db.sqlalchemy import api as db_api
+from qonos.db.sqlalchemy import models
+from qonos.openstack.common import cfg
+from qonos.openstack.common import uuidutils
+
+
+CONF = cfg.CONF
+INSERT_CHUNK = 10000
+CRON_COLUMNS = ('minute', 'hour', 'day_of_month', 'month', 'day_of_week')
+
+
+def random_fields():
+    kind = random.random()
+    if kind < 0.6:
+        return (random.randrange(60), random.randrange(24), None, None, None)
+    elif kind < 0.8:
+        return (random.randrange(60), None, None, None, None)
+    return (random.randrange(60), random.randrange(24), None, None,
+            random.randrange(7))
+
+
+def load_schedules(engine, count):
+    now = datetime.datetime.utcnow()
+    table = models.Schedule.__table__
+    for offset in xrange(0, count, INSERT_CHUNK):
+        rows = []
+        for i in xrange(offset, min(offset + INSERT_CHUNK, count)):
+            row = dict(zip(CRON_COLUMNS, random_fields()))
+            row.update({
+                'id': uuidutils.generate_uuid(),
+                'created_at': now,
+                'updated_at': now,
+                'tenant_id': 'tenant-%d' % (i % 1000),
+                'action': 'snapshot',
+                'next_run': now,
+            })
+            rows.append(row)
+        engine.execute(table.insert(), rows)
+
+
+def recompute_each(engine, start_time):
+    """Recompute and update every schedule on its own, as a loop over
+    schedule_update would."""
+    table = models.Schedule.__table__
+    columns = [table.c.id] + [table.c[name] for name in CRON_COLUMNS]
+    rows = engine.execute(db_api.sa_sql.select(columns)).fetchall()
+    connection = engine.connect()
+    transaction = connection.begin()
+    for row in rows:
+        fields = tuple(row)[1:]
+        next_run = utils.cron_string_to_next_datetime(
+            *[utils._cron_field(field) for field in fields],
+            start_time=start_time)
+        connection.execute(table.update()
+                                .where(table.c.id == row['id'])
+                                .values(next_run=next_run))
+    transaction.commit()
+    connection.close()
+    return len(rows)
+
+
+def timed(label, func):
+    start = time.time()
+    updated = func()
+    print '%-24s %8.1fs for %d schedules' % (label, time.time() - start,
+                                             updated)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    db_file = None
+    if len(sys.argv) > 2:
+        sql_connection = sys.argv[2]
+    else:
+        db_file = tempfile.mktemp(suffix='.sqlite')
+        sql_connection = 'sqlite:///%s' % db_file
+
+    config.parse_args(args=[])
+    CONF.set_override('sql_connection', sql_connection)
+    db_api.configure_db()
+    try:
+        db_api.reset()
+        load_start = time.time()
+        load_schedules(db_api._ENGINE, count)
+        print 'loaded %d schedules in %.1fs' % (count,
+                                                time.time() - load_start)
+
+        start_time = datetime.datetime(2012, 11, 27, 2, 30)
+        timed('one row at a time', lambda: recompute_each(db_api._ENGINE,
+                                                          start_time))
+        timed('grouped by cron fields',
+              lambda: db_api.schedules_recompute_next_run(start_time))
+    finally:
+        if db_file is not None and os.path.exists(db_file):
+            os.remove(db_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Measures how late the scheduler creates jobs when listing schedules by
+time window and with in_memory_schedules.
+
+Usage: tools/benchmarks/scheduler_latency.py [number_of_schedules]
+                                             [seconds]
+
+Schedules come due at random seconds during the first ten seconds of
+the run by default. The scheduler talks to the simple db backend through
+an in-process client instead of the API. Defaults to 1000 schedules.
+"""
+
+import datetime
+import os
+import random
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.common import config
+from qonos.common import utils
+from qonos.db.simple import api as db_api
+from qonos.openstack.common import cfg
+from qonos.openstack.common import timeutils
+from qonos.scheduler import scheduler
+
+
+CONF = cfg.CONF
+
+
+class Finished(Exception):
+    pass
+
+
+class InProcessClient(object):
+    def __init__(self, end):
+        self.end = end
+        self.latencies = []
+        self.listed = 0
+
+    def list_schedules(self, filter_args={}):
+        if time.time() > self.end:
+            raise Finished()
+        filter_args = dict(filter_args)
+        for key, value in filter_args.items():
+            filter_args[key] = timeutils.normalize_time(
+                timeutils.parse_isotime(value))
+        schedules = db_api.schedule_get_all(filter_args=filter_args)
+        self.listed += len(schedules)
+        for schedule in schedules:
+            utils.serialize_datetimes(schedule)
+        return schedules
+
+    def create_jobs(self, schedule_ids):
+        now = timeutils.utcnow()
+        for schedule in db_api.schedule_get_by_ids(schedule_ids):
+            self.latencies.append(
+                (now - schedule['next_run']).total_seconds())
+        return []
+
+
+def run(count, seconds):
+    db_api.reset()
+    # NOTE: The API serializes times in whole seconds.
+    start = timeutils.utcnow().replace(microsecond=0)
+    for i in xrange(count):
+        due_in = datetime.timedelta(seconds=random.randint(1, seconds))
+        db_api.schedule_create({'tenant_id': 'tenant', 'action': 'snapshot',
+                                'minute': 0, 'hour': 0,
+                                'next_run': start + due_in})
+
+    # Leave the time window scheduler one more poll after the last run
+    client = InProcessClient(time.time() + seconds +
+                             CONF.scheduler.job_schedule_interval + 1)
+    try:
+        scheduler.Scheduler(lambda *args: client).run()
+    except Finished:
+        pass
+    latencies = sorted(client.latencies)
+    return latencies, client.listed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    config.parse_args(args=[])
+
+    for in_memory in (False, True):
+        CONF.set_override('in_memory_schedules', in_memory, 'scheduler')
+        latencies, listed = run(count, seconds)
+        print '%-22s %d jobs, late by median %.3fs max %.3fs, ' \
+              '%d schedules listed' % (
+                  'in memory' if in_memory else 'time window',
+                  len(latencies), latencies[len(latencies) / 2],
+                  latencies[-1], listed)
+
+
+if __name__ == '__main__':
+    main()
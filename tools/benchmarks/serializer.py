@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Compares the compiled model serializer used by force_dict with the
+reflection based conversion it replaced.
+
+Usage: tools/benchmarks/serializer.py [number_of_jobs]
+"""
+
+import gc
+import os
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+import sqlalchemy.orm as sa_orm
+
+from qonos.common import config
+from qonos.db.sqlalchemy import api as db_api
+from qonos.db.sqlalchemy import models
+from qonos.openstack.common import cfg
+
+
+CONF = cfg.CONF
+
+
+def legacy_convert(object):
+    """The conversion force_dict performed before serializers existed."""
+    to_return = dict(object)
+    if 'parent' in to_return:
+        del to_return['parent']
+    if '_sa_instance_state' in to_return:
+        del to_return['_sa_instance_state']
+    for key in to_return:
+        if isinstance(to_return[key], list):
+            to_return[key] = [legacy_convert(o) for o in to_return[key]]
+        elif isinstance(to_return[key], models.ModelBase):
+            to_return[key] = legacy_convert(to_return[key])
+    return to_return
+
+
+def load_jobs(count):
+    jobs_values = []
+    for i in xrange(count):
+        jobs_values.append({
+            'tenant_id': 'tenant-%d' % (i % 100),
+            'action': 'snapshot',
+            'schedule_id': 'schedule-%d' % i,
+            'status': 'queued',
+            'job_metadata': [{'key': 'instance_id',
+                              'value': 'instance-%d' % i}],
+        })
+    db_api.job_create_many(jobs_values)
+
+
+def query_jobs():
+    session = db_api.get_session()
+    return session.query(models.Job)\
+                  .options(sa_orm.subqueryload('job_metadata'))\
+                  .all()
+
+
+def timed(convert, jobs):
+    # NOTE: Like timeit, keep the cyclic collector from walking the loaded
+    # ORM objects while the conversion is being measured.
+    gc.disable()
+    try:
+        start = time.time()
+        result = [convert(job) for job in jobs]
+        return time.time() - start, result
+    finally:
+        gc.enable()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    config.parse_args(args=[])
+    CONF.set_override('sql_connection', 'sqlite://')
+    db_api.configure_db()
+    load_jobs(count)
+
+    legacy_time, legacy = timed(legacy_convert, query_jobs())
+    compiled_time, compiled = timed(models.Job.serialize, query_jobs())
+    assert legacy == compiled
+
+    print 'jobs converted:      %d' % count
+    print 'reflection (legacy): %.3fs' % legacy_time
+    print 'compiled serializer: %.3fs' % compiled_time
+    print 'speedup:             %.1fx' % (legacy_time / compiled_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Measures the in-memory simple db backend with many schedules and jobs.
+
+Usage: tools/benchmarks/simple_db.py [number_of_objects]
+
+Creates that many schedules spread over a hundred tenants and as many
+jobs spread over ten actions, then times filtered schedule listings,
+due schedule lookups and job claims. Defaults to 100000 of each.
+"""
+
+import datetime
+import os
+import random
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.db.simple import api as db_api
+
+
+ACTIONS = ['action-%d' % i for i in range(10)]
+TENANTS = ['tenant-%d' % i for i in range(100)]
+ITERATIONS = 200
+
+
+def load(count):
+    now = datetime.datetime.utcnow()
+    db_api.JOB_TYPES['default']['timeout_seconds'] = 24 * 3600
+    for i in xrange(count):
+        db_api.schedule_create({
+            'tenant_id': random.choice(TENANTS),
+            'action': 'snapshot',
+            'minute': i % 60,
+            'next_run': now + datetime.timedelta(minutes=i % 1440),
+            'schedule_metadata': [{'key': 'instance_id',
+                                   'value': 'instance-%d' % i}],
+        })
+        db_api.job_create({
+            'tenant_id': random.choice(TENANTS),
+            'action': random.choice(ACTIONS),
+        })
+    return now
+
+
+def timed(func):
+    timings = []
+    for i in xrange(ITERATIONS):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings[len(timings) / 2] * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    start = time.time()
+    now = load(count)
+    print 'loaded %d schedules and jobs in %.1fs' % (count,
+                                                     time.time() - start)
+
+    print 'list by tenant, limit 100: median %.2fms' % timed(
+        lambda: db_api.schedule_get_all({'tenant_id': random.choice(TENANTS),
+                                         'limit': 100}))
+    print 'list by instance:          median %.2fms' % timed(
+        lambda: db_api.schedule_get_all(
+            {'instance_id': 'instance-%d' % random.randrange(count)}))
+    print 'list next minute:          median %.2fms' % timed(
+        lambda: db_api.schedule_get_all(
+            {'next_run_after': now,
+             'next_run_before': now + datetime.timedelta(minutes=1)}))
+    print 'claim a job:               median %.2fms' % timed(
+        lambda: db_api.jobs_get_and_assign_next_by_action(
+            random.choice(ACTIONS), 'benchmark-worker', 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Measures journaling overhead and recovery time of the simple db backend.
+
+Usage: tools/benchmarks/simple_db_recovery.py [number_of_jobs] [fsync]
+
+Creates that many jobs with journaling enabled in a temporary directory,
+then times recovery from the journal alone, writing a snapshot and
+recovery from the snapshot. Pass "fsync" to sync the journal after
+every change. Defaults to one million jobs.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.common import config
+from qonos.db.simple import api as db_api
+from qonos.openstack.common import cfg
+
+
+CONF = cfg.CONF
+ACTIONS = ['action-%d' % i for i in range(10)]
+
+
+def restart():
+    db_api._JOURNAL.close()
+    db_api._JOURNAL = None
+    db_api.reset()
+    start = time.time()
+    db_api.configure_db()
+    return time.time() - start
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path)) / (1024.0 * 1024)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    db_dir = tempfile.mkdtemp()
+
+    config.parse_args(args=[])
+    CONF.set_override('simple_db_dir', db_dir)
+    CONF.set_override('simple_db_snapshot_interval', count + 1)
+    CONF.set_override('simple_db_fsync', sys.argv[2:3] == ['fsync'])
+    try:
+        db_api.configure_db()
+        start = time.time()
+        for i in xrange(count):
+            db_api.job_create({'tenant_id': 'tenant',
+                               'action': ACTIONS[i % len(ACTIONS)]})
+        elapsed = time.time() - start
+        print 'created %d jobs in %.1fs (%.0f/s), journal %.0fMB' % (
+            count, elapsed, count / elapsed, directory_size(db_dir))
+
+        print 'recovered from journal in %.1fs' % restart()
+
+        db_api._JOURNAL.snapshot_interval = 0
+        start = time.time()
+        started = db_api._start_snapshot()
+        locked = time.time() - start
+        db_api._JOURNAL.finish_snapshot(*started)
+        print 'wrote snapshot in %.1fs holding the locks %.1fs, %.0fMB' % (
+            time.time() - start, locked, directory_size(db_dir))
+
+        print 'recovered from snapshot in %.1fs' % restart()
+        assert len(db_api.DATA['jobs']) == count
+    finally:
+        shutil.rmtree(db_dir)
+
+
+if __name__ == '__main__':
+    main()
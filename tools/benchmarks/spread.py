@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Shows how spread windows and shards split the jobs of schedules that are
+all due at the top of the hour.
+
+Usage: tools/benchmarks/spread.py [number_of_schedules] [window_seconds]
+                                  [shard_count]
+
+Prints the most jobs created in one second without and with the spread
+window, and the schedules each shard handles. Defaults to 100000
+schedules, a 300 second window and 4 shards.
+"""
+
+import collections
+import os
+import sys
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'qonos', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from qonos.common import utils
+from qonos.openstack.common import uuidutils
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    shard_count = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    schedule_ids = [uuidutils.generate_uuid() for i in xrange(count)]
+
+    per_second = collections.Counter(
+        utils.spread_offset(schedule_id, window)
+        for schedule_id in schedule_ids)
+    print 'jobs in the busiest second: %d without spread, %d over %ds' % (
+        count, max(per_second.values()), window)
+
+    ranges = [utils.shard_id_range(shard, shard_count)
+              for shard in range(shard_count)]
+    per_shard = [sum(1 for schedule_id in schedule_ids
+                     if (lower is None or schedule_id >= lower) and
+                     (upper is None or schedule_id < upper))
+                 for lower, upper in ranges]
+    print 'schedules per shard: %s' % ', '.join(map(str, per_shard))
+
+
+if __name__ == '__main__':
+    main()